@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+"""
+Measures the gap filling of DatasetDB2HDF5 against the previous per row implementation (strptime of every row and
+one list append per second, kept here as legacy_gap_fill), on every time-series of a large synthetic database. Both
+must produce identical arrays.
+
+usage: python3 -m Benchmark.BenchmarkDB2HDF5 [--database dataset.db] [--rows 1000000] [--series 100]
+                                             [FeedGenerator options]
+"""
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+from Benchmark import FeedGenerator
+from Dataset.DatasetConverter import DatasetConverter
+from Dataset.DatasetDatabase import DatasetDatabase, DATE_FORMAT
+from Dataset.DatasetDB2HDF5 import DatasetDB2HDF5
+
+__author__ = 'gm'
+
+
+def legacy_gap_fill(rows: list, first_datetime: dt.datetime, last_datetime: dt.datetime) -> np.ndarray:
+    """
+    the gap filling of DatasetDB2HDF5 before fill_gaps
+
+    :param rows: [(date, time, data1, data2), ...] of DatasetDatabase.get_time_series
+    """
+    gap_filled_ts = []
+    first_datetime_of_ts = dt.datetime.strptime(rows[0][0] + "-" + rows[0][1], DATE_FORMAT)
+    last_datetime_of_ts = dt.datetime.strptime(rows[-1][0] + "-" + rows[-1][1], DATE_FORMAT)
+    if first_datetime_of_ts != first_datetime:
+        delta = first_datetime_of_ts - first_datetime
+        for i in range(delta.days * 86400 + delta.seconds):
+            gap_filled_ts.append(rows[0][2])
+    prev_datetime = None
+    prev_data = None
+    for date, time_, cur_data, data2 in rows:
+        cur_datetime = dt.datetime.strptime(date + "-" + time_, DATE_FORMAT)
+        if prev_datetime is not None:
+            delta = cur_datetime - prev_datetime
+            for i in range(delta.days * 86400 + delta.seconds - 1):
+                gap_filled_ts.append(prev_data)
+        gap_filled_ts.append(cur_data)
+        prev_datetime = cur_datetime
+        prev_data = cur_data
+    if last_datetime_of_ts != last_datetime:
+        delta = last_datetime - last_datetime_of_ts
+        for i in range(delta.days * 86400 + delta.seconds):
+            gap_filled_ts.append(rows[-1][2])
+    return np.array(gap_filled_ts, dtype='float32')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gap filling of DatasetDB2HDF5")
+    parser.add_argument("--database", default=None,
+                        help="an existing database to convert, by default one is generated")
+    parser.add_argument("--rows", type=int, default=1000000,
+                        help="the number of lines of the generated dataset")
+    FeedGenerator.add_arguments(parser)
+    parser.set_defaults(series=100, tick_rate=0.5)
+    parser.add_argument("--tmp", default=None,
+                        help="the folder for the generated files, default is a new temporary folder")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(dir=args.tmp)
+    try:
+        database = args.database
+        if database is None:
+            dataset = os.path.join(folder, "dataset.txt")
+            database = os.path.join(folder, "dataset.db")
+            begin = time.time()
+            FeedGenerator.from_arguments(args).write(dataset, args.rows)
+            with contextlib.redirect_stdout(io.StringIO()):
+                DatasetConverter(dataset, database).convert()
+            os.remove(dataset)
+            print("generated %d lines of %d time-series in %.1f s" % (args.rows, args.series, time.time() - begin))
+
+        db = DatasetDatabase(database).connect()
+        names = db.get_distinct_names()
+        first_datetime = dt.datetime.strptime(db.get_first_datetime(None), DATE_FORMAT)
+        last_datetime = dt.datetime.strptime(db.get_last_datetime(None), DATE_FORMAT)
+        start_end_timestamps = db.get_start_end_timestamps().values()
+        first_timestamp = min(first for first, last in start_end_timestamps)
+        last_timestamp = max(last for first, last in start_end_timestamps)
+
+        legacy_seconds = 0.0
+        vectorized_seconds = 0.0
+        points = 0
+        for name in names:
+            begin = time.time()
+            legacy = legacy_gap_fill(db.get_time_series(name).fetchall(), first_datetime, last_datetime)
+            legacy_seconds += time.time() - begin
+
+            begin = time.time()
+            timestamps, data1, data2 = db.get_time_series_arrays(name)
+            vectorized = DatasetDB2HDF5.fill_gaps(timestamps, data1, first_timestamp, last_timestamp)
+            vectorized_seconds += time.time() - begin
+
+            assert np.array_equal(legacy, vectorized)
+            points += len(vectorized)
+        db.disconnect()
+
+        begin = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            DatasetDB2HDF5(database, os.path.join(folder, "dataset.h5")).convert()
+        convert_seconds = time.time() - begin
+    finally:
+        shutil.rmtree(folder)
+
+    print(json.dumps({"series": len(names),
+                      "points_written": points,
+                      "legacy_seconds": legacy_seconds,
+                      "vectorized_seconds": vectorized_seconds,
+                      "speedup": legacy_seconds / vectorized_seconds,
+                      "convert_seconds": convert_seconds}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+"""
+Measures the HDF5 codecs and chunk sizes of DatasetH5Writer: for every layout, codec and chunk size a copy of a hdf5
+dataset is written, then read in full through DatasetH5 as the correlation algorithms do. The file size against the
+read throughput (of the uncompressed float32 points) shows which codec fits a deployment. The reads are served by
+the page cache, so they measure the decompression, not the disk.
+
+usage: python3 -m Benchmark.BenchmarkH5Codecs [--hdf5 dataset.h5] [--rows 1000000] [--codecs none lzf gzip]
+                                              [--chunk-sizes 64 1024] [--layouts series matrix] [FeedGenerator options]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from Benchmark import FeedGenerator
+from Dataset.DatasetH5 import DatasetH5, DatasetH5Writer, CODECS, LAYOUTS, READ_BLOCK_SIZE, hdf5plugin
+from Dataset.DatasetText2HDF5 import DatasetText2HDF5
+
+__author__ = 'gm'
+
+
+def copy(source: str, target: str, layout: str, codec: str, level, chunk_size):
+    """
+    write the time series of the hdf5 dataset source to target
+    """
+    with DatasetH5(source, mode='r') as h5:
+        with DatasetH5Writer(target, h5.ts_names, len(h5[0]), layout=layout, compression_level=level,
+                             attrs=h5.point_attributes(), codec=codec, chunk_size=chunk_size) as writer:
+            for i, name in enumerate(h5.ts_names):
+                writer.write(name, h5[i][:])
+
+
+def read_all(path: str) -> int:
+    """
+    read every time series of the hdf5 dataset in path
+
+    :return: the bytes of the points read
+    """
+    size = 0
+    with DatasetH5(path, mode='r') as h5:
+        if h5.matrix is not None:
+            for start in range(0, len(h5), READ_BLOCK_SIZE):
+                size += h5.read_block(range(start, min(start + READ_BLOCK_SIZE, len(h5)))).nbytes
+        else:
+            for i in range(len(h5)):
+                size += h5.read(i).nbytes
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="file size and read throughput of the HDF5 codecs")
+    parser.add_argument("--hdf5", default=None,
+                        help="an existing hdf5 dataset, by default one is generated")
+    parser.add_argument("--rows", type=int, default=1000000,
+                        help="the number of lines of the generated dataset")
+    FeedGenerator.add_arguments(parser)
+    parser.set_defaults(series=100)
+    parser.add_argument("--codecs", nargs="+", choices=CODECS,
+                        default=[c for c in CODECS if c != "blosc-lz4" or hdf5plugin is not None],
+                        help="the codecs to measure, default is all available")
+    parser.add_argument("--level", type=int, default=None,
+                        help="the compression level of gzip and blosc-lz4, default is the codec's")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[0, 64, 1024],
+                        help="the chunk sizes to measure in KiB, 0 is the default of DatasetH5Writer")
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=LAYOUTS,
+                        help="the layouts to measure")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="every file is read repeat times, the fastest read is reported")
+    parser.add_argument("--tmp", default=None,
+                        help="the folder for the generated files, default is a new temporary folder")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(dir=args.tmp)
+    results = []
+    try:
+        source = args.hdf5
+        if source is None:
+            dataset = os.path.join(folder, "dataset.txt")
+            source = os.path.join(folder, "dataset.h5")
+            begin = time.time()
+            FeedGenerator.from_arguments(args).write(dataset, args.rows)
+            with contextlib.redirect_stdout(io.StringIO()):
+                DatasetText2HDF5(dataset, source).convert()
+            os.remove(dataset)
+            print("generated %d lines of %d time-series in %.1f s" % (args.rows, args.series, time.time() - begin))
+
+        for layout in args.layouts:
+            for codec in args.codecs:
+                for chunk_size in args.chunk_sizes:
+                    target = os.path.join(folder, "copy.h5")
+                    begin = time.time()
+                    copy(source, target, layout, codec, args.level, chunk_size * 1024 or None)
+                    write_seconds = time.time() - begin
+                    read_seconds = None
+                    for i in range(args.repeat):
+                        begin = time.time()
+                        points_size = read_all(target)
+                        dur = time.time() - begin
+                        if read_seconds is None or dur < read_seconds:
+                            read_seconds = dur
+                    result = {"layout": layout,
+                              "codec": codec,
+                              "chunk_kib": chunk_size or None,
+                              "file_mb": os.path.getsize(target) / 1024 / 1024,
+                              "ratio": points_size / os.path.getsize(target),
+                              "write_seconds": write_seconds,
+                              "read_seconds": read_seconds,
+                              "read_mb_per_s": points_size / 1024 / 1024 / read_seconds}
+                    os.remove(target)
+                    results.append(result)
+                    print(json.dumps(result))
+    finally:
+        shutil.rmtree(folder)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+"""
+Measures the throughput and the peak memory of every ingestion stage:
+ - reader:    DatasetReader parses the dataset
+ - converter: DatasetConverter converts the dataset to a sqlite database
+ - store:     DatasetDatabase.store_rows writes the rows of the dataset (prepared in memory beforehand), committing
+              every write
+ - bulk:      the same as store, within DatasetDatabase.bulk_load
+ - db2h5:     DatasetDB2HDF5 converts the sqlite database of the converter stage to a hdf5 database
+ - text2h5:   DatasetText2HDF5 converts the dataset straight to a hdf5 database
+
+Every stage runs in a new process, so its peak RSS is its own: peak_rss_MB is that of the stage process and
+peak_children_rss_MB that of its largest child process (with --jobs > 1 the converter and db2h5 stages work in a
+pool). The peak of the children is only known above that of the processes run before the stage (importing h5py runs
+one), it is null if no child of the stage exceeded it. The store and bulk stages prepare the rows in memory before
+the measured write, their peak_rss_MB includes those rows and prepared_rss_MB is the peak when the write starts.
+The results are printed as JSON.
+
+usage: python3 -m Benchmark.BenchmarkIngestion dataset.txt [--stages reader converter] [--jobs 4]
+       python3 -m Benchmark.BenchmarkIngestion --generate 100000000 [FeedGenerator options] [--tmp /data/tmp]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from Benchmark import FeedGenerator
+from Dataset.DatasetAggregator import DatasetAggregator
+from Dataset.DatasetConverter import DatasetConverter
+from Dataset.DatasetDatabase import DatasetDatabase
+from Dataset.DatasetDB2HDF5 import DatasetDB2HDF5
+from Dataset.DatasetReader import DatasetReader
+from Dataset.DatasetText2HDF5 import DatasetText2HDF5
+
+__author__ = 'gm'
+
+STAGES = ["reader", "converter", "store", "bulk", "db2h5", "text2h5"]
+
+
+def run_reader(args) -> tuple:
+    """
+    :return: (rows, input bytes) of the stage
+    """
+    reader = DatasetReader(args.dataset_file, chunk_size=args.chunk_size)
+    reader.open_dataset()
+    rows = 0
+    for chunk in iter(reader.get_next_chunk, None):
+        rows += len(chunk)
+    reader.close_dataset()
+    return rows, os.path.getsize(args.dataset_file)
+
+
+def run_converter(args) -> tuple:
+    dc = DatasetConverter(args.dataset_file, args.database_file, jobs=args.jobs, chunk_size=args.chunk_size)
+    dc.convert()
+    return count_lines(args.dataset_file), os.path.getsize(args.dataset_file)
+
+
+def run_store(args, bulk=False) -> tuple:
+    # the rows are prepared as DatasetConverter does, only writing them is measured
+    reader = DatasetReader(args.dataset_file, chunk_size=args.chunk_size)
+    reader.open_dataset()
+    aggregator = DatasetAggregator()
+    rows = []
+    for chunk in iter(reader.get_next_chunk, None):
+        rows.append(aggregator.process(chunk))
+    rows.append(aggregator.flush())
+    db = DatasetDatabase(args.database_file)
+    db.connect()
+    series_ids = db.get_series_ids(reader.names)
+    db.commit()
+    multi_data = []
+    for r in rows:
+        multi_data.extend(zip([series_ids[i] for i in r.name_ids.tolist()], r.ticks.tolist(), r.timestamps.tolist(),
+                              r.data1.tolist(), r.data2.tolist()))
+    reader.close_dataset()
+
+    prepared_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    begin = time.time()
+    if bulk:
+        with db.bulk_load():
+            for i in range(0, len(multi_data), args.write_buffer_size):
+                db.store_rows(multi_data[i:i + args.write_buffer_size])
+    else:
+        for i in range(0, len(multi_data), args.write_buffer_size):
+            db.store_rows(multi_data[i:i + args.write_buffer_size])
+    db.disconnect()
+    return len(multi_data), os.path.getsize(args.database_file), time.time() - begin, prepared_rss
+
+
+def run_bulk(args) -> tuple:
+    return run_store(args, bulk=True)
+
+
+def run_db2h5(args) -> tuple:
+    DatasetDB2HDF5(args.database_file, args.hdf5_file).convert(jobs=args.jobs)
+    return count_rows(args.database_file), os.path.getsize(args.database_file)
+
+
+def run_text2h5(args) -> tuple:
+    DatasetText2HDF5(args.dataset_file, args.hdf5_file, chunk_size=args.chunk_size).convert()
+    return count_lines(args.dataset_file), os.path.getsize(args.dataset_file)
+
+
+def count_rows(database_file: str) -> int:
+    db = DatasetDatabase(database_file)
+    db.connect()
+    rows = db.execute_query("SELECT count(*) FROM dataset").fetchone()[0]
+    db.disconnect()
+    return rows
+
+
+def count_lines(dataset_file: str) -> int:
+    lines = 0
+    with open(dataset_file, "rb") as f:
+        for block in iter(lambda: f.read(16 * 1024 * 1024), b""):
+            lines += block.count(b"\n")
+    return lines
+
+
+def run_stage(args):
+    """
+    run one stage in this process and print its result as JSON. rows are the lines of the dataset for the stages that
+    read it and the rows of the database for store, bulk and db2h5
+    """
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    begin = time.time()
+    result = globals()["run_" + args.stage](args)
+    dur = time.time() - begin
+    rows, input_bytes = result[0], result[1]
+    prepared_rss = None
+    if len(result) > 2:
+        # the stage measured only part of its work, after preparing its input in memory
+        dur, prepared_rss = result[2], result[3] / 1024
+    stats = {"stage": args.stage,
+             "rows": rows,
+             "input_bytes": input_bytes,
+             "seconds": dur,
+             "rows_per_s": rows / dur,
+             "MB_per_s": input_bytes / dur / 1000000,
+             "peak_rss_MB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+             "peak_children_rss_MB": None}
+    if resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss > children_rss:
+        stats["peak_children_rss_MB"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    if prepared_rss is not None:
+        stats["prepared_rss_MB"] = prepared_rss
+    print(json.dumps(stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="throughput and peak memory of the ingestion stages")
+    parser.add_argument("dataset_file", nargs="?", default=None,
+                        help="the dataset to ingest, omit it to generate one with --generate")
+    parser.add_argument("--generate", type=int, default=None,
+                        help="generate a dataset of this many lines with Benchmark.FeedGenerator")
+    FeedGenerator.add_arguments(parser)
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES,
+                        help="the stages to measure, db2h5 needs converter")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="the number of processes of the converter and db2h5 stages")
+    parser.add_argument("--chunk-size", type=int, default=100000000,
+                        help="the chunk size of DatasetReader in bytes")
+    parser.add_argument("--write-buffer-size", type=int, default=100000,
+                        help="the number of rows per store_rows call of the store stage")
+    parser.add_argument("--tmp", default=None,
+                        help="the folder for the generated files, default is a new temporary folder")
+    parser.add_argument("--stage", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--database-file", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--hdf5-file", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage is not None:
+        run_stage(args)
+        return
+
+    if "db2h5" in args.stages and "converter" not in args.stages:
+        parser.error("stage db2h5 needs stage converter")
+    if (args.dataset_file is None) == (args.generate is None):
+        parser.error("give either a dataset file or --generate")
+
+    folder = tempfile.mkdtemp(dir=args.tmp)
+    results = []
+    try:
+        dataset_file = args.dataset_file
+        if dataset_file is None:
+            dataset_file = os.path.join(folder, "dataset.txt")
+            begin = time.time()
+            FeedGenerator.from_arguments(args).write(dataset_file, args.generate)
+            print("generated %d lines in %.1f s" % (args.generate, time.time() - begin))
+
+        for stage in [s for s in STAGES if s in args.stages]:
+            database_file = os.path.join(folder, stage + ".db" if stage in ["store", "bulk"] else "dataset.db")
+            command = [sys.executable, "-m", "Benchmark.BenchmarkIngestion", dataset_file, "--stage", stage,
+                       "--jobs", str(args.jobs), "--chunk-size", str(args.chunk_size),
+                       "--write-buffer-size", str(args.write_buffer_size), "--database-file", database_file,
+                       "--hdf5-file", os.path.join(folder, stage + ".h5")]
+            output = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout.decode("utf-8")
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        shutil.rmtree(folder)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
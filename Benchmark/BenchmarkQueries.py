@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+"""
+Measures the per time-series metadata queries of DatasetDatabase (used by the dates, calc and db2h5 subcommands),
+answered by the catalog, on a large synthetic database. They are compared to the same results computed from the data
+with one query per time-series and with a single GROUP BY query.
+
+usage: python3 -m Benchmark.BenchmarkQueries [--database dataset.db] [--rows 10000000] [--series 5000]
+                                             [FeedGenerator options]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from Benchmark import FeedGenerator
+from Dataset.DatasetConverter import DatasetConverter
+from Dataset.DatasetDatabase import DatasetDatabase
+
+__author__ = 'gm'
+
+
+def per_series_start_end_timestamps(db: DatasetDatabase) -> dict:
+    query = "SELECT min(ts), max(ts) FROM dataset WHERE series_id=(SELECT id FROM series WHERE name=?)"
+    return dict((name, db.conn.execute(query, (name,)).fetchone()) for name in db.get_distinct_names())
+
+
+def per_series_num_points(db: DatasetDatabase) -> dict:
+    query = "SELECT count(*) FROM dataset WHERE series_id=(SELECT id FROM series WHERE name=?)"
+    return dict((name, db.conn.execute(query, (name,)).fetchone()[0]) for name in db.get_distinct_names())
+
+
+def group_by_start_end_timestamps(db: DatasetDatabase) -> dict:
+    c = db.conn.execute("SELECT name, min(ts), max(ts) FROM dataset JOIN series ON series_id=series.id "
+                        "GROUP BY series_id")
+    return dict((name, (first, last)) for name, first, last in c)
+
+
+def group_by_num_points(db: DatasetDatabase) -> dict:
+    c = db.conn.execute("SELECT name, count(*) FROM dataset JOIN series ON series_id=series.id GROUP BY series_id")
+    return dict(c.fetchall())
+
+
+def measure(function) -> float:
+    """
+    :return: the duration of function() in seconds, its output is discarded
+    """
+    begin = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function()
+    return time.time() - begin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per time-series metadata queries of DatasetDatabase")
+    parser.add_argument("--database", default=None,
+                        help="an existing database to query, by default one is generated")
+    parser.add_argument("--rows", type=int, default=10000000,
+                        help="the number of lines of the generated dataset")
+    FeedGenerator.add_arguments(parser)
+    parser.set_defaults(series=5000)
+    parser.add_argument("--tmp", default=None,
+                        help="the folder for the generated files, default is a new temporary folder")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(dir=args.tmp)
+    try:
+        database = args.database
+        if database is None:
+            dataset = os.path.join(folder, "dataset.txt")
+            database = os.path.join(folder, "dataset.db")
+            begin = time.time()
+            FeedGenerator.from_arguments(args).write(dataset, args.rows)
+            with contextlib.redirect_stdout(io.StringIO()):
+                DatasetConverter(dataset, database).convert()
+            os.remove(dataset)
+            print("generated %d lines of %d time-series in %.1f s" % (args.rows, args.series, time.time() - begin))
+
+        db = DatasetDatabase(database).connect()
+        assert group_by_start_end_timestamps(db) == db.get_start_end_timestamps()
+        assert group_by_num_points(db) == db.get_num_points_of_all()
+        results = {
+            "series": len(db.get_distinct_names()),
+            "rows": sum(db.get_num_points_of_all().values()),
+            "get_start_end_timestamps": measure(db.get_start_end_timestamps),
+            "per_series_start_end_timestamps": measure(lambda: per_series_start_end_timestamps(db)),
+            "group_by_start_end_timestamps": measure(lambda: group_by_start_end_timestamps(db)),
+            "get_num_points_of_all": measure(db.get_num_points_of_all),
+            "per_series_num_points": measure(lambda: per_series_num_points(db)),
+            "group_by_num_points": measure(lambda: group_by_num_points(db)),
+            "get_start_end_points": measure(db.get_start_end_points),
+            "get_distinct_names_threshold": measure(lambda: db.get_distinct_names(point_threshold="%5")),
+            "print_min_date_times": measure(db.print_min_date_times),
+            "print_max_date_times": measure(db.print_max_date_times),
+        }
+        db.disconnect()
+    finally:
+        shutil.rmtree(folder)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
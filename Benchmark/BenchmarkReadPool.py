@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+"""
+Stress test of DatasetDatabasePool: N threads, or N processes, stream every time-series of a WAL mode database in
+parallel, each through its own read-only connection, while a writer commits new rows. The read throughput for every
+N shows how the readers scale with the cores; the rows read are checked against a serial read.
+
+usage: python3 -m Benchmark.BenchmarkReadPool [--database dataset.db] [--rows 10000000] [--series 1000]
+                                              [--workers 1 2 4 8] [--writer] [FeedGenerator options]
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from Benchmark import FeedGenerator
+from Dataset.DatasetConverter import DatasetConverter
+from Dataset.DatasetDatabase import DatasetDatabase, DatasetDatabasePool
+
+__author__ = 'gm'
+
+BATCH_SIZE = 10000
+
+pool = None  # the pool of the worker processes, see init_worker
+
+
+def init_worker(database: str):
+    global pool
+    pool = DatasetDatabasePool(database, mmap_size=1 << 30)
+
+
+def read_series(name: str) -> tuple:
+    """
+    stream the time-series name through the connection of the calling thread
+
+    :return: (rows, checksum of the rows)
+    """
+    c = pool.get().get_time_series(name)
+    rows = 0
+    checksum = 0
+    for batch in iter(lambda: c.fetchmany(BATCH_SIZE), []):
+        rows += len(batch)
+        checksum = zlib.crc32(repr(batch).encode("utf-8"), checksum)
+    return rows, checksum
+
+
+def write_rows(database: str, stop: threading.Event) -> int:
+    """
+    commit new rows of a new time-series, one second of data at a time, until stop is set
+
+    :return: the number of rows written
+    """
+    db = DatasetDatabase(database).connect()
+    series_id = db.get_series_ids(["BenchmarkReadPool·writer"])[0]
+    tick = 0
+    while not stop.is_set():
+        db.store_rows([(series_id, tick, tick, 1.0, 1.0)])
+        tick += 1
+    db.disconnect()
+    return tick
+
+
+def measure(database: str, names: list, workers: int, processes: bool, writer: bool) -> dict:
+    """
+    read every time-series of names with workers threads or processes
+
+    :return: the result of the run, with the checksum of every time-series
+    """
+    global pool
+    stop = threading.Event()
+    writer_thread = None
+    written = []
+    if writer:
+        writer_thread = threading.Thread(target=lambda: written.append(write_rows(database, stop)))
+        writer_thread.start()
+
+    begin = time.time()
+    if processes:
+        executor = concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker, initargs=(database,))
+    else:
+        init_worker(database)
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+    with executor:
+        results = list(executor.map(read_series, names))
+    dur = time.time() - begin
+    if not processes:
+        pool.close()
+
+    if writer:
+        stop.set()
+        writer_thread.join()
+    rows = sum(r[0] for r in results)
+    return {"workers": workers,
+            "processes": processes,
+            "rows": rows,
+            "seconds": dur,
+            "rows_per_s": rows / dur,
+            "rows_written": written[0] if written else 0,
+            "checksums": [r[1] for r in results]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parallel readers of DatasetDatabasePool")
+    parser.add_argument("--database", default=None,
+                        help="an existing database to read, it is switched to WAL mode. By default one is generated")
+    parser.add_argument("--rows", type=int, default=10000000,
+                        help="the number of lines of the generated dataset")
+    FeedGenerator.add_arguments(parser)
+    parser.set_defaults(series=1000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="the numbers of parallel readers to measure")
+    parser.add_argument("--writer", action="store_true", default=False,
+                        help="commit new rows while reading")
+    parser.add_argument("--tmp", default=None,
+                        help="the folder for the generated files, default is a new temporary folder")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(dir=args.tmp)
+    results = []
+    try:
+        database = args.database
+        if database is None:
+            dataset = os.path.join(folder, "dataset.txt")
+            database = os.path.join(folder, "dataset.db")
+            begin = time.time()
+            FeedGenerator.from_arguments(args).write(dataset, args.rows)
+            with contextlib.redirect_stdout(io.StringIO()):
+                DatasetConverter(dataset, database).convert()
+            os.remove(dataset)
+            print("generated %d lines of %d time-series in %.1f s" % (args.rows, args.series, time.time() - begin))
+
+        db = DatasetDatabase(database).connect()
+        db.execute_query("PRAGMA journal_mode=WAL")
+        names = db.get_distinct_names()
+        db.disconnect()
+
+        checksums = None
+        for processes in [False, True]:
+            for workers in args.workers:
+                result = measure(database, names, workers, processes, args.writer)
+                if checksums is None:
+                    checksums = result["checksums"]
+                # every reader sees the same rows, whatever the writer commits meanwhile
+                assert result.pop("checksums") == checksums
+                results.append(result)
+                print(json.dumps(result))
+    finally:
+        shutil.rmtree(folder)
+
+    print(json.dumps({"cpus": os.cpu_count(), "results": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+"""
+Measures the throughput of DatasetReader for every input kind: memory mapped plain text and the streaming
+decompressors (gzip, bz2, xz and zstd if module zstandard is installed).
+
+usage: python3 -m Benchmark.BenchmarkReader dataset.txt [--kinds plain gzip zstd] [--chunk-size 100000000]
+"""
+import argparse
+import bz2
+import gzip
+import json
+import lzma
+import os
+import shutil
+import tempfile
+import time
+from Dataset.DatasetReader import DatasetReader
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__author__ = 'gm'
+
+EXTENSIONS = {"plain": "", "gzip": ".gz", "bz2": ".bz2", "xz": ".xz", "zstd": ".zst"}
+
+
+def compress(source: str, target: str, kind: str):
+    """
+    write a compressed copy of source to target
+    """
+    with open(source, "rb") as f_in:
+        if kind == "plain":
+            f_out = open(target, "wb")
+        elif kind == "gzip":
+            f_out = gzip.open(target, "wb", compresslevel=6)
+        elif kind == "bz2":
+            f_out = bz2.open(target, "wb")
+        elif kind == "xz":
+            f_out = lzma.open(target, "wb")
+        else:
+            f_out = zstandard.ZstdCompressor().stream_writer(open(target, "wb"))
+        with f_out:
+            shutil.copyfileobj(f_in, f_out, 16 * 1024 * 1024)
+
+
+def read_all(path: str, chunk_size: int) -> int:
+    """
+    parse every chunk of the dataset in path
+
+    :return: the number of rows read
+    """
+    reader = DatasetReader(path, chunk_size=chunk_size)
+    reader.open_dataset()
+    rows = 0
+    for chunk in iter(reader.get_next_chunk, None):
+        rows += len(chunk)
+    reader.close_dataset()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DatasetReader throughput for every input kind")
+    parser.add_argument("dataset_file",
+                        help="an uncompressed dataset, compressed copies are created in a temporary folder")
+    parser.add_argument("--kinds", nargs="+", default=["plain", "gzip", "bz2", "xz", "zstd"],
+                        choices=sorted(EXTENSIONS.keys()),
+                        help="the input kinds to measure")
+    parser.add_argument("--chunk-size", type=int, default=100000000,
+                        help="the chunk size of DatasetReader in bytes")
+    parser.add_argument("--tmp", default=None,
+                        help="the folder for the compressed copies, default is a new temporary folder")
+    args = parser.parse_args()
+
+    size = os.path.getsize(args.dataset_file)
+    folder = tempfile.mkdtemp(dir=args.tmp)
+    results = []
+    try:
+        for kind in args.kinds:
+            if kind == "zstd" and zstandard is None:
+                print("skipping zstd, module zstandard is not installed")
+                continue
+            path = os.path.join(folder, "dataset.txt" + EXTENSIONS[kind])
+            if kind == "plain":
+                path = args.dataset_file
+            else:
+                compress(args.dataset_file, path, kind)
+            begin = time.time()
+            rows = read_all(path, args.chunk_size)
+            dur = time.time() - begin
+            results.append({"kind": kind,
+                            "file_bytes": os.path.getsize(path),
+                            "rows": rows,
+                            "seconds": dur,
+                            "rows_per_s": rows / dur,
+                            "MB_per_s": size / dur / 1000000})
+    finally:
+        shutil.rmtree(folder)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
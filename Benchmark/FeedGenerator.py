@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+"""
+Generates synthetic datasets in the format of the original dataset, one tick per line:
+name,MM/DD/YYYY,HH:MM:SS,data1,data2
+
+usage: python3 -m Benchmark.FeedGenerator feed.txt --rows 100000000 [--series 1000] [--tick-rate 0.5]
+                                                    [--duplicate-rate 0.2] [--gap-rate 0.001]
+                                                    [--gap-distribution pareto] [--gap-mean 600] [--seed 0]
+"""
+import argparse
+import datetime as dt
+import numpy as np
+from Dataset.DatasetReader import EPOCH, timestamps_to_date_time
+
+__author__ = 'gm'
+
+GAP_DISTRIBUTIONS = ["none", "uniform", "exponential", "pareto"]
+
+
+class FeedGenerator:
+    """
+    Every time-series is a random walk that moves forward in time on its own clock. The lines of all time-series are
+    interleaved in date-time order (within every block of block_size lines), like the ticks of a live feed.
+
+    The step of a time-series' clock from one line to the next is:
+     - 0 seconds with probability duplicate_rate, ie. a line with the same date-time, that are averaged on ingestion
+     - otherwise a geometric number of seconds with success probability tick_rate (tick_rate = 1: every second has a
+       tick, tick_rate = 0.1: every 10 seconds on average), plus, with probability gap_rate, a gap of gap_mean seconds
+       on average drawn from gap_distribution
+    """
+
+    def __init__(self, series=100, tick_rate=1.0, duplicate_rate=0.1, gap_rate=0.0, gap_distribution="exponential",
+                 gap_mean=60.0, start="07/08/2015-00:00:00", seed=0, block_size=1000000):
+        """
+        :param series: the number of time-series
+        :param tick_rate: the probability that a second of a time-series has a tick, in (0, 1]
+        :param duplicate_rate: the probability that a line has the same date-time as the previous line of its
+                               time-series, in [0, 1)
+        :param gap_rate: the probability that a new date-time of a time-series follows a gap
+        :param gap_distribution: one of GAP_DISTRIBUTIONS
+        :param gap_mean: the mean length of the gaps in seconds
+        :param start: the date-time of the first tick of every time-series, '%m/%d/%Y-%H:%M:%S'
+        :param seed: the seed of the random generator, the same parameters and seed generate the same feed
+        :param block_size: lines are generated and written block_size at a time
+        """
+        assert series > 0
+        assert 0 < tick_rate <= 1
+        assert 0 <= duplicate_rate < 1
+        assert 0 <= gap_rate <= 1
+        assert gap_distribution in GAP_DISTRIBUTIONS
+        self.series = series
+        self.tick_rate = tick_rate
+        self.duplicate_rate = duplicate_rate
+        self.gap_rate = gap_rate
+        self.gap_distribution = gap_distribution
+        self.gap_mean = gap_mean
+        self.block_size = block_size
+        self.rng = np.random.RandomState(seed)
+        self.names = ["Synthetic·S%05d·NoExpiry" % i for i in range(series)]
+
+        start_ts = int((dt.datetime.strptime(start, "%m/%d/%Y-%H:%M:%S") - EPOCH).total_seconds())
+        # the state of every time-series: its current date-time and value
+        self.clock = np.full(series, start_ts, dtype=np.int64)
+        self.value = self.rng.uniform(1, 1000, series)
+        self.started = np.zeros(series, dtype=bool)
+
+    def _gaps(self, n: int) -> np.ndarray:
+        """
+        :return: n gap lengths in seconds
+        """
+        if self.gap_distribution == "none":
+            return np.zeros(n, dtype=np.int64)
+        elif self.gap_distribution == "uniform":
+            gaps = self.rng.uniform(0, 2 * self.gap_mean, n)
+        elif self.gap_distribution == "exponential":
+            gaps = self.rng.exponential(self.gap_mean, n)
+        else:
+            # heavy tailed, shape 1.5 has mean 3 * scale
+            gaps = (self.rng.pareto(1.5, n) + 1) * self.gap_mean / 3
+        return gaps.astype(np.int64)
+
+    def generate_block(self, n: int) -> tuple:
+        """
+        generate the next n lines
+
+        :return: (name_ids, timestamps, data1, data2) ordered by date-time
+        :rtype: tuple
+        """
+        ids = self.rng.randint(0, self.series, n)
+
+        steps = self.rng.geometric(self.tick_rate, n)
+        gap = self.rng.random_sample(n) < self.gap_rate
+        steps[gap] += self._gaps(int(gap.sum()))
+        steps[self.rng.random_sample(n) < self.duplicate_rate] = 0
+        moves = self.rng.normal(0, 0.0005, n)
+
+        # the first line of a time-series starts its clock
+        order = np.argsort(ids, kind="stable")
+        ids_sorted = ids[order]
+        new_series = np.ones(n, dtype=bool)
+        new_series[1:] = ids_sorted[1:] != ids_sorted[:-1]
+        first = order[new_series]
+        first = first[~self.started[ids[first]]]
+        steps[first] = 0
+        moves[first] = 0
+        self.started[ids[first]] = True
+
+        # per time-series running sums of the steps and moves, continuing from the state of the time-series
+        steps_sorted = np.cumsum(steps[order])
+        moves_sorted = np.cumsum(moves[order])
+        series_start = np.flatnonzero(new_series)
+        lengths = np.diff(np.append(series_start, n))
+        steps_sorted -= np.repeat(steps_sorted[series_start] - steps[order][series_start], lengths)
+        moves_sorted -= np.repeat(moves_sorted[series_start] - moves[order][series_start], lengths)
+        timestamps = np.empty(n, dtype=np.int64)
+        data1 = np.empty(n, dtype=np.float64)
+        timestamps[order] = self.clock[ids_sorted] + steps_sorted
+        data1[order] = self.value[ids_sorted] * np.exp(moves_sorted)
+
+        series_end = np.append(series_start[1:], n) - 1
+        self.clock[ids_sorted[series_end]] = timestamps[order][series_end]
+        self.value[ids_sorted[series_end]] = data1[order][series_end]
+
+        data2 = self.rng.randint(1, 10, n).astype(np.float64)
+        by_time = np.argsort(timestamps, kind="stable")
+        return ids[by_time], timestamps[by_time], data1[by_time], data2[by_time]
+
+    def write(self, path: str, rows: int):
+        """
+        write a dataset of rows lines to path
+
+        :return: the number of bytes written
+        :rtype: int
+        """
+        written = 0
+        with open(path, "wb") as f:
+            while rows > 0:
+                n = min(rows, self.block_size)
+                ids, timestamps, data1, data2 = self.generate_block(n)
+                dates, times = timestamps_to_date_time(timestamps)
+                names = [self.names[i] for i in ids.tolist()]
+                block = "".join(map("%s,%s,%s,%.6f,%.1f\n".__mod__,
+                                    zip(names, dates, times, data1.tolist(), data2.tolist()))).encode("utf-8")
+                f.write(block)
+                written += len(block)
+                rows -= n
+        return written
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """
+    add the options of FeedGenerator to parser
+    """
+    parser.add_argument("--series", type=int, default=100,
+                        help="the number of time-series, default=100")
+    parser.add_argument("--tick-rate", type=float, default=1.0,
+                        help="the probability that a second of a time-series has a tick, default=1.0")
+    parser.add_argument("--duplicate-rate", type=float, default=0.1,
+                        help="the probability that a tick has the same date-time as the previous tick of its "
+                             "time-series, default=0.1")
+    parser.add_argument("--gap-rate", type=float, default=0.0,
+                        help="the probability that a new date-time of a time-series follows a gap, default=0")
+    parser.add_argument("--gap-distribution", choices=GAP_DISTRIBUTIONS, default="exponential",
+                        help="the distribution of the gap lengths, default=exponential")
+    parser.add_argument("--gap-mean", type=float, default=60.0,
+                        help="the mean gap length in seconds, default=60")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="the seed of the random generator, default=0")
+
+
+def from_arguments(args) -> FeedGenerator:
+    """
+    :return: a FeedGenerator with the options of add_arguments
+    """
+    return FeedGenerator(series=args.series, tick_rate=args.tick_rate, duplicate_rate=args.duplicate_rate,
+                         gap_rate=args.gap_rate, gap_distribution=args.gap_distribution, gap_mean=args.gap_mean,
+                         seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate a synthetic dataset")
+    parser.add_argument("dataset_file",
+                        help="the dataset file to create")
+    parser.add_argument("--rows", type=int, required=True,
+                        help="the number of lines of the dataset")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    written = from_arguments(args).write(args.dataset_file, args.rows)
+    print("wrote %d lines (%d MB) to %s" % (args.rows, written // 1000000, args.dataset_file))
+
+
+if __name__ == '__main__':
+    main()
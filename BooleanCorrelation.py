@@ -1,4 +1,4 @@
-from Dataset.DatasetH5 import DatasetH5
+from Dataset.DatasetH5 import DatasetH5, READ_BLOCK_SIZE
 import numpy as np
 import logging
 import time
@@ -27,7 +27,12 @@ class BooleanCorrelation:
 
     def get_ts(self, i):
         if self.cache[i] is None:
-            self.cache[i] = self.norm_ds[i].value
+            # the block of time series of i, a single read of its rows in the matrix layout
+            start = i - i % READ_BLOCK_SIZE
+            block = range(start, min(start + READ_BLOCK_SIZE, len(self.norm_ds)))
+            for j, data in zip(block, self.norm_ds.read_block(block)):
+                if self.cache[j] is None:
+                    self.cache[j] = data
 
         return self.cache[i]
 
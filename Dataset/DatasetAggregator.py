@@ -0,0 +1,254 @@
+import numpy as np
+
+from .DatasetReader import DatasetChunk
+
+__author__ = 'gm'
+
+
+class DatasetAggregator:
+    """
+    Averages the data of every time-series that have the same date-time and numbers the resulting rows (ticks), for
+    whole chunks parsed by DatasetReader at once.
+
+    Data with the same date-time are the consecutive data of a time-series that have equal timestamps, they are
+    averaged incrementally in the order they were read: avg_n = (n - 1) * avg_(n-1) / n + data_n / n
+    Every time-series starts from tick 0 and every new date-time increments the tick.
+
+    The latest row of every time-series is kept pending, because the data of the next chunk may continue its
+    date-time. The pending rows are returned by flush() when there are no more chunks.
+    """
+
+    def __init__(self, keep_heads=False):
+        """
+        :param keep_heads: keep the raw data of the first date-time of every time-series in self.heads, needed when
+                           the rows are merged into the rows of a preceding part of the dataset (see merge)
+        """
+        self.keep_heads = keep_heads
+        self.heads = {}  # {name id: [[data1, ...], [data2, ...]]}
+        self.head_open = np.zeros(0, dtype=bool)
+        # pending row of every time-series, indexed by name id
+        self.has_pending = np.zeros(0, dtype=bool)
+        self.pending_ts = np.zeros(0, dtype=np.int64)
+        self.pending_data1 = np.zeros(0, dtype=np.float64)
+        self.pending_data2 = np.zeros(0, dtype=np.float64)
+        self.pending_n = np.zeros(0, dtype=np.int64)  # number of data averaged into the pending row
+        self.pending_tick = np.zeros(0, dtype=np.int64)
+
+    def _grow(self, size: int):
+        """
+        make room in the pending arrays for name ids up to size - 1
+        """
+        old = len(self.has_pending)
+        if size <= old:
+            return
+        size = max(size, 2 * old)
+        for attr in ["has_pending", "head_open", "pending_ts", "pending_data1", "pending_data2", "pending_n",
+                     "pending_tick"]:
+            a = getattr(self, attr)
+            grown = np.zeros(size, dtype=a.dtype)
+            grown[:old] = a
+            setattr(self, attr, grown)
+        self.head_open[old:] = self.keep_heads
+
+    def pending_ids(self) -> np.ndarray:
+        """
+        :return: the name ids of the time-series that have a pending row
+        """
+        return np.flatnonzero(self.has_pending)
+
+    def set_pending(self, name_id: int, timestamp: int, data1: float, data2: float, n: int, tick: int):
+        """
+        set the pending row of a time-series, the next rows of the time-series continue from it
+        """
+        self._grow(name_id + 1)
+        self.has_pending[name_id] = True
+        self.head_open[name_id] = False
+        self.pending_ts[name_id] = timestamp
+        self.pending_data1[name_id] = data1
+        self.pending_data2[name_id] = data2
+        self.pending_n[name_id] = n
+        self.pending_tick[name_id] = tick
+
+    def process(self, chunk: DatasetChunk) -> DatasetChunk:
+        """
+        average and number the data of chunk
+
+        :return: the rows that are complete, that is every row of chunk (and the pending rows) except for the latest
+                 row of every time-series, as a DatasetChunk with ticks
+        :rtype: DatasetChunk
+        """
+        if len(chunk) == 0:
+            return DatasetChunk(chunk.name_ids, chunk.timestamps, chunk.data1, chunk.data2,
+                                ticks=np.zeros(0, dtype=np.int64))
+        self._grow(int(chunk.name_ids.max()) + 1)
+
+        # put the pending rows of the time-series in the chunk in front of their data
+        carried = np.unique(chunk.name_ids)
+        carried = carried[self.has_pending[carried]]
+        c = len(carried)
+        ids = np.concatenate([carried, chunk.name_ids])
+        ts = np.concatenate([self.pending_ts[carried], chunk.timestamps])
+        data1 = np.concatenate([self.pending_data1[carried], chunk.data1])
+        data2 = np.concatenate([self.pending_data2[carried], chunk.data2])
+        counts = np.concatenate([self.pending_n[carried], np.ones(len(chunk), dtype=np.int64)])
+        is_pending = np.zeros(len(ids), dtype=bool)
+        is_pending[:c] = True
+
+        # group by time-series, keeping the order the data were read
+        order = np.argsort(ids, kind="stable")
+        ids, ts, data1, data2, counts, is_pending = \
+            ids[order], ts[order], data1[order], data2[order], counts[order], is_pending[order]
+        n = len(ids)
+
+        # runs: consecutive data of a time-series with the same date-time
+        new_run = np.ones(n, dtype=bool)
+        new_run[1:] = (ids[1:] != ids[:-1]) | (ts[1:] != ts[:-1])
+        run_start = np.flatnonzero(new_run)
+        run_of = np.cumsum(new_run) - 1
+        position = np.arange(n) - run_start[run_of]
+
+        # incremental average, one step for all runs with at least k data
+        avg1 = data1[run_start].copy()
+        avg2 = data2[run_start].copy()
+        run_n = counts[run_start].copy()
+        by_position = np.argsort(position, kind="stable")
+        position_bounds = np.cumsum(np.bincount(position))
+        for k in range(1, len(position_bounds)):
+            rows = by_position[position_bounds[k - 1]:position_bounds[k]]
+            runs = run_of[rows]
+            m = run_n[runs] + 1
+            avg1[runs] = (m - 1) * avg1[runs] / m + data1[rows] / m
+            avg2[runs] = (m - 1) * avg2[runs] / m + data2[rows] / m
+            run_n[runs] = m
+
+        # ticks: continue from the pending tick of the time-series, or start from 0
+        run_ids = ids[run_start]
+        run_ts = ts[run_start]
+        r = len(run_start)
+        new_series = np.ones(r, dtype=bool)
+        new_series[1:] = run_ids[1:] != run_ids[:-1]
+        series_start = np.flatnonzero(new_series)
+        series_of = np.cumsum(new_series) - 1
+        run_index = np.arange(r) - series_start[series_of]
+        base = np.where(self.has_pending[run_ids], self.pending_tick[run_ids], 0)
+        ticks = base + run_index
+
+        if self.keep_heads:
+            self._keep_heads(ids, data1, data2, is_pending, run_index[run_of])
+
+        # the latest run of every time-series is kept pending
+        series_end = np.append(series_start[1:] - 1, r - 1)
+        last_ids = run_ids[series_end]
+        self.has_pending[last_ids] = True
+        self.pending_ts[last_ids] = run_ts[series_end]
+        self.pending_data1[last_ids] = avg1[series_end]
+        self.pending_data2[last_ids] = avg2[series_end]
+        self.pending_n[last_ids] = run_n[series_end]
+        self.pending_tick[last_ids] = ticks[series_end]
+
+        complete = np.ones(r, dtype=bool)
+        complete[series_end] = False
+        return DatasetChunk(run_ids[complete], run_ts[complete], avg1[complete], avg2[complete],
+                            ticks=ticks[complete])
+
+    def _keep_heads(self, ids, data1, data2, is_pending, run_index):
+        """
+        store the raw data of the chunk that belong to the first date-time of their time-series
+        """
+        head = self.head_open[ids] & (run_index == 0) & ~is_pending
+        head_ids = ids[head]
+        head_data1 = data1[head].tolist()
+        head_data2 = data2[head].tolist()
+        # ids are sorted, so the data of every time-series are contiguous
+        unique_ids, first = np.unique(head_ids, return_index=True)
+        bounds = np.append(first, len(head_ids)).tolist()
+        for j, i in enumerate(unique_ids.tolist()):
+            h = self.heads.setdefault(i, [[], []])
+            h[0].extend(head_data1[bounds[j]:bounds[j + 1]])
+            h[1].extend(head_data2[bounds[j]:bounds[j + 1]])
+        # a time-series with a second date-time has its first one complete
+        closed = ids[self.head_open[ids] & (run_index > 0)]
+        self.head_open[closed] = False
+
+    def flush(self) -> DatasetChunk:
+        """
+        :return: the pending rows, after this call there are no pending rows
+        :rtype: DatasetChunk
+        """
+        ids = self.pending_ids()
+        rows = DatasetChunk(ids.astype(np.int32), self.pending_ts[ids], self.pending_data1[ids],
+                            self.pending_data2[ids], ticks=self.pending_tick[ids])
+        self.has_pending[ids] = False
+        return rows
+
+    def merge(self, rows: DatasetChunk, heads: dict, run_lengths: dict) -> DatasetChunk:
+        """
+        merge all rows of the next part of the dataset, produced by another DatasetAggregator (with keep_heads
+        enabled, including its flushed rows), as if this aggregator had processed the data of that part.
+        If the first date-time of a time-series equals the date-time of its pending row, the average of the pending
+        row is continued with the raw data in heads, so the result is exactly the same.
+
+        :param rows: the rows of the part, the name ids must already be translated to the ids used by this aggregator
+        :param heads: {name id: [[data1, ...], [data2, ...]]} the raw data of the first date-time of every time-series
+        :param run_lengths: {name id: n} number of data averaged into the latest row of every time-series
+        :return: the rows that are complete
+        :rtype: DatasetChunk
+        """
+        if len(rows) == 0:
+            return rows
+        self._grow(int(rows.name_ids.max()) + 1)
+        order = np.lexsort((rows.ticks, rows.name_ids))
+        ids = rows.name_ids[order]
+        ts = rows.timestamps[order]
+        data1 = rows.data1[order].copy()
+        data2 = rows.data2[order].copy()
+        ticks = rows.ticks[order].copy()
+
+        new_series = np.ones(len(ids), dtype=bool)
+        new_series[1:] = ids[1:] != ids[:-1]
+        series_start = np.flatnonzero(new_series)
+        series_end = np.append(series_start[1:] - 1, len(ids) - 1)
+        shift = np.zeros(len(series_start), dtype=np.int64)
+        complete = np.ones(len(ids), dtype=bool)
+        complete[series_end] = False
+        last_n = np.array([run_lengths[i] for i in ids[series_end].tolist()], dtype=np.int64)
+
+        previous = []
+        for s, i in enumerate(ids[series_start].tolist()):
+            first = series_start[s]
+            if not self.has_pending[i]:
+                continue
+            if self.pending_ts[i] == ts[first]:
+                # the pending date-time continues, so does its average
+                avg1 = self.pending_data1[i]
+                avg2 = self.pending_data2[i]
+                n = int(self.pending_n[i])
+                for d1, d2 in zip(*heads[i]):
+                    n += 1
+                    avg1 = (n - 1) * avg1 / n + d1 / n
+                    avg2 = (n - 1) * avg2 / n + d2 / n
+                data1[first] = avg1
+                data2[first] = avg2
+                shift[s] = self.pending_tick[i]
+                if first == series_end[s]:
+                    last_n[s] = n
+            else:
+                previous.append(i)
+                shift[s] = self.pending_tick[i] + 1
+        previous = np.array(previous, dtype=np.int64)
+        emitted = DatasetChunk(previous.astype(np.int32), self.pending_ts[previous], self.pending_data1[previous],
+                               self.pending_data2[previous], ticks=self.pending_tick[previous])
+
+        ticks += np.repeat(shift, series_end - series_start + 1)
+        last_ids = ids[series_end]
+        self.has_pending[last_ids] = True
+        self.head_open[last_ids] = False
+        self.pending_ts[last_ids] = ts[series_end]
+        self.pending_data1[last_ids] = data1[series_end]
+        self.pending_data2[last_ids] = data2[series_end]
+        self.pending_n[last_ids] = last_n
+        self.pending_tick[last_ids] = ticks[series_end]
+
+        complete_rows = DatasetChunk(ids[complete], ts[complete], data1[complete], data2[complete],
+                                     ticks=ticks[complete])
+        return DatasetChunk.concatenate([emitted, complete_rows])
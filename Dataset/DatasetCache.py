@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import tempfile
+
+__author__ = 'gm'
+
+DEFAULT_CACHE_FOLDER = ".dataset-cache"
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024  # bytes
+
+
+class DatasetCache:
+    """
+    Cache of database query results in a folder, one .npz file of numpy arrays per entry.
+
+    An entry is keyed by the identity of the database file (absolute path, size, modification time) and the query
+    with its parameters, so changing the database or asking a different range or point threshold never returns a
+    stale result. When the files of the folder exceed max_size bytes, the least recently used entries are removed.
+    """
+
+    def __init__(self, folder=DEFAULT_CACHE_FOLDER, max_size=DEFAULT_CACHE_SIZE):
+        """
+        :param folder: the folder of the cache files, created if it does not exist
+        :param max_size: the max total size of the cache files in bytes
+        """
+        assert max_size >= 0
+        self.folder = folder
+        self.max_size = max_size
+        self.logger = logging.getLogger("DatasetCache")
+
+    @staticmethod
+    def key(db_name, query, **params):
+        """
+        :param db_name: the database file the query is performed on
+        :param query: the name of the query eg. "start-end-points"
+        :param params: the parameters of the query, must be JSON serializable
+        :return: the key of the result of query on the current version of db_name
+        :rtype: str
+        """
+        stat = os.stat(db_name)
+        identity = [os.path.abspath(db_name), stat.st_size, stat.st_mtime_ns, query, params]
+        digest = hashlib.sha1(json.dumps(identity, sort_keys=True).encode("utf-8")).hexdigest()
+        return "%s-%s" % (query, digest)
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + ".npz")
+
+    def get(self, key):
+        """
+        :return: {"array name": np.ndarray} stored under key, None if there is no such entry
+        :rtype: dict
+        """
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                arrays = dict((name, npz[name]) for name in npz.files)
+        except (OSError, ValueError) as e:
+            if os.path.exists(path):
+                self.logger.warning("Ignoring unreadable cache file \"%s\": %s" % (path, e))
+            return None
+        # the modification time orders the entries for eviction
+        os.utime(path)
+        return arrays
+
+    def put(self, key, arrays):
+        """
+        store arrays under key, then evict the least recently used entries if the cache is too big
+
+        :param arrays: {"array name": np.ndarray}, the arrays must not hold python objects
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        # written to a temporary file first, so a reader never sees a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self._evict(keep=key)
+
+    def _evict(self, keep=None):
+        """
+        remove the least recently used entries until the cache fits in max_size, the entry keep is removed last
+        """
+        entries = []
+        for name in os.listdir(self.folder):
+            if not name.endswith(".npz"):
+                continue
+            stat = os.stat(os.path.join(self.folder, name))
+            entries.append((name[:-4] == keep, stat.st_mtime_ns, stat.st_size, name))
+        entries.sort()
+        size = sum(e[2] for e in entries)
+        for is_keep, mtime, entry_size, name in entries:
+            if size <= self.max_size:
+                break
+            os.remove(os.path.join(self.folder, name))
+            size -= entry_size
+            self.logger.info("Evicted cache file \"%s\"" % name)
+
+    def clear(self):
+        """
+        remove every entry of the cache
+        """
+        if not os.path.isdir(self.folder):
+            return
+        for name in os.listdir(self.folder):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(self.folder, name))
@@ -1,32 +1,97 @@
-from .DatasetReader import DatasetReader
+from .DatasetReader import DatasetReader, DatasetChunk
 from .DatasetDatabase import DatasetDatabase
+from .DatasetAggregator import DatasetAggregator
 
+import json
 import logging
+import multiprocessing
+import numpy as np
+import os
 __author__ = 'gm'
 
 
+def _convert_shard(shard):
+    """
+    read and average the byte range of the dataset given in shard = (dataset_path, start, end, chunk_size). Runs in a
+    worker process of DatasetConverter._convert_parallel
+
+    :return: (names, rows, heads, run_lengths)
+             names: the time-series names, indexed by the name ids of rows, heads and run_lengths
+             rows: every row of the range as a DatasetChunk with ticks, the ticks of every time-series start from 0
+             heads, run_lengths: see DatasetAggregator.merge
+    :rtype: tuple
+    """
+    dataset_path, start, end, chunk_size = shard
+    reader = DatasetReader(dataset_path, chunk_size=chunk_size)
+    reader.open_dataset(start, end)
+
+    aggregator = DatasetAggregator(keep_heads=True)
+    rows = []
+    for chunk in iter(reader.get_next_chunk, None):
+        rows.append(aggregator.process(chunk))
+    ids = aggregator.pending_ids()
+    run_lengths = dict(zip(ids.tolist(), aggregator.pending_n[ids].tolist()))
+    rows.append(aggregator.flush())
+    names = reader.names
+    reader.close_dataset()
+
+    return names, DatasetChunk.concatenate(rows), aggregator.heads, run_lengths
+
+
 class DatasetConverter:
     """
     Converts a given dataset to an sqlite database with two tables, "dataset" and "dataset_normalized" both with columns
-    name | tick | date | time | data1 | data2
-    
+    series_id | tick | ts | data1 | data2
+    see DatasetDatabase
+
     data with the same date-time are averaged
     TODO: missing data?
+
+    Every checkpoint_interval writes of the write buffer a checkpoint is stored in the database, in the same
+    transaction as the data written since the previous one. It holds the byte offset of the dataset parsed so far,
+    the time-series names and the pending (latest) row of every time-series, so an interrupted conversion can be
+    resumed from it without duplicating any rows.
+
+    With append, the dataset is appended to the time-series already in the database (eg. a new trading day): every
+    time-series continues from its latest stored row, as if the dataset had been converted together with the data
+    already stored. A first date-time equal to that of the latest row continues its average, which is updated in
+    place, every other row is new.
     """
 
-    def __init__(self, dataset_name, database_name, write_buffer_size=100000):
+    def __init__(self, dataset_name, database_name, write_buffer_size=100000, jobs=1, shard_size=64000000,
+                 chunk_size=100000000, resume=False, checkpoint_interval=10, append=False):
         """
         :param dataset_name: the name of the dataset
         :param database_name: the name of the database
         :param write_buffer_size: gather this many ticks, then write to database
+        :param jobs: the number of worker processes that parse the dataset, 1 parses it in this process
+        :param shard_size: when jobs > 1 the dataset is split in byte ranges of about this size
+        :param chunk_size: the dataset is parsed chunk_size bytes at a time
+        :param resume: continue from the checkpoint of a previous, interrupted, conversion of the dataset
+        :param checkpoint_interval: store a checkpoint every this many writes of the write buffer
+        :param append: append the dataset to the time-series of the database, else the database must have no data
         """
         self.dataset = dataset_name
         self.dbname = database_name
         self.write_buffer = []  # holds data to be written to the database
         self.write_buffer_size = write_buffer_size
-        # last data per time series
-        # {"time-series name", [latest-data, tick]}
-        self.ldpt = {}
+        self.jobs = jobs
+        self.shard_size = shard_size
+        self.chunk_size = chunk_size
+        self.resume = resume
+        self.checkpoint_interval = checkpoint_interval
+        self.append = append
+        self.writes = 0  # writes of the write buffer since the last checkpoint
+        self.start = 0  # the byte offset of the dataset to start parsing from
+        # averages same date-time data and assigns the ticks of every time-series
+        self.aggregator = DatasetAggregator()
+        self.names = []  # time-series names, indexed by the name ids of the aggregator
+        self.series_ids = []  # the database series ids of self.names
+        # the tick and data of the latest stored row of every time-series when appending, indexed by name id, tick
+        # -1 once the row has been returned by the aggregator
+        self.tail_ticks = np.zeros(0, dtype=np.int64)
+        self.tail_data1 = np.zeros(0, dtype=np.float64)
+        self.tail_data2 = np.zeros(0, dtype=np.float64)
         self.db = None
         self.dreader = None
         self.logger = logging.getLogger("DatasetConverter")
@@ -37,65 +102,223 @@ class DatasetConverter:
         """
         assert isinstance(self.dataset, str)
         assert isinstance(self.dbname, str)
-
-        self.dreader = DatasetReader(self.dataset)
-        self.dreader.open_dataset()
+        assert self.jobs > 0
 
         self.db = DatasetDatabase(self.dbname)
         self.db.connect()
+        if not self._load_checkpoint():
+            self._load_last_rows()
 
-        for data in self.dreader:
-            name = data[0]
-            date = data[1]
-            time = data[2]
-
-            if name not in self.ldpt:
-                # first time seeing this time-series
-                # keep the data in ldpt and initialize tick to zero
-                self.ldpt[name] = [data, 0]
-            elif self.ldpt[name][0][1] == date and self.ldpt[name][0][2] == time:
-                # known time series
-                # the date-time from the latest tick of this time-series is the same with the current
-                # overwrite (data is incrementally averaged while read, so no need to compute avg here)
-                self.ldpt[name] = [data, self.ldpt[name][1]]
+        with self.db.bulk_load():
+            if self.jobs > 1 and DatasetReader.get_compression(self.dataset) is not None:
+                # compressed datasets can not be split in byte ranges
+                self.logger.warning("Compressed dataset \"%s\" is parsed by a single process" % self.dataset)
+                self._convert_serial()
+            elif self.jobs > 1:
+                self._convert_parallel()
             else:
-                # known time series
-                # - put the latest [data, tick] of this time-series from ldpt in the write buffer
-                self._append_to_write_buffer(self.ldpt[name])
+                self._convert_serial()
+
+            # write the last data for each time-series, kept pending in the aggregator, and how many data they average
+            a = self.aggregator
+            ids = a.pending_ids()
+            last_runs = list(zip(ids.tolist(), a.pending_tick[ids].tolist(), a.pending_n[ids].tolist()))
+            self._append_to_write_buffer(a.flush())
+            self.db.store_last_runs([(self.series_ids[i], tick, n) for i, tick, n in last_runs])
 
-                # - overwrite ldpt [data, tick] with the newly arrived data and increment tick
-                self.ldpt[name] = [data, self.ldpt[name][1] + 1]
-        # write the last data for each time-series that are left in ldpt
-        for key, value in self.ldpt.items():
-            self._append_to_write_buffer(value)
+            # flush the write buffer, the conversion is complete so the checkpoint is no longer needed. Committed
+            # when the bulk load completes
+            if len(self.write_buffer) > 0:
+                self.db.store_rows(self.write_buffer, commit=False)
+                self.write_buffer.clear()
+            self.db.delete_checkpoint(os.path.abspath(self.dataset))
 
-        # flush the write buffer
+        self.db.disconnect()
+
+    def _dataset_identity(self):
+        """
+        :return: (absolute path, size, modification time) of the dataset, a checkpoint is valid only for the same
+                 dataset file
+        """
+        stat = os.stat(self.dataset)
+        return os.path.abspath(self.dataset), stat.st_size, stat.st_mtime_ns
+
+    def _load_checkpoint(self):
+        """
+        restore the state of the checkpoint of the dataset if self.resume is set. Without resume, a checkpoint
+        means that the database has the data of an interrupted conversion, which would be duplicated
+
+        :return: True if the state was restored
+        """
+        path, size, mtime = self._dataset_identity()
+        checkpoint = self.db.get_checkpoint(path)
+        if checkpoint is None:
+            if self.resume:
+                self.logger.warning("No checkpoint of dataset \"%s\" to resume from" % self.dataset)
+            return False
+        if not self.resume:
+            raise Exception("Database \"%s\" has an interrupted conversion of dataset \"%s\", resume it"
+                            % (self.dbname, self.dataset))
+        if checkpoint[0] != size or checkpoint[1] != mtime:
+            raise Exception("Dataset \"%s\" has changed since the checkpoint" % self.dataset)
+
+        self.start = checkpoint[2]
+        state = json.loads(checkpoint[3])
+        self.names.extend(state["names"])
+        for name_id, timestamp, data1, data2, n, tick in state["pending"]:
+            self.aggregator.set_pending(name_id, timestamp, data1, data2, n, tick)
+        self._set_tails(state.get("tails", []))
+        self.logger.info("Resume conversion of dataset \"%s\" from byte %d" % (self.dataset, self.start))
+        return True
+
+    def _load_last_rows(self):
+        """
+        with append, the latest row of every time-series of the database becomes its pending row in the aggregator,
+        so the time-series continue from it. Without append the database must have no data, their ticks would
+        start from 0 again
+        """
+        last_rows = self.db.get_last_rows()
+        if not self.append:
+            if len(last_rows) > 0:
+                raise Exception("Database \"%s\" already has data, append dataset \"%s\" to it"
+                                % (self.dbname, self.dataset))
+            return
+        tails = []
+        for name, tick, timestamp, data1, data2, n in last_rows:
+            name_id = len(self.names)
+            self.names.append(name)
+            self.aggregator.set_pending(name_id, timestamp, data1, data2, n, tick)
+            tails.append((name_id, tick, data1, data2))
+        self._set_tails(tails)
+        self.logger.info("Append dataset \"%s\" to %d time-series" % (self.dataset, len(last_rows)))
+
+    def _set_tails(self, tails):
+        """
+        :param tails: [(name id, tick, data1, data2), ...] the latest stored row of the time-series
+        """
+        size = max([t[0] for t in tails], default=-1) + 1
+        self.tail_ticks = np.full(size, -1, dtype=np.int64)
+        self.tail_data1 = np.zeros(size, dtype=np.float64)
+        self.tail_data2 = np.zeros(size, dtype=np.float64)
+        for name_id, tick, data1, data2 in tails:
+            self.tail_ticks[name_id] = tick
+            self.tail_data1[name_id] = data1
+            self.tail_data2[name_id] = data2
+
+    def _checkpoint(self, offset):
+        """
+        store a checkpoint if the write buffer has been written checkpoint_interval times since the last one
+
+        :param offset: every data of the dataset before this byte offset have been given to the aggregator
+        """
+        if self.writes < self.checkpoint_interval:
+            return
         if len(self.write_buffer) > 0:
-            self.db.store_multiple_data(self.write_buffer)
+            self.db.store_rows(self.write_buffer, commit=False)
             self.write_buffer.clear()
+        a = self.aggregator
+        ids = a.pending_ids()
+        pending = list(zip(ids.tolist(), a.pending_ts[ids].tolist(), a.pending_data1[ids].tolist(),
+                           a.pending_data2[ids].tolist(), a.pending_n[ids].tolist(), a.pending_tick[ids].tolist()))
+        ids = np.flatnonzero(self.tail_ticks >= 0)
+        tails = list(zip(ids.tolist(), self.tail_ticks[ids].tolist(), self.tail_data1[ids].tolist(),
+                         self.tail_data2[ids].tolist()))
+        path, size, mtime = self._dataset_identity()
+        self.db.store_checkpoint(path, size, mtime, offset,
+                                 json.dumps({"names": self.names, "pending": pending, "tails": tails}))
+        self.db.commit()
+        self.writes = 0
+        self.logger.info("Checkpoint at byte %d of dataset \"%s\"" % (offset, self.dataset))
+
+    def _convert_serial(self):
+        """
+        parse the dataset in this process
+        """
+        self.dreader = DatasetReader(self.dataset, chunk_size=self.chunk_size)
+        self.dreader.open_dataset(self.start)
+        self.dreader.set_names(self.names)
+        self.names = self.dreader.names
+
+        for chunk in iter(self.dreader.get_next_chunk, None):
+            self._append_to_write_buffer(self.aggregator.process(chunk))
+            self._checkpoint(self.dreader.position)
 
-        self.db.disconnect()
         self.dreader.close_dataset()
 
-    def _append_to_write_buffer(self, data: list):
+    def _convert_parallel(self):
         """
-        append data to the write buffer, if the buffer has reached a predefined size then the data are written
+        split the dataset in byte ranges that are parsed and averaged by self.jobs worker processes. The results are
+        merged here, in the order of the ranges, so ticks and averages are the same as those of _convert_serial
+        """
+        shards = max(self.jobs, os.path.getsize(self.dataset) // self.shard_size)
+        ranges = [(self.dataset, start, end, self.chunk_size)
+                  for start, end in DatasetReader.split_dataset(self.dataset, shards, self.start)]
+        self.logger.info("Parse dataset \"%s\" in %d ranges with %d jobs" % (self.dataset, len(ranges), self.jobs))
+
+        name_ids = dict((name, i) for i, name in enumerate(self.names))
+        with multiprocessing.Pool(self.jobs) as pool:
+            for (dataset, start, end, chunk_size), (names, rows, heads, run_lengths) in \
+                    zip(ranges, pool.imap(_convert_shard, ranges)):
+                # translate the name ids of the range to ours
+                translate = np.empty(len(names), dtype=np.int32)
+                for i, name in enumerate(names):
+                    if name not in name_ids:
+                        name_ids[name] = len(self.names)
+                        self.names.append(name)
+                    translate[i] = name_ids[name]
+                rows.name_ids = translate[rows.name_ids]
+                heads = {int(translate[i]): h for i, h in heads.items()}
+                run_lengths = {int(translate[i]): n for i, n in run_lengths.items()}
+                self._append_to_write_buffer(self.aggregator.merge(rows, heads, run_lengths))
+                self._checkpoint(end)
+
+    def _append_to_write_buffer(self, rows: DatasetChunk):
+        """
+        append rows to the write buffer, every time the buffer reaches a predefined size the data are written
         into the database
 
-        :param data: the data to append to the write buffer
-                     [ [name, tick, date, time, data1, data2], tick ]
+        :param rows: averaged rows with ticks, as returned by the aggregator
         """
-        assert isinstance(data, list)
-        assert isinstance(data[0], tuple)
-        assert isinstance(data[1], int)
+        assert isinstance(rows, DatasetChunk)
+        assert rows.ticks is not None
 
-        prev_name = data[0][0]
-        prev_date = data[0][1]
-        prev_time = data[0][2]
-        prev_data1 = data[0][3]
-        prev_data2 = data[0][4]
-        self.write_buffer.append([prev_name, data[1], prev_date, prev_time, prev_data1, prev_data2])
+        if len(self.series_ids) < len(self.names):
+            self.series_ids.extend(self.db.get_series_ids(self.names[len(self.series_ids):]))
+        if len(self.tail_ticks) > 0:
+            rows = self._update_tails(rows)
+        series_ids = np.array(self.series_ids, dtype=np.int64)[rows.name_ids]
+        self.write_buffer.extend(zip(series_ids.tolist(), rows.ticks.tolist(), rows.timestamps.tolist(),
+                                     rows.data1.tolist(), rows.data2.tolist()))
 
-        if len(self.write_buffer) == self.write_buffer_size:
-            self.db.store_multiple_data(self.write_buffer)
-            self.write_buffer.clear()
+        while len(self.write_buffer) >= self.write_buffer_size:
+            # committed with the next checkpoint
+            self.db.store_rows(self.write_buffer[:self.write_buffer_size], commit=False)
+            del self.write_buffer[:self.write_buffer_size]
+            self.writes += 1
+
+    def _update_tails(self, rows: DatasetChunk) -> DatasetChunk:
+        """
+        the latest stored rows of the time-series that are appended to are returned by the aggregator like any
+        other row. They are not stored again, they are updated in place if new data of the same date-time changed
+        their average
+
+        :return: rows without the latest stored rows
+        """
+        seeded = rows.name_ids < len(self.tail_ticks)
+        is_tail = np.zeros(len(rows), dtype=bool)
+        is_tail[seeded] = rows.ticks[seeded] == self.tail_ticks[rows.name_ids[seeded]]
+        if not is_tail.any():
+            return rows
+
+        ids = rows.name_ids[is_tail]
+        data1 = rows.data1[is_tail]
+        data2 = rows.data2[is_tail]
+        changed = (data1 != self.tail_data1[ids]) | (data2 != self.tail_data2[ids])
+        series_ids = np.array(self.series_ids, dtype=np.int64)[ids[changed]]
+        self.db.update_rows(list(zip(series_ids.tolist(), rows.ticks[is_tail][changed].tolist(),
+                                     data1[changed].tolist(), data2[changed].tolist())))
+        self.tail_ticks[ids] = -1
+
+        keep = ~is_tail
+        return DatasetChunk(rows.name_ids[keep], rows.timestamps[keep], rows.data1[keep], rows.data2[keep],
+                            ticks=rows.ticks[keep])
@@ -1,13 +1,37 @@
-from .DatasetDatabase import DatasetDatabase
-from Dataset.DatasetDatabase import DATE_FORMAT
-import h5py
+from .DatasetDatabase import DatasetDatabase, DatasetDatabasePool
+from .DatasetDBNormalizer import DatasetDBNormalizer
+from .DatasetReader import date_time_to_timestamp, timestamp_to_date_time
+from .DatasetStatistics import DatasetStatistics
+from .DatasetH5 import DatasetH5, DatasetH5Writer
+import multiprocessing
 import numpy as np
-import datetime as dt
 
 __author__ = 'gm'
 
-delta1sec = dt.timedelta(seconds=1)
-delta_zero = dt.timedelta(seconds=0)
+# how the rows within an interval become its point(s), see DatasetDB2HDF5.resample
+AGGREGATIONS = ["last", "mean", "ohlc", "vwap"]
+
+# the time series written for every time series of the database, by aggregation, as suffixes of its name
+AGGREGATION_SUFFIXES = {"last": [""], "mean": [""], "ohlc": [".open", ".high", ".low", ".close"], "vwap": [""]}
+
+_pool = None  # the read-only connections of a worker process of DatasetDB2HDF5._convert_parallel
+_grid = None  # (first_timestamp, last_timestamp, interval, agg) of the worker process
+
+
+def _init_worker(db_name, first_timestamp, last_timestamp, interval, agg):
+    global _pool, _grid
+    _pool = DatasetDatabasePool(db_name)
+    _grid = (first_timestamp, last_timestamp, interval, agg)
+
+
+def _gap_fill_series(task):
+    """
+    read and gap fill the time series of task = (ts_name, range) in a worker process
+
+    :return: [(name, gap filled time series), ...] see DatasetDB2HDF5.gap_filled
+    """
+    ts_name, range = task
+    return DatasetDB2HDF5.gap_filled(_pool.get(), ts_name, range, *_grid)
 
 
 class DatasetDB2HDF5:
@@ -22,20 +46,25 @@ class DatasetDB2HDF5:
         """
         self.db_name = db_name
         self.hdf5_name = hdf5_name
-        self.first_datetime = None
-        self.last_datetime = None
+        self.first_timestamp = None  # the globally first date-time, seconds since the epoch
+        self.last_timestamp = None  # the globally last date-time
         self.db = None  # sqlite database
-        self.h5 = None  # hdf5 database
-        self.first_datetime_of_ts = None  # temp variable holding the first datetime of a time series
-        self.last_datetime_of_ts = None  # temp variable, holding the last datetime of a time series
-        self.ts = []  # temp variable, holding a time series
+        self.h5 = None  # hdf5 database, a DatasetH5Writer
+        self.h5_norm = None  # the normalized hdf5 database, a DatasetH5Writer
 
-    def convert(self, range=None, compression_level=None, point_threshold=None):
+    def convert(self, range=None, compression_level=None, point_threshold=None, jobs=1, layout="series", interval=1,
+                agg="last", codec=None, chunk_size=None, append=False, normalized_hdf5_name=None):
         """
         convert a dataset stored in a sqlite3 database to a hdf5 database. Data interval in every time series is
         one second. For those seconds that the dataset has no data we put the previous available data to fill the gaps.
+        The time axis spans the globally first to the globally last date-time, clipped to range if given, see
+        clip_to_range. Its first and last date-times are stored in the "window_start" and "window_end" attributes
 
-        range is used to filter the time series to write to the new database
+        interval > 1 writes one point every interval seconds instead, computed from the rows of the interval by agg,
+        one of AGGREGATIONS, see resample. Both are stored in the "interval" and "aggregation" attributes of the
+        hdf5 database. agg="ohlc" writes 4 time series per time series, named after it with AGGREGATION_SUFFIXES
+
+        range is used to filter the time series to write to the new database, and to clip the time axis
         range = [start_date, end_date] date: '%m/%d/%Y-%H:%M:%S'
 
         point_threshold if not None will determine if a time series name will not be displayed based on
@@ -43,150 +72,276 @@ class DatasetDB2HDF5:
         eg. if point_threshold is 100 and a time series has 90 data points then it will be discarded.
         It can also be a percentage of the max data points in the range specified
         eg. point_threshold="%50"
+
+        jobs > 1 worker processes read and gap fill the time series in parallel, over read-only connections. This
+        process writes them to the hdf5 database (h5py can not write concurrently) in the same order as jobs=1
+
+        layout is one of DatasetH5.LAYOUTS
+
+        codec (one of DatasetH5.CODECS) with compression_level and chunk_size (bytes) set the compression and the
+        chunks of the hdf5 datasets, see DatasetH5Writer. By default gzip if compression_level is given
+
+        append extends the time series of the existing hdf5 database with the points after its last one instead, see
+        append. All the other arguments are those the hdf5 database was created with
+
+        The DatasetStatistics of every time series are stored as its attributes. If normalized_hdf5_name is not None
+        the normalized time series are written to this hdf5 database too, in the same pass (not with append, the
+        hdf5 database is normalized again after an append, see DatasetDBNormalizer.normalize_hdf5)
         """
         assert compression_level in [None, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+        assert jobs > 0
+        assert interval > 0
+        assert agg in AGGREGATIONS
         self.db = DatasetDatabase(self.db_name)
         self.db.connect()
+        if append:
+            if range or point_threshold or normalized_hdf5_name:
+                raise Exception("range, point threshold and normalized hdf5 database can not be given when appending")
+            self.append()
+            self.db.disconnect()
+            return
 
         # get the globally first and last date-times (of all time series)
-        self.first_datetime = dt.datetime.strptime(self.db.get_first_datetime(None), DATE_FORMAT)
-        self.last_datetime = dt.datetime.strptime(self.db.get_last_datetime(None), DATE_FORMAT)
-
-        self.h5 = h5py.File(self.hdf5_name, mode='w')
-
+        start_end_timestamps = self.db.get_start_end_timestamps().values()
+        self.first_timestamp = min(first for first, last in start_end_timestamps)
+        self.last_timestamp = max(last for first, last in start_end_timestamps)
+        self.first_timestamp, self.last_timestamp = DatasetDB2HDF5.clip_to_range(range, self.first_timestamp,
+                                                                                 self.last_timestamp)
+
+        ts_names = self.db.get_distinct_names(range=range, point_threshold=point_threshold)
+        names = [ts_name + suffix for ts_name in ts_names for suffix in AGGREGATION_SUFFIXES[agg]]
+        m = (self.last_timestamp - self.first_timestamp) // interval + 1
+        attrs = DatasetDB2HDF5.point_attributes(self.first_timestamp, self.last_timestamp, interval, agg)
+        self.h5 = DatasetH5Writer(self.hdf5_name, names, m, layout=layout, compression_level=compression_level,
+                                  codec=codec, chunk_size=chunk_size, attrs=attrs)
+        if normalized_hdf5_name is not None:
+            self.h5_norm = DatasetH5Writer(normalized_hdf5_name, names, m, layout=layout,
+                                           compression_level=compression_level, codec=codec, chunk_size=chunk_size,
+                                           attrs=attrs)
+        if jobs > 1:
+            converted = self._convert_parallel(ts_names, range, jobs, interval, agg)
+        else:
+            converted = (DatasetDB2HDF5.gap_filled(self.db, ts_name, range, self.first_timestamp, self.last_timestamp,
+                                                   interval, agg) for ts_name in ts_names)
         i = 1
-        for ts_name in self.db.get_distinct_names(range=range, point_threshold=point_threshold):
-            self._convert_time_series(ts_name, compression_level)
+        for series in converted:
+            for ts_name, ts_array in series:
+                DatasetDBNormalizer.write_time_series(self.h5, self.h5_norm, ts_name, ts_array)
             if i % 100 == 0:
                 print("processed %d time series" % i)
             i += 1
 
         self.h5.close()
+        if self.h5_norm is not None:
+            self.h5_norm.close()
         self.db.disconnect()
 
-    def _convert_time_series(self, ts_name, compression_level):
-        self.ts = self.db.get_time_series(ts_name).fetchall()
-        # ts --> [[date, time, data1, data2], ...]
-        gap_filled_ts = []
-
-        # get the first and last date-times of this time series
-        self.first_datetime_of_ts = dt.datetime.strptime(self.ts[0][0] + "-" + self.ts[0][1], DATE_FORMAT)
-        self.last_datetime_of_ts = dt.datetime.strptime(self.ts[-1][0] + "-" + self.ts[-1][1], DATE_FORMAT)
-
-        # FS: First Segment
-        # MS: Middle Segment
-        # LS: Last Segment
-        #
-        # |--FS--| |--MS--| |--LS--|
-        # ........ ........ ........  <-- time series
-        # |---the globally first datetime(self.first_datetime)
-        #          |---the first datetime of the time series(self.first_datetime_of_ts)
-        #                 |---the last datetime of the time series(self.last_datetime_of_ts)
-        #                          |---the globally last datetime(self.last_datetime)
-
-        # First segment filling
-        # There is no First segment if self.first_datetime_of_ts == self.first_datetime
-        if self.first_datetime_of_ts != self.first_datetime:
-            self._fill_first_segment(gap_filled_ts)
-
-        # Middle segment filling
-        # This is always present
-        self._fill_middle_segment(gap_filled_ts)
-
-        # Last segment filling
-        # There is no Last segment if self.last_datetime_of_ts == self.last_datetime
-        if self.last_datetime_of_ts != self.last_datetime:
-            self._fill_last_segment(gap_filled_ts)
-
-        ts_array = np.array(gap_filled_ts, dtype='float32')
-        if compression_level:
-            self.h5.create_dataset(ts_name, (len(gap_filled_ts),), data=ts_array, dtype='float32', compression="gzip",
-                                   compression_opts=compression_level)
-        else:
-            self.h5.create_dataset(ts_name, (len(gap_filled_ts),), data=ts_array, dtype='float32')
-
-    def _fill_first_segment(self, gap_filled_ts):
+    def append(self):
         """
-        fills the first segment, copies the first point of self.ts to all missing points from global start timedate
-        assume global start timedate is 00:00:00 and start of timeseries is 00:00:05 with data 2.1
-
-        00:00:05
-           2.1
+        append the points after the last point of the time series of the hdf5 database, up to the globally last
+        date-time of the database, eg after a new trading day is added with DatasetConverter append. Only the rows
+        at or after the stored "window_end" date-time are read, the last point stored is recomputed since rows of its
+        interval may have been added, and "window_end" moves to the new last date-time. Rows added before
+        "window_end" are not taken into account, time series that are not in the hdf5 database are not added. The
+        DatasetStatistics attributes of the time series are updated with the points appended.
+
+        The hdf5 database must have the "last" aggregation (of any interval), the other aggregations can not be
+        computed from the points stored
+        """
+        with DatasetH5(self.hdf5_name, mode='r') as h5:
+            if "window_start" not in h5.f.attrs:
+                raise Exception("\"%s\" has no window_start attribute, it was written by a previous version"
+                                % self.hdf5_name)
+            if h5.f.attrs["aggregation"] != "last":
+                raise Exception("only a hdf5 database of the last aggregation can be appended to, \"%s\" is of %s"
+                                % (self.hdf5_name, h5.f.attrs["aggregation"]))
+            interval = h5.interval
+            self.first_timestamp = date_time_to_timestamp(*h5.f.attrs["window_start"].split("-"))
+            stored_timestamp = date_time_to_timestamp(*h5.f.attrs["window_end"].split("-"))
+            # the last point stored, rewritten by the append
+            offset = (stored_timestamp - self.first_timestamp) // interval
+            ts_names = h5.ts_names
+            last_values = h5.read_point(offset) if len(ts_names) else []
+            statistics = [DatasetStatistics.from_attributes(h5.attributes(i)) for i in range(len(ts_names))]
+
+        self.last_timestamp = max(last for first, last in self.db.get_start_end_timestamps().values())
+        if self.last_timestamp <= stored_timestamp:
+            print("no data after %s" % "-".join(timestamp_to_date_time(stored_timestamp)))
+            return
+        names = set(self.db.get_distinct_names())
+        ignored = len(names.difference(ts_names))
+        if ignored:
+            print("%d time series are not in %s, convert it again to add them" % (ignored, self.hdf5_name))
+
+        start = "-".join(timestamp_to_date_time(stored_timestamp))
+        m = (self.last_timestamp - self.first_timestamp) // interval + 1
+        self.h5 = DatasetH5Writer(self.hdf5_name, None, m, append=True,
+                                  attrs={"window_end": "-".join(timestamp_to_date_time(self.last_timestamp))})
+        for i, ts_name in enumerate(ts_names):
+            timestamps, data1, data2 = self.db.get_time_series_arrays(ts_name, start=start) if ts_name in names \
+                else (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+            if len(timestamps) == 0 or timestamps[0] != stored_timestamp:
+                # the point stored at window_end carries on
+                timestamps = np.insert(timestamps, 0, stored_timestamp)
+                data1 = np.insert(data1, 0, last_values[i])
+                data2 = np.insert(data2, 0, 0)
+            interval_start = self.first_timestamp + offset * interval
+            if interval == 1:
+                ts_array = DatasetDB2HDF5.fill_gaps(timestamps, data1, interval_start, self.last_timestamp)
+            else:
+                ts_array = DatasetDB2HDF5.resample(timestamps, data1, data2, interval_start, self.last_timestamp,
+                                                   interval, "last")[0]
+            self.h5.write(ts_name, ts_array, offset=offset)
+            if statistics[i] is not None:
+                statistics[i].remove(last_values[i])
+                statistics[i].update(ts_array)
+                self.h5.set_attributes(ts_name, statistics[i].attributes())
+            if (i + 1) % 100 == 0:
+                print("processed %d time series" % (i + 1))
+        self.h5.close()
 
-        after filling:
+    def _convert_parallel(self, ts_names, range, jobs, interval, agg):
+        """
+        :return: generator of the gap_filled time series of every name of ts_names, in its order
+        """
+        with multiprocessing.Pool(jobs, initializer=_init_worker,
+                                  initargs=(self.db_name, self.first_timestamp, self.last_timestamp, interval,
+                                            agg)) as pool:
+            for result in pool.imap(_gap_fill_series, [(ts_name, range) for ts_name in ts_names]):
+                yield result
 
-        00:00:00  00:00:01  00:00:02  00:00:03  00:00:04  00:00:05
-           2.1       2.1       2.1       2.1       2.1       2.1
+    @staticmethod
+    def clip_to_range(range, first_timestamp, last_timestamp):
+        """
+        the time series within range start at or after its start date, so the seconds before it (and after its end
+        date) would only repeat the first (last) point of every time series
 
+        :param range: None or [start_date, end_date] date: '%m/%d/%Y-%H:%M:%S'
+        :return: (first_timestamp, last_timestamp) of the time axis, the part of first_timestamp - last_timestamp
+                 within range
         """
-        assert self.first_datetime_of_ts > self.first_datetime
-        delta = self.first_datetime_of_ts - self.first_datetime
-        first_ts_data = self.ts[0][2]
-        seconds = delta.days * 86400 + delta.seconds
-        DatasetDB2HDF5._fill_N_points(gap_filled_ts, first_ts_data, seconds)
+        if not range:
+            return first_timestamp, last_timestamp
+        first_timestamp = max(first_timestamp, date_time_to_timestamp(*range[0].split("-")))
+        last_timestamp = min(last_timestamp, date_time_to_timestamp(*range[1].split("-")))
+        if first_timestamp > last_timestamp:
+            raise Exception("no data within range %s--%s" % (range[0], range[1]))
+        return first_timestamp, last_timestamp
 
-    def _fill_middle_segment(self, gap_filled_ts):
+    @staticmethod
+    def point_attributes(first_timestamp, last_timestamp, interval=1, agg="last"):
         """
-        fills the middle segment, puts the first point of self.ts in gap_filled_ts and then does the following:
-        if the next point to insert is ahead of the previous for more than one second, then fill every missing second
-        by copying the data of the previous point
-        00:00:00  00:00:05
-           1.1       2.3
+        :return: the DatasetH5.POINT_ATTRIBUTES of a hdf5 database with the time axis first_timestamp - last_timestamp
+        """
+        return {"interval": interval,
+                "aggregation": agg,
+                "window_start": "-".join(timestamp_to_date_time(first_timestamp)),
+                "window_end": "-".join(timestamp_to_date_time(last_timestamp))}
 
-        after filling:
+    @staticmethod
+    def gap_filled(db, ts_name, range, first_timestamp, last_timestamp, interval=1, agg="last"):
+        """
+        :param db: a connected DatasetDatabase
+        :param range: if not None, only the rows within range = [start_date, end_date] are read from the database
+        :return: [(ts_name + suffix, time series) for every suffix of AGGREGATION_SUFFIXES[agg]], one point for every
+                 second (see fill_gaps) or every interval seconds (see resample) from first_timestamp to last_timestamp
+        """
+        if range:
+            timestamps, data1, data2 = db.get_time_series_arrays(ts_name, start=range[0], end=range[1])
+        else:
+            timestamps, data1, data2 = db.get_time_series_arrays(ts_name)
+        if interval == 1 and agg == "last":
+            return [(ts_name, DatasetDB2HDF5.fill_gaps(timestamps, data1, first_timestamp, last_timestamp))]
+        resampled = DatasetDB2HDF5.resample(timestamps, data1, data2, first_timestamp, last_timestamp, interval, agg)
+        return [(ts_name + suffix, ts_array) for suffix, ts_array in zip(AGGREGATION_SUFFIXES[agg], resampled)]
 
-        00:00:00  00:00:01  00:00:02  00:00:03  00:00:04  00:00:05
-           1.1       1.1       1.1       1.1       1.1       2.3
+    @staticmethod
+    def resample(timestamps: np.ndarray, data1: np.ndarray, data2: np.ndarray, first_timestamp: int,
+                 last_timestamp: int, interval: int, agg: str) -> list:
         """
-        prev_datetime = None
-        prev_data = None
-        assert len(self.ts) != 0
-        for row in self.ts:  # for every row in the current time series
-            date = row[0]
-            time = row[1]
-            cur_data = row[2]
-            cur_datetime = dt.datetime.strptime(date + "-" + time, DATE_FORMAT)
-            if prev_datetime is not None:
-                assert cur_datetime > prev_datetime
-                delta = cur_datetime - prev_datetime
-                assert delta != delta_zero
-                if delta > delta1sec:
-                    # fill gaps
-                    seconds = delta.days * 86400 + delta.seconds
-                    assert prev_data
-                    assert seconds - 1 > 0
-                    DatasetDB2HDF5._fill_N_points(gap_filled_ts, prev_data, seconds - 1)
-
-            gap_filled_ts.append(cur_data)
-            prev_datetime = cur_datetime
-            prev_data = cur_data
-
-    def _fill_last_segment(self, gap_filled_ts):
-        """
-        fills the last segment, copies the last point of self.ts to all missing points from time series
-        last point till global last timedate
-        assume global last timedate is 00:00:10 and last of timeseries is 00:00:05 with data 2.1
-
-        00:00:05
-           2.1
+        one float32 point for every interval seconds from first_timestamp to last_timestamp. Point i is the
+        aggregation agg of the rows with first_timestamp + i * interval <= timestamp < first_timestamp + (i + 1) *
+        interval:
 
-        after filling:
+        last: data1 of the last row, the same as fill_gaps when interval is 1
+        mean: the mean of data1
+        ohlc: 4 time series, the first, the max, the min and the last data1
+        vwap: the mean of data1 weighted by data2 (the volume)
 
-        00:00:05  00:00:06  00:00:07  00:00:08  00:00:09  00:00:10
-           2.1       2.1       2.1       2.1       2.1       2.1
+        An interval without rows gets the data1 of the latest row before it, as fill_gaps does, and the intervals
+        before the first row get the data1 of the first row. For vwap an interval without volume is the last.
 
+        :param timestamps: the seconds of the rows, strictly increasing
+        :return: [time series] one time series per suffix of AGGREGATION_SUFFIXES[agg]
         """
-        assert self.last_datetime_of_ts < self.last_datetime
-        delta = self.last_datetime - self.last_datetime_of_ts
-        last_ts_data = self.ts[-1][2]
-        seconds = delta.days * 86400 + delta.seconds
-        DatasetDB2HDF5._fill_N_points(gap_filled_ts, last_ts_data, seconds)
+        assert len(timestamps) != 0
+        assert first_timestamp <= timestamps[0] and timestamps[-1] <= last_timestamp
+        if np.any(np.diff(timestamps) <= 0):
+            raise Exception("date-times of the time series are not strictly increasing")
+        m = (last_timestamp - first_timestamp) // interval + 1
+        data1 = np.asarray(data1, dtype='float64')
+        # the last row at or before the end of every interval
+        ends = first_timestamp + np.arange(1, m + 1, dtype=np.int64) * interval - 1
+        last = data1[np.maximum(np.searchsorted(timestamps, ends, side='right') - 1, 0)]
+        if agg == "last":
+            return [last.astype('float32')]
+
+        bins = (timestamps - first_timestamp) // interval  # the interval of every row
+        counts = np.bincount(bins, minlength=m)
+        if agg == "mean":
+            sums = np.bincount(bins, weights=data1, minlength=m)
+            return [np.where(counts > 0, sums / np.maximum(counts, 1), last).astype('float32')]
+        if agg == "vwap":
+            data2 = np.asarray(data2, dtype='float64')
+            volumes = np.bincount(bins, weights=data2, minlength=m)
+            values = np.bincount(bins, weights=data1 * data2, minlength=m)
+            return [np.where(volumes > 0, values / np.where(volumes > 0, volumes, 1), last).astype('float32')]
+
+        # ohlc, the rows of an interval are contiguous, starts are the first row of every non empty interval
+        filled, starts = np.unique(bins, return_index=True)
+        ohlc = []
+        for interval_values in [data1[starts], np.maximum.reduceat(data1, starts), np.minimum.reduceat(data1, starts),
+                                last[filled]]:
+            series = last.copy()
+            series[filled] = interval_values
+            ohlc.append(series.astype('float32'))
+        return ohlc
 
     @staticmethod
-    def _fill_N_points(gap_filled_ts: list, data: float, N: int):
+    def fill_gaps(timestamps: np.ndarray, data: np.ndarray, first_timestamp: int, last_timestamp: int) -> np.ndarray:
         """
-        append data N times to gap_filled_ts
+        one float32 value for every second from first_timestamp to last_timestamp, in a single np.repeat
+
+        FS: First Segment
+        MS: Middle Segment
+        LS: Last Segment
+
+        |--FS--| |--MS--| |--LS--|
+        ........ ........ ........  <-- time series
+        |---first_timestamp
+                 |---the first point of the time series
+                        |---the last point of the time series
+                                 |---last_timestamp
+
+        The seconds of FS get the data of the first point. Every other second gets the data of the latest point at or
+        before it, so a gap of MS and the whole LS repeat the data of the point before them:
+        00:00:00  00:00:05
+           1.1       2.3
+
+        after filling:
+
+        00:00:00  00:00:01  00:00:02  00:00:03  00:00:04  00:00:05
+           1.1       1.1       1.1       1.1       1.1       2.3
+
+        :param timestamps: the seconds of the points, strictly increasing
+        :param data: the data of the points
+        :return: the gap filled time series
         """
-        assert N > 0
-        for i in range(N):
-            gap_filled_ts.append(data)
+        assert len(timestamps) != 0
+        assert first_timestamp <= timestamps[0] and timestamps[-1] <= last_timestamp
+        if np.any(np.diff(timestamps) <= 0):
+            raise Exception("date-times of the time series are not strictly increasing")
+        # every point is repeated until the next one, the first point also covers the first segment
+        repeats = np.diff(np.append(timestamps, last_timestamp + 1))
+        repeats[0] += timestamps[0] - first_timestamp
+        return np.repeat(np.asarray(data, dtype='float32'), repeats)
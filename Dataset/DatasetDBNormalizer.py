@@ -1,9 +1,10 @@
 import numpy as np
 
 from .DatasetDatabase import DatasetDatabase
+from .DatasetH5 import DatasetH5, DatasetH5Writer
+from .DatasetStatistics import DatasetStatistics
 from Dataset.DatasetDatabase import DATE_FORMAT
 import datetime as dt
-import h5py
 
 __author__ = 'gm'
 
@@ -71,30 +72,74 @@ class DatasetDBNormalizer:
         db.disconnect()
 
     @staticmethod
-    def normalize_hdf5(h5db, h5db_normalized, compression_level=None):
-        h5 = h5py.File(h5db, mode='r')
-        h5_norm = h5py.File(h5db_normalized, mode='w')
-        for ts in h5:
-            ts_norm = DatasetDBNormalizer.normalize_time_series(h5[ts][:])
-            if compression_level:
-                h5_norm.create_dataset(ts, (len(ts_norm),), data=ts_norm, dtype='float32', compression="gzip",
-                                       compression_opts=compression_level)
-            else:
-                h5_norm.create_dataset(ts, (len(ts_norm),), data=ts_norm, dtype='float32')
-        h5.close()
-        h5_norm.close()
+    def normalize_hdf5(h5db, h5db_normalized, compression_level=None, layout="series", codec=None, chunk_size=None,
+                       read_size=None):
+        """
+        normalize every time series of the hdf5 database h5db, of any layout, into h5db_normalized of the given
+        layout, see DatasetH5.LAYOUTS, and compression, see DatasetH5Writer. The DatasetStatistics of every time
+        series are stored as its attributes
+
+        read_size bounds the memory used for time series longer than read_size points, see _normalize_by_ranges.
+        None reads every time series at once
+
+        Every normalized point depends on the mean and std of the whole time series, which the points appended to
+        h5db by DatasetDB2HDF5.append change, so h5db_normalized is normalized again after an append
+        """
+        with DatasetH5(h5db, mode='r') as h5:
+            m = len(h5[0]) if len(h5) else 0
+            with DatasetH5Writer(h5db_normalized, h5.ts_names, m, layout=layout, compression_level=compression_level,
+                                 attrs=h5.point_attributes(), codec=codec, chunk_size=chunk_size) as h5_norm:
+                for i, ts in enumerate(h5.ts_names):
+                    if read_size is not None and read_size < m:
+                        DatasetDBNormalizer._normalize_by_ranges(h5, i, h5_norm, read_size)
+                    else:
+                        DatasetDBNormalizer.write_time_series(None, h5_norm, ts, h5[i][:])
+
+    @staticmethod
+    def _normalize_by_ranges(h5, i, h5_norm, read_size):
+        """
+        normalize time series i of h5 in two passes over ranges of read_size points: the first merges the
+        DatasetStatistics of the ranges, the second normalizes and writes every range. At most a range of points is
+        held in memory (in float64 while it is normalized), the result is that of write_time_series within float32
+        rounding
+        """
+        m = len(h5[i])
+        statistics = DatasetStatistics()
+        for start in range(0, m, read_size):
+            statistics.update(h5.read(i, start, start + read_size))
+        ts = h5.ts_names[i]
+        for start in range(0, m, read_size):
+            h5_norm.write_range(ts, statistics.normalize(h5.read(i, start, start + read_size)), start)
+        h5_norm.set_attributes(ts, statistics.attributes())
+
+    @staticmethod
+    def write_time_series(h5, h5_norm, ts_name, ts_array):
+        """
+        write a time series and its normalization, in a single pass, with the attributes of its DatasetStatistics
+
+        :param h5: None or the DatasetH5Writer of the time series
+        :param h5_norm: None or the DatasetH5Writer of the normalized time series
+        """
+        statistics = DatasetStatistics()
+        statistics.update(ts_array)
+        if h5 is not None:
+            h5.write(ts_name, ts_array)
+            h5.set_attributes(ts_name, statistics.attributes())
+        if h5_norm is not None:
+            h5_norm.write(ts_name, statistics.normalize(ts_array))
+            h5_norm.set_attributes(ts_name, statistics.attributes())
 
     @staticmethod
     def normalize_time_series(time_series_data: np.array):
         """
-        normalize an array of float values
+        normalize an array of float values, as normalize_hdf5 normalizes them (see DatasetStatistics): the mean and
+        std are computed in float64, the float32 mean of a time series of small variance shifts every normalized
+        point, and a time series is constant, not normalized, by DatasetStatistics.CONSTANT_TOLERANCE
         :param time_series_data: a numpy array with float values
         :return: a numpy array with normalized data
         """
         assert isinstance(time_series_data, np.ndarray)
-        d = time_series_data
-        if np.std(d) == 0:
-            data_norm = d
-        else:
-            data_norm = (d - np.mean(d)) / np.std(d)
-        return data_norm
+        d = time_series_data.astype('float64')
+        statistics = DatasetStatistics()
+        statistics.update(d)
+        return statistics.normalize(d)
@@ -1,27 +1,68 @@
+from .DatasetCache import DatasetCache
+from .DatasetReader import date_time_to_timestamp, timestamp_to_date_time, timestamps_to_date_time
 import datetime as dt
 import numpy as np
 import sqlite3 as sql
 import logging
 import os
+import threading
+from urllib.request import pathname2url
 
 __author__ = 'gm'
 
 DATE_FORMAT = '%m/%d/%Y-%H:%M:%S'
 
+# the version of the database schema, stored in "PRAGMA user_version". Version 0 is the legacy schema:
+# dataset(name varchar, tick int, date varchar, time varchar, data1 varchar, data2 varchar)
+# version 2: series(id, name), dataset(series_id, tick, ts, data1, data2)
+# version 3: index (series_id, ts) on the data tables
+# version 4: catalog(series_id, first_ts, last_ts, num_points) of table dataset
+# version 5: last_run(series_id, tick, n) of table dataset
+SCHEMA_VERSION = 5
+
+# merges rows (series_id, first_ts, last_ts, num_points) of new data into the catalog
+CATALOG_UPSERT = "ON CONFLICT(series_id) DO UPDATE SET " \
+                 "first_ts=min(first_ts, excluded.first_ts), " \
+                 "last_ts=max(last_ts, excluded.last_ts), " \
+                 "num_points=num_points + excluded.num_points;"
+
+# date and time of the ts column (seconds since the epoch) in the format of the dataset
+SQL_DATE = "strftime('%m/%d/%Y', ts, 'unixepoch')"
+SQL_TIME = "strftime('%H:%M:%S', ts, 'unixepoch')"
+
 
 class DatasetDatabase:
     """
-    Sqlite database that holds dataset information in table "dataset" and "dataset_normalized
+    Sqlite database that holds dataset information in table "dataset" and "dataset_normalized"
     Columns:
-    name | tick | date | time | data1 | data2
+    series_id | tick | ts | data1 | data2
+
+    series_id refers to table "series" (id | name) that holds every time-series name once, ts is the date-time in
+    seconds since the epoch and data1, data2 are stored as REAL. The methods still take and return time-series
+    names and "month/day/year", "hours:minutes:seconds" date and time strings.
+    Table "catalog" (series_id | first_ts | last_ts | num_points) holds the first and last date-time and the number
+    of points of every time-series of table "dataset", it is updated by every store to "dataset" and answers the
+    per time-series queries without reading the data.
+    Table "last_run" (series_id | tick | n) holds the number of data averaged into the latest row (tick) of every
+    time-series by the conversion that stored it, so that a later conversion can append to the time-series and
+    continue that average exactly, see DatasetConverter.
+    Databases of the legacy schema (name | tick | date | time | data1 | data2, all text) are converted by migrate()
     """
 
-    def __init__(self, db_name):
+    def __init__(self, db_name, read_only=False):
+        """
+        :param db_name: the database file
+        :param read_only: open the database read-only (URI mode=ro), it must exist. The connection may be closed by
+                          another thread than the one that uses it, see DatasetDatabasePool
+        """
         self.db_name = db_name
+        self.read_only = read_only
         self.conn = None
         self.logger = logging.getLogger("DatasetDatabase")
         self.start_end_dates = None  # dictionary used by get_distinct_names for range filtering
         # {"time-series name": [start_datetime, end_datetime]}
+        self.series_ids = None  # {"time-series name": series id}, loaded on first use
+        self.load_table = None  # the table being bulk loaded, see bulk_load
 
     def is_connected(self):
         return self.conn is not None
@@ -33,7 +74,21 @@ class DatasetDatabase:
         if the database does not exist it is created
         """
         if not self.is_connected():
-            if os.path.exists(self.db_name) and os.path.isfile(self.db_name):
+            if self.read_only:
+                self._connect_read_only()
+            elif os.path.exists(self.db_name) and os.path.isfile(self.db_name):
+                version = DatasetDatabase.get_schema_version(self.db_name)
+                if version is None:
+                    # an empty file
+                    self.conn = sql.connect(self.db_name)
+                    self._create_database()
+                    self.logger.info("Created database \"%s\"" % self.db_name)
+                    return self
+                if version < SCHEMA_VERSION:
+                    raise Exception("Database \"%s\" has the older schema version %d, migrate it with dbmigrate"
+                                    % (self.db_name, version))
+                elif version > SCHEMA_VERSION:
+                    raise Exception("Database \"%s\" has the unknown schema version %d" % (self.db_name, version))
                 self.conn = sql.connect(self.db_name)
                 self.logger.info("connected to database \"%s\"" % self.db_name)
             else:
@@ -42,6 +97,19 @@ class DatasetDatabase:
                 self.logger.info("Created database \"%s\"" % self.db_name)
         return self
 
+    def _connect_read_only(self):
+        if not os.path.isfile(self.db_name):
+            raise Exception("Database \"%s\" does not exist" % self.db_name)
+        conn = sql.connect("file:%s?mode=ro" % pathname2url(os.path.abspath(self.db_name)), uri=True,
+                           check_same_thread=False)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            conn.close()
+            raise Exception("Database \"%s\" has the schema version %d, expected %d"
+                            % (self.db_name, version, SCHEMA_VERSION))
+        self.conn = conn
+        self.logger.info("connected read-only to database \"%s\"" % self.db_name)
+
     def disconnect(self):
         """
         close the sql.Connection (self.conn) if it is connected
@@ -49,38 +117,158 @@ class DatasetDatabase:
         if self.is_connected():
             self.conn.close()
             self.conn = None
+            self.series_ids = None
             self.logger.info("Disconnected from database \"%s\"" % self.db_name)
 
     def _create_database(self):
         """
         create a new database with the name specified in self.db_name
-        create table "dataset"
+        create tables "series", "dataset" and "dataset_normalized"
         """
 
         assert isinstance(self.conn, sql.Connection)
         c = self.conn.cursor()
         assert isinstance(c, sql.Cursor)
-        create_query = "CREATE TABLE dataset(" \
-                       "name varchar(255)," \
-                       "tick int," \
-                       "date varchar(255)," \
-                       "time varchar(255)," \
-                       "data1 varchar(255)," \
-                       "data2 varchar(255)," \
-                       "CONSTRAINT mypk PRIMARY KEY (name, tick)" \
-                       ");"
-        c.execute(create_query)
-
-        create_query = "CREATE TABLE dataset_normalized(" \
-                       "name varchar(255)," \
-                       "tick int," \
-                       "date varchar(255)," \
-                       "time varchar(255)," \
-                       "data1 varchar(255)," \
-                       "data2 varchar(255)," \
-                       "CONSTRAINT mypk PRIMARY KEY (name, tick)" \
-                       ");"
-        c.execute(create_query)
+        # the pages freed by bulk_load are returned to the file system
+        c.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        DatasetDatabase._create_tables(c)
+        c.execute("PRAGMA user_version = %d;" % SCHEMA_VERSION)
+        self.conn.commit()
+
+    @staticmethod
+    def _create_tables(c, suffix="", indexes=True):
+        """
+        create the tables of the current schema, their names end with suffix. The data tables are clustered by their
+        primary key, so the rows of a time-series are stored together in tick order
+
+        :param indexes: create the secondary indexes, else they are created by _create_indexes
+        """
+        c.execute("CREATE TABLE series%s("
+                  "id integer PRIMARY KEY,"
+                  "name varchar(255) NOT NULL UNIQUE"
+                  ");" % suffix)
+        for table in ["dataset", "dataset_normalized"]:
+            c.execute("CREATE TABLE %s%s("
+                      "series_id int,"
+                      "tick int,"
+                      "ts int,"
+                      "data1 real,"
+                      "data2 real,"
+                      "PRIMARY KEY (series_id, tick)"
+                      ") WITHOUT ROWID;" % (table, suffix))
+            if indexes:
+                DatasetDatabase._create_indexes(c, table + suffix)
+        DatasetDatabase._create_catalog(c)
+        DatasetDatabase._create_last_run(c)
+
+    @staticmethod
+    def _create_catalog(c):
+        c.execute("CREATE TABLE IF NOT EXISTS catalog("
+                  "series_id integer PRIMARY KEY,"
+                  "first_ts int,"
+                  "last_ts int,"
+                  "num_points int"
+                  ");")
+
+    @staticmethod
+    def _create_last_run(c):
+        c.execute("CREATE TABLE IF NOT EXISTS last_run("
+                  "series_id integer PRIMARY KEY,"
+                  "tick int,"
+                  "n int"
+                  ");")
+
+    @staticmethod
+    def _create_indexes(c, table):
+        """
+        create the secondary indexes of a data table. (series_id, ts) answers the first and last date-time of every
+        time-series without reading its rows and is smaller than the table for counting them
+        """
+        c.execute("CREATE INDEX IF NOT EXISTS %s_ts ON %s(series_id, ts);" % (table, table))
+
+    @staticmethod
+    def get_schema_version(db_name):
+        """
+        :return: the schema version of the database db_name, 0 for the legacy schema, None if it has no tables
+        """
+        conn = sql.connect(db_name)
+        try:
+            if conn.execute("SELECT count(*) FROM sqlite_master WHERE type='table'").fetchone()[0] == 0:
+                return None
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def migrate(db_name):
+        """
+        convert a database of an older schema to the current one, in place. For the legacy schema dates and times
+        are converted to seconds since the epoch and data to REAL, the time-series names are moved to table "series"
+
+        :return: True if the database was migrated, False if it has the current schema (or no tables)
+        """
+        version = DatasetDatabase.get_schema_version(db_name)
+        if version is None or version == SCHEMA_VERSION:
+            return False
+        if version not in [0, 2, 3, 4]:
+            raise Exception("Database \"%s\" has the unknown schema version %d" % (db_name, version))
+
+        logger = logging.getLogger("DatasetDatabase")
+        conn = sql.connect(db_name)
+        c = conn.cursor()
+        if version == 0:
+            DatasetDatabase._migrate_legacy(c)
+        for table in ["dataset", "dataset_normalized"]:
+            DatasetDatabase._create_indexes(c, table)
+        DatasetDatabase._create_catalog(c)
+        c.execute("DELETE FROM catalog;")
+        c.execute("INSERT INTO catalog SELECT series_id, min(ts), max(ts), count(*) FROM dataset GROUP BY series_id;")
+        DatasetDatabase._create_last_run(c)
+        c.execute("PRAGMA user_version = %d;" % SCHEMA_VERSION)
+        conn.commit()
+        if version == 0:
+            c.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            c.execute("VACUUM;")
+        conn.close()
+        logger.info("Migrated database \"%s\" from schema version %d to %d" % (db_name, version, SCHEMA_VERSION))
+        return True
+
+    @staticmethod
+    def _migrate_legacy(c):
+        """
+        replace the tables of the legacy schema with those of the current one, without the secondary indexes
+        """
+        DatasetDatabase._create_tables(c, suffix="_v2", indexes=False)
+        c.execute("INSERT INTO series_v2(name) "
+                  "SELECT name FROM dataset UNION SELECT name FROM dataset_normalized ORDER BY name;")
+        for table in ["dataset", "dataset_normalized"]:
+            # the legacy date is "month/day/year"
+            c.execute("INSERT INTO %s_v2 "
+                      "SELECT s.id, t.tick, "
+                      "CAST(strftime('%%s', substr(t.date, 7, 4) || '-' || substr(t.date, 1, 2) || '-' || "
+                      "substr(t.date, 4, 2) || ' ' || t.time) AS INTEGER), "
+                      "CAST(t.data1 AS REAL), CAST(t.data2 AS REAL) "
+                      "FROM %s t JOIN series_v2 s ON s.name = t.name ORDER BY s.id, t.tick;" % (table, table))
+            c.execute("DROP TABLE %s;" % table)
+            c.execute("ALTER TABLE %s_v2 RENAME TO %s;" % (table, table))
+        c.execute("ALTER TABLE series_v2 RENAME TO series;")
+
+    def get_series_ids(self, names, create=True):
+        """
+        :param names: time-series names
+        :param create: add the names that are not in table "series", not committed
+        :return: the series id of every name, None for the names not in table "series" if create is False
+        :rtype: list
+        """
+        self.assert_connected()
+        if self.series_ids is None:
+            self.series_ids = dict((name, i) for i, name in self.conn.execute("SELECT id, name FROM series"))
+        ids = []
+        for name in names:
+            if name not in self.series_ids and create:
+                self.series_ids[name] = self.conn.execute("INSERT INTO series(name) VALUES (?);", (name,)).lastrowid
+            ids.append(self.series_ids.get(name))
+        return ids
 
     def store_data(self, name, tick, date, time, data1, data2, table="dataset"):
         """
@@ -99,51 +287,204 @@ class DatasetDatabase:
         :param data2: the data of this timepoint for this time-series
         :type data2: int
         """
-        if self.is_connected():
-            assert isinstance(self.conn, sql.Connection)
-            c = self.conn.cursor()
-            assert isinstance(c, sql.Cursor)
-            store_query = "INSERT INTO %s VALUES (?,?,?,?,?,?);" % table
-            try:
-                c.execute(store_query, (name, tick, date, time, data1, data2))
-                self.conn.commit()
-            except sql.IntegrityError as e:
-                self.logger.exception(e)
-        else:
-            raise Exception("Not connected to database")
+        self.store_multiple_data([(name, tick, date, time, data1, data2)], table=table)
 
-    def store_multiple_data(self, multi_data, table="dataset"):
+    def store_multiple_data(self, multi_data, table="dataset", commit=True):
         """
         stores data in list multi_data to database. multi_data is of the form:
         [(name, tick, date, time, data1, data2), (...), ...]
+
+        :param commit: commit the transaction, if False the data are committed by a later commit()
+        """
+        self.assert_connected()
+        names = sorted(set(row[0] for row in multi_data))
+        series_ids = dict(zip(names, self.get_series_ids(names)))
+        rows = [(series_ids[name], tick, date_time_to_timestamp(date, time), float(data1), float(data2))
+                for name, tick, date, time, data1, data2 in multi_data]
+        self.store_rows(rows, table=table, commit=commit)
+
+    def store_rows(self, rows, table="dataset", commit=True):
+        """
+        stores rows of the form [(series_id, tick, ts, data1, data2), (...), ...] to database, the series ids are
+        those of get_series_ids
+
+        :param commit: commit the transaction, if False the data are committed by a later commit()
         """
         if self.is_connected():
             assert isinstance(self.conn, sql.Connection)
             c = self.conn.cursor()
             assert isinstance(c, sql.Cursor)
-            store_query = "INSERT INTO %s VALUES (?,?,?,?,?,?);" % table
+            if table == self.load_table:
+                table += "_load"
+            store_query = "INSERT INTO %s VALUES (?,?,?,?,?);" % table
             try:
-                c.executemany(store_query, multi_data)
-                self.conn.commit()
+                c.executemany(store_query, rows)
+                if table == "dataset":
+                    self._update_catalog(rows)
+                if commit:
+                    self.commit()
             except sql.IntegrityError as e:
                 self.logger.exception(e)
+                if table == "dataset":
+                    # the rows before the failed one are stored
+                    self._rebuild_catalog(set(row[0] for row in rows))
         else:
             raise Exception("Not connected to database")
 
-    def get_time_series(self, name):
+    def update_rows(self, rows, table="dataset"):
+        """
+        update the data of stored rows, not committed. Their date-times do not change, neither does the catalog
+
+        :param rows: [(series_id, tick, data1, data2), (...), ...]
+        """
+        self.assert_connected()
+        self.conn.executemany("UPDATE %s SET data1=?, data2=? WHERE series_id=? AND tick=?;" % table,
+                              [(data1, data2, series_id, tick) for series_id, tick, data1, data2 in rows])
+
+    def store_last_runs(self, runs):
+        """
+        store the number of data averaged into the latest row of time-series, not committed
+
+        :param runs: [(series_id, tick, n), (...), ...] tick is the latest tick of the time-series
+        """
+        self.assert_connected()
+        self.conn.executemany("INSERT OR REPLACE INTO last_run VALUES (?,?,?);", runs)
+
+    def get_last_rows(self):
+        """
+        get the latest row of every time-series of table "dataset" and the number of data averaged into it. If
+        table "last_run" does not have the latest tick of a time-series (its rows were not stored by a conversion),
+        its latest row is taken as one data
+
+        :return: [(time-series name, tick, ts, data1, data2, n), ...]
+        :rtype: list
+        """
+        self.assert_connected()
+        c = self.conn.execute("SELECT s.name, d.tick, d.ts, d.data1, d.data2, coalesce(r.n, 1) FROM series s "
+                              "JOIN dataset d ON d.series_id=s.id "
+                              "AND d.tick=(SELECT max(tick) FROM dataset WHERE series_id=s.id) "
+                              "LEFT JOIN last_run r ON r.series_id=s.id AND r.tick=d.tick ORDER BY s.id")
+        return c.fetchall()
+
+    def _update_catalog(self, rows):
+        """
+        add the rows stored to table "dataset" to the catalog
+        """
+        catalog = {}
+        for series_id, tick, ts, data1, data2 in rows:
+            entry = catalog.get(series_id)
+            if entry is None:
+                catalog[series_id] = [ts, ts, 1]
+            else:
+                if ts < entry[0]:
+                    entry[0] = ts
+                elif ts > entry[1]:
+                    entry[1] = ts
+                entry[2] += 1
+        self.conn.executemany("INSERT INTO catalog VALUES (?,?,?,?) " + CATALOG_UPSERT,
+                              [(series_id, e[0], e[1], e[2]) for series_id, e in catalog.items()])
+
+    def _rebuild_catalog(self, series_ids):
+        """
+        compute the catalog of the time-series series_ids from table "dataset"
+        """
+        for series_id in series_ids:
+            self.conn.execute("DELETE FROM catalog WHERE series_id=?;", (series_id,))
+            self.conn.execute("INSERT INTO catalog SELECT series_id, min(ts), max(ts), count(*) FROM dataset "
+                              "WHERE series_id=? GROUP BY series_id;", (series_id,))
+
+    def commit(self):
+        """
+        commit the current transaction
+        """
+        self.assert_connected()
+        self.conn.commit()
+
+    def bulk_load(self, table="dataset", journal_mode="WAL", synchronous="OFF"):
+        """
+        a context for storing many rows fast, eg.
+
+            with db.bulk_load():
+                db.store_rows(rows)
+
+        Within the context the journal is in journal_mode with synchronous relaxed, the rows are committed as
+        store_rows commits them. The rows of table are appended to table "<table>_load", which has no primary key, and
+        are inserted into table in primary key order when the context exits, so its (series_id, tick) index is built
+        after loading, in one transaction with the rows not committed yet. The journal mode and synchronous setting
+        the database had before are restored when the context exits.
+        Rows loaded and committed by an interrupted context are kept in "<table>_load" and are inserted by the next
+        bulk load of table. They are not seen by the queries of this class until then.
+
+        :param journal_mode: WAL or OFF. With OFF a crash may corrupt the database
+        :param synchronous: OFF or NORMAL
+        :rtype: DatasetBulkLoad
+        """
+        assert journal_mode in ["WAL", "OFF"]
+        assert synchronous in ["OFF", "NORMAL"]
+        return DatasetBulkLoad(self, table, journal_mode, synchronous)
+
+    def _create_checkpoint_table(self):
+        self.execute_query("CREATE TABLE IF NOT EXISTS checkpoint("
+                           "dataset varchar(255) PRIMARY KEY,"
+                           "size int,"
+                           "mtime int,"
+                           "offset int,"
+                           "state text"
+                           ");")
+
+    def store_checkpoint(self, dataset, size, mtime, offset, state):
+        """
+        store the ingestion checkpoint of a dataset, replacing the previous one. The checkpoint is not committed, so
+        it is committed together with the data it describes
+
+        :param dataset: the absolute path of the dataset
+        :param size: the size of the dataset file
+        :param mtime: the modification time of the dataset file (ns)
+        :param offset: the byte offset of the dataset up to which all data are described by the checkpoint
+        :param state: the ingestion state, as a JSON string
+        """
+        self.assert_connected()
+        self._create_checkpoint_table()
+        self.conn.execute("INSERT OR REPLACE INTO checkpoint VALUES (?,?,?,?,?);", (dataset, size, mtime, offset, state))
+
+    def get_checkpoint(self, dataset):
+        """
+        :param dataset: the absolute path of the dataset
+        :return: (size, mtime, offset, state) of the dataset's checkpoint or None if it has none
+        """
+        self.assert_connected()
+        self._create_checkpoint_table()
+        return self.conn.execute("SELECT size, mtime, offset, state FROM checkpoint WHERE dataset=?",
+                                 (dataset,)).fetchone()
+
+    def delete_checkpoint(self, dataset):
+        """
+        delete the checkpoint of the dataset, not committed
+        """
+        self.assert_connected()
+        self._create_checkpoint_table()
+        self.conn.execute("DELETE FROM checkpoint WHERE dataset=?", (dataset,))
+
+    def get_time_series(self, name, start=None, end=None):
         """
         :param name: the time-series name
+        :param start: if not None, only the rows at or after this date-time '%m/%d/%Y-%H:%M:%S'
+        :param end: if not None, only the rows at or before this date-time '%m/%d/%Y-%H:%M:%S'
         :return: None if error occurred else a sql.Cursor that can be treated as an iterator, call the
         cursor’s fetchone() method to retrieve a single matching row, or call fetchall() to get a list
         of the matching rows.
+
+        start and end are a range predicate on ts, answered by index (series_id, ts), so only the rows within
+        start - end are read
         """
         if self.is_connected():
             assert isinstance(self.conn, sql.Connection)
             c = self.conn.cursor()
             assert isinstance(c, sql.Cursor)
-            query = "SELECT date, time, data1, data2 FROM dataset WHERE name=? order by date, time"
+            query, params = DatasetDatabase._time_series_query("%s, %s, data1, data2" % (SQL_DATE, SQL_TIME), name,
+                                                               start, end)
             try:
-                return c.execute(query, (name,))
+                return c.execute(query, params)
             except sql.IntegrityError as e:
                 self.logger.exception(e)
         else:
@@ -151,6 +492,36 @@ class DatasetDatabase:
 
         return None
 
+    def get_time_series_arrays(self, name, start=None, end=None):
+        """
+        the rows of get_time_series as arrays, with the date-times as seconds since the epoch instead of strings
+
+        :return: (timestamps, data1, data2) np.int64, np.float64 and np.float64 arrays ordered by tick
+        :rtype: tuple
+        """
+        self.assert_connected()
+        query, params = DatasetDatabase._time_series_query("ts, data1, data2", name, start, end)
+        rows = self.conn.execute(query, params).fetchall()
+        return (np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+                np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows)),
+                np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows)))
+
+    @staticmethod
+    def _time_series_query(columns, name, start, end):
+        """
+        :return: (query, parameters) of the rows of time-series name within start - end, see get_time_series
+        """
+        query = "SELECT %s FROM dataset WHERE series_id=(SELECT id FROM series WHERE name=?)" % columns
+        params = [name]
+        if start is not None:
+            query += " AND ts >= ?"
+            params.append(date_time_to_timestamp(*start.split("-")))
+        if end is not None:
+            query += " AND ts <= ?"
+            params.append(date_time_to_timestamp(*end.split("-")))
+        query += " order by tick"
+        return query, params
+
     def get_distinct_names(self, range=None, point_threshold=None):
         """
         get all time-series names, filter by range if not None.
@@ -166,7 +537,7 @@ class DatasetDatabase:
         :return: a list with all time-series names
         """
         self.assert_connected()
-        query = "SELECT distinct name FROM dataset"
+        query = "SELECT name FROM series JOIN catalog ON series_id=series.id ORDER BY name"
         c = self.execute_query(query)
         assert c
 
@@ -176,26 +547,56 @@ class DatasetDatabase:
         if range:
             ts_names = list(filter(lambda x: self.time_series_within_range(x, range[0], range[1]), ts_names))
         if point_threshold:
-            assert isinstance(point_threshold, str)
-            maxp = 0
-            ts_lengths = []
-            for ts in ts_names:
-                cur = self.get_num_points(ts)
-                ts_lengths.append([ts, cur])
-                if cur > maxp:
-                    maxp = cur
-            if point_threshold[0] == "%":
-                point_threshold = maxp * float(point_threshold[1:2]) / 100
-            else:
-                point_threshold = float(point_threshold)
-            print("max points: %d" % maxp)
-            print("point threshold: %f" % point_threshold)
-            print("before threshold filtering: %d time-series" % len(ts_lengths))
-            ts_lengths = list(filter(lambda x: x[1] >= point_threshold, ts_lengths))
-            print("after threshold filtering: %d time-series" % len(ts_lengths))
-            ts_names = [x[0] for x in ts_lengths]
+            num_points = self.get_num_points_of_all()
+            ts_names = DatasetDatabase.filter_by_point_threshold([[ts, num_points[ts]] for ts in ts_names],
+                                                                 point_threshold)
         return ts_names
 
+    def get_start_end_timestamps(self):
+        """
+        get the first and last date-time of every time-series, from the catalog
+        returns a dictionary of the form {"time-series name": (first_timestamp, last_timestamp)}
+        timestamps are seconds since the epoch
+        """
+        self.assert_connected()
+        c = self.conn.execute("SELECT name, first_ts, last_ts FROM series JOIN catalog ON series_id=series.id")
+        return dict((name, (first, last)) for name, first, last in c)
+
+    def get_num_points_of_all(self):
+        """
+        get the number of data points of every time-series, from the catalog
+        returns a dictionary of the form {"time-series name": number of points}
+        """
+        self.assert_connected()
+        c = self.conn.execute("SELECT name, num_points FROM series JOIN catalog ON series_id=series.id")
+        return dict(c.fetchall())
+
+    @staticmethod
+    def filter_by_point_threshold(ts_lengths, point_threshold):
+        """
+        keep the time series that have at least point_threshold data points, see get_distinct_names
+
+        :param ts_lengths: [[time-series name, number of points], ...]
+        :param point_threshold: a number of points or a percentage of the max points eg. "%50"
+        :type point_threshold: str
+        :return: the names of the time series kept
+        """
+        assert isinstance(point_threshold, str)
+        maxp = 0
+        for ts, cur in ts_lengths:
+            if cur > maxp:
+                maxp = cur
+        if point_threshold[0] == "%":
+            point_threshold = maxp * float(point_threshold[1:2]) / 100
+        else:
+            point_threshold = float(point_threshold)
+        print("max points: %d" % maxp)
+        print("point threshold: %f" % point_threshold)
+        print("before threshold filtering: %d time-series" % len(ts_lengths))
+        ts_lengths = list(filter(lambda x: x[1] >= point_threshold, ts_lengths))
+        print("after threshold filtering: %d time-series" % len(ts_lengths))
+        return [x[0] for x in ts_lengths]
+
     def time_series_within_range(self, ts_name, start_date, end_date):
         """
         returns true if all points of the time series with name ts_name are within start_date - end_date
@@ -246,17 +647,16 @@ class DatasetDatabase:
             c = self.conn.cursor()
             assert isinstance(c, sql.Cursor)
             if name is None:
-                query = "select min(date), min(time) from dataset"
+                query = "select min(first_ts) from catalog"
             else:
-                query = "select min(date), min(time) from dataset where name=?"
+                query = "select first_ts from catalog where series_id=(SELECT id FROM series WHERE name=?)"
             try:
                 if name is None:
                     c = c.execute(query)
                 else:
                     c = c.execute(query, (name,))
                 res = c.fetchone()
-                date_time = res[0] + "-" + res[1]
-                return date_time
+                return DatasetDatabase._date_time(res[0])
             except sql.IntegrityError as e:
                 self.logger.exception(e)
         else:
@@ -275,22 +675,28 @@ class DatasetDatabase:
         c = self.conn.cursor()
         assert isinstance(c, sql.Cursor)
         if name is None:
-            query = "select max(date), max(time) from dataset"
+            query = "select max(last_ts) from catalog"
         else:
-            query = "select max(date), max(time) from dataset where name=?"
+            query = "select last_ts from catalog where series_id=(SELECT id FROM series WHERE name=?)"
         try:
             if name is None:
                 c = c.execute(query)
             else:
                 c = c.execute(query, (name,))
             res = c.fetchone()
-            date_time = res[0] + "-" + res[1]
-            return date_time
+            return DatasetDatabase._date_time(res[0])
         except sql.IntegrityError as e:
             self.logger.exception(e)
 
         return None
 
+    @staticmethod
+    def _date_time(timestamp):
+        """
+        :return: timestamp as "month/day/year-hours:minutes:seconds"
+        """
+        return "-".join(timestamp_to_date_time(timestamp))
+
     def assert_connected(self):
         if self.is_connected():
             assert isinstance(self.conn, sql.Connection)
@@ -302,12 +708,12 @@ class DatasetDatabase:
         print the min (start) date-time of every time-series
         """
         self.assert_connected()
-        tsnames_list = self.get_distinct_names()
+        start_end_timestamps = self.get_start_end_timestamps()
 
         dt = {}
 
-        for name in tsnames_list:
-            date_time = self.get_first_datetime(name)
+        for timestamps in start_end_timestamps.values():
+            date_time = DatasetDatabase._date_time(timestamps[0])
             if date_time in dt:
                 dt[date_time] += 1
                 continue
@@ -322,12 +728,12 @@ class DatasetDatabase:
         print the max (end) date-time of every time-series
         """
         self.assert_connected()
-        tsnames_list = self.get_distinct_names()
+        start_end_timestamps = self.get_start_end_timestamps()
 
         dt = {}
 
-        for name in tsnames_list:
-            date_time = self.get_last_datetime(name)
+        for timestamps in start_end_timestamps.values():
+            date_time = DatasetDatabase._date_time(timestamps[1])
             if date_time in dt:
                 dt[date_time] += 1
                 continue
@@ -344,7 +750,7 @@ class DatasetDatabase:
         for key, value in self.get_start_end_points(range=range).items():
             print(key + " " + value[0] + "---" + value[1])
 
-    def get_start_end_points(self, range=None, use_file=False, point_threshold=None):
+    def get_start_end_points(self, range=None, use_file=False, point_threshold=None, cache=None):
         """
         get the start date-time and end date-time of every time-series
         returns a dictionary of the form {"time-series name": [start_datetime, end_datetime]}
@@ -352,38 +758,42 @@ class DatasetDatabase:
 
         range is used to filter the time series whose points will be returned
         range = [start_date, end_date]
-        """
-        if not use_file or not os.path.exists("date-time-pairs"):
-            self.assert_connected()
-            tsnames_list = self.get_distinct_names(range=range, point_threshold=point_threshold)
-
-            dt = {}
 
-            for name in tsnames_list:
-                c = self.execute_query("select name, min(date), min(time), max(date), max(time) from dataset "
-                                       "where name='%s'" % name)
-                res = c.fetchone()
-
-                name = res[0]
-                min_date_time = res[1] + "-" + res[2]
-                max_date_time = res[3] + "-" + res[4]
-
-                dt[name] = [min_date_time, max_date_time]
+        if use_file is set, the result is stored in cache (default DatasetCache()) and read from it the next time the
+        same query is performed on the same database
+        """
+        if use_file:
+            cache = cache if cache is not None else DatasetCache()
+            key = DatasetCache.key(self.db_name, "start-end-points", range=range, point_threshold=point_threshold)
+            arrays = cache.get(key)
+            if arrays is not None:
+                return DatasetDatabase._start_end_points_from_arrays(arrays)
 
-            if use_file:
-                with open("date-time-pairs", 'w') as f:
-                    for key, value in dt.items():
-                        print(key + "," + value[0] + "," + value[1], file=f)
-        else:
-            dt = {}
-            with open("date-time-pairs", 'r') as f:
-                for line in f:
-                    line = line[:-1]
-                    split_line = line.split(",")
-                    dt[split_line[0]] = [split_line[1], split_line[2]]
+        self.assert_connected()
+        tsnames_list = self.get_distinct_names(range=range, point_threshold=point_threshold)
+        start_end_timestamps = self.get_start_end_timestamps()
+        timestamps = np.array([start_end_timestamps[name] for name in tsnames_list], dtype=np.int64).reshape(-1, 2)
+        arrays = {"names": np.array(tsnames_list, dtype=str),
+                  "first": timestamps[:, 0].astype("datetime64[s]"),
+                  "last": timestamps[:, 1].astype("datetime64[s]")}
+        if use_file:
+            cache.put(key, arrays)
+        return DatasetDatabase._start_end_points_from_arrays(arrays)
+
+    @staticmethod
+    def _start_end_points_from_arrays(arrays):
+        """
+        :param arrays: {"names": time-series names, "first": first date-times, "last": last date-times}
+        :return: see get_start_end_points
+        """
+        first_dates, first_times = timestamps_to_date_time(arrays["first"].astype(np.int64))
+        last_dates, last_times = timestamps_to_date_time(arrays["last"].astype(np.int64))
+        dt = {}
+        for name, fd, ft, ld, lt in zip(arrays["names"].tolist(), first_dates, first_times, last_dates, last_times):
+            dt[name] = [fd + "-" + ft, ld + "-" + lt]
         return dt
 
-    def get_all_points(self, range=None, use_file=False, point_threshold=None):
+    def get_all_points(self, range=None, use_file=False, point_threshold=None, cache=None):
         """
         get all points of every time series. Point is a date-time that the time-series has data for
         returns a dictionary of the form {"time-series name": np.array([d1,d2,d3, ...])}
@@ -392,44 +802,68 @@ class DatasetDatabase:
 
         range is used to filter the time series whose points will be returned
         range = [start_date, end_date]
+
+        if use_file is set, the result is stored in cache (default DatasetCache()) and read from it the next time the
+        same query is performed on the same database
         """
-        if not use_file or not os.path.exists("all-date-time-points"):
-            self.assert_connected()
-            tsnames_list = self.get_distinct_names(range=range, point_threshold=point_threshold)
-
-            dt = {}
-
-            for name in tsnames_list:
-                c = self.execute_query("select name, date, time from dataset "
-                                       "where name='%s' order by date, time" % name)
-
-                # d = self.db_name.execute_query("select count(date) from dataset "
-                # "where name='%s'" % name).fetchone()[0]
-                # d = int(d)
-                for res in c:
-                    name = res[0]
-                    date_time = res[1] + "-" + res[2]
-
-                    if name in dt:
-                        dt[name].append(date_time)
-                    else:
-                        dt[name] = [date_time]
-                        # print(d, len(dt[name]))
-                        # assert d == len(dt[name])
-            if use_file:
-                with open("all-date-time-points", 'w') as f:
-                    for key, value in dt.items():
-                        print(key + "," + ",".join(value), file=f)
-        else:
-            dt = {}
-            with open("all-date-time-points", 'r') as f:
-                for line in f:
-                    line = line[:-1]
-                    split_line = line.split(",")
-                    dt[split_line[0]] = split_line[1:]
-
-        for key, value in dt.items():
-            dt[key] = np.array(value)
+        if use_file:
+            cache = cache if cache is not None else DatasetCache()
+            key = DatasetCache.key(self.db_name, "all-points", range=range, point_threshold=point_threshold)
+            arrays = cache.get(key)
+            if arrays is not None:
+                return DatasetDatabase._all_points_from_arrays(arrays)
+
+        self.assert_connected()
+        tsnames_list = self.get_distinct_names(range=range, point_threshold=point_threshold)
+        points = [p.view(np.int64) for name, p in self.iter_all_points(tsnames_list)]
+        # the points of all time-series in one array, the points of time-series i are points[offsets[i]:offsets[i+1]]
+        offsets = np.zeros(len(points) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in points])
+        arrays = {"names": np.array(tsnames_list, dtype=str),
+                  "points": np.concatenate(points + [np.empty(0, dtype=np.int64)]).astype("datetime64[s]"),
+                  "offsets": offsets}
+        if use_file:
+            cache.put(key, arrays)
+        return DatasetDatabase._all_points_from_arrays(arrays)
+
+    def iter_all_points(self, names=None, range=None, point_threshold=None, batch_size=100000):
+        """
+        generator variant of get_all_points, for databases too big to hold every point of every time-series as
+        strings. The rows of every time-series are fetched batch_size at a time into one preallocated array, so at
+        most one time-series is in memory at any time, 8 bytes per point.
+
+        :param names: the time-series names in the order they are yielded, default get_distinct_names(range,
+                      point_threshold)
+        :return: generator of (time-series name, np.ndarray of datetime64[s] ordered by tick)
+        """
+        self.assert_connected()
+        if names is None:
+            names = self.get_distinct_names(range=range, point_threshold=point_threshold)
+        num_points = self.get_num_points_of_all()
+        for name, series_id in zip(names, self.get_series_ids(names, create=False)):
+            assert series_id is not None, "Unknown time-series %s" % name
+            points = np.empty(num_points[name], dtype=np.int64)
+            c = self.conn.execute("SELECT ts FROM dataset WHERE series_id=? ORDER BY tick", (series_id,))
+            n = 0
+            for rows in iter(lambda: c.fetchmany(batch_size), []):
+                points[n:n + len(rows)] = [row[0] for row in rows]
+                n += len(rows)
+            assert n == len(points)
+            yield name, points.view("datetime64[s]")
+
+    @staticmethod
+    def _all_points_from_arrays(arrays):
+        """
+        :param arrays: {"names": time-series names, "points": the date-times of all time-series, "offsets": where the
+                       date-times of every time-series start in points}
+        :return: see get_all_points
+        """
+        dates, times = timestamps_to_date_time(arrays["points"].astype(np.int64))
+        date_times = np.array([date + "-" + time for date, time in zip(dates, times)])
+        offsets = arrays["offsets"].tolist()
+        dt = {}
+        for i, name in enumerate(arrays["names"].tolist()):
+            dt[name] = date_times[offsets[i]:offsets[i + 1]]
         return dt
 
     def get_num_points(self, time_series):
@@ -437,6 +871,143 @@ class DatasetDatabase:
         get the number of data points the specified time series has
         """
         self.assert_connected()
-        num = self.execute_query("select count(data1) from dataset where name='%s'" % time_series).fetchone()[0]
-        assert num
-        return num
+        res = self.conn.execute("select num_points from catalog where series_id=(SELECT id FROM series WHERE name=?)",
+                                (time_series,)).fetchone()
+        assert res and res[0]
+        return res[0]
+
+
+class DatasetBulkLoad:
+    """
+    see DatasetDatabase.bulk_load
+    """
+
+    def __init__(self, db: DatasetDatabase, table, journal_mode, synchronous):
+        self.db = db
+        self.table = table
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.restored = None  # the (journal mode, synchronous) of the database before the bulk load
+
+    def __enter__(self):
+        db = self.db
+        db.assert_connected()
+        assert db.load_table is None
+        # the journal mode can not change within a transaction
+        db.commit()
+        self.restored = (db.conn.execute("PRAGMA journal_mode;").fetchone()[0],
+                         db.conn.execute("PRAGMA synchronous;").fetchone()[0])
+        db.conn.execute("PRAGMA journal_mode=%s;" % self.journal_mode)
+        db.conn.execute("PRAGMA synchronous=%s;" % self.synchronous)
+        db.conn.execute("CREATE TABLE IF NOT EXISTS %s_load("
+                        "series_id int,"
+                        "tick int,"
+                        "ts int,"
+                        "data1 real,"
+                        "data2 real"
+                        ");" % self.table)
+        db.commit()
+        db.load_table = self.table
+        return db
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        db = self.db
+        db.load_table = None
+        try:
+            if exc_type is None:
+                # in the same transaction as the rows not committed yet
+                db.conn.execute("INSERT INTO %s SELECT * FROM %s_load ORDER BY series_id, tick;"
+                                % (self.table, self.table))
+                if self.table == "dataset":
+                    db.conn.execute("INSERT INTO catalog SELECT series_id, min(ts), max(ts), count(*) "
+                                    "FROM dataset_load WHERE true GROUP BY series_id " + CATALOG_UPSERT)
+                db.conn.execute("DROP TABLE %s_load;" % self.table)
+                db.commit()
+                # return the pages of the dropped table, the pragma frees one page per step so it is run as a script
+                db.conn.executescript("PRAGMA incremental_vacuum;")
+            else:
+                # as after a crash, only the committed rows are kept
+                db.conn.rollback()
+        except Exception:
+            db.conn.rollback()
+            raise
+        finally:
+            db.conn.execute("PRAGMA journal_mode=%s;" % self.restored[0])
+            db.conn.execute("PRAGMA synchronous=%d;" % self.restored[1])
+        return False
+
+
+class DatasetDatabasePool:
+    """
+    Read-only connections to a database for parallel readers, one DatasetDatabase (URI mode=ro) per thread and per
+    process, opened on first use by get(). Every connection of the pool gets the same cache settings.
+
+    Readers of different time-series stream their own cursors in parallel: sqlite3 releases the GIL while it reads,
+    and in WAL journal mode readers neither block nor are blocked by a writer. A process forked after the pool was
+    created opens new connections, a sqlite connection must not be used across fork.
+    """
+
+    def __init__(self, db_name, cache_size=None, mmap_size=None):
+        """
+        :param db_name: the database file
+        :param cache_size: if not None, "PRAGMA cache_size" of every connection, pages or -KiB if negative
+        :param mmap_size: if not None, "PRAGMA mmap_size" of every connection in bytes, memory mapped reads share
+                          the pages of the file between the connections of all threads and processes
+        """
+        self.db_name = db_name
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.databases = []  # every connected DatasetDatabase of this process, closed by close()
+
+    def __getstate__(self):
+        # a pool given to a worker process opens its own connections
+        return self.db_name, self.cache_size, self.mmap_size
+
+    def __setstate__(self, state):
+        self.db_name, self.cache_size, self.mmap_size = state
+        self._reset()
+
+    def get(self):
+        """
+        :return: the connected read-only DatasetDatabase of the calling thread
+        :rtype: DatasetDatabase
+        """
+        if self.pid != os.getpid():
+            # forked, the connections belong to the parent
+            self._reset()
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = DatasetDatabase(self.db_name, read_only=True).connect()
+            if self.cache_size is not None:
+                db.conn.execute("PRAGMA cache_size = %d;" % self.cache_size)
+            if self.mmap_size is not None:
+                db.conn.execute("PRAGMA mmap_size = %d;" % self.mmap_size)
+            self.local.db = db
+            with self.lock:
+                self.databases.append(db)
+        return db
+
+    def close(self):
+        """
+        disconnect every connection of the pool opened by this process, they must not be in use
+        """
+        if self.pid != os.getpid():
+            self._reset()
+            return
+        with self.lock:
+            for db in self.databases:
+                db.disconnect()
+            self.databases = []
+        self.local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
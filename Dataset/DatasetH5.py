@@ -2,17 +2,96 @@ import h5py
 import os
 import numpy as np
 
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
 __author__ = 'gm'
 
+# how the time series are stored in a hdf5 dataset:
+# series: one float32 dataset of m points per time series, named after it
+# matrix: one chunked N x m float32 dataset "matrix", row i holds the time series named names[i] of dataset "names",
+#         attribute "layout" of the file is "matrix"
+LAYOUTS = ["series", "matrix"]
+
+# the attributes of the file that describe the points, kept by every file derived from it (eg normalized):
+# interval: the seconds between two points, 1 if missing
+# aggregation: how the points of an interval were computed from the raw rows, see DatasetDB2HDF5.AGGREGATIONS
+# window_start, window_end: the date-times '%m/%d/%Y-%H:%M:%S' of the first and the last second of the time axis
+POINT_ATTRIBUTES = ["interval", "aggregation", "window_start", "window_end"]
+
+# the size of a chunk of the matrix layout, whole rows are chunked together
+MATRIX_CHUNK_BYTES = 1024 * 1024
+
+# the compression filters of the hdf5 datasets, see compression_options
+# none: not compressed
+# lzf: fast, fixed level, shipped with h5py
+# gzip: the shuffle filter followed by gzip of compression_level
+# blosc-lz4: blosc with lz4 and its own shuffle, needs module hdf5plugin
+CODECS = ["none", "lzf", "gzip", "blosc-lz4"]
+
+# the codec of the fourier coefficients stored by DatasetH5.compute_fourier
+COEFF_CODEC = "lzf"
+
+# the time series the correlation algorithms read at once, see DatasetH5.read_block
+READ_BLOCK_SIZE = 64
+
+
+def compression_options(codec=None, compression_level=None) -> dict:
+    """
+    :param codec: one of CODECS, None is gzip if compression_level is given else none
+    :param compression_level: 1-9, the level of gzip (default 4) and blosc-lz4 (default 5)
+    :return: the keyword arguments of h5py create_dataset for codec
+    """
+    assert codec in [None] + CODECS
+    assert compression_level in [None, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+    if codec is None:
+        codec = "gzip" if compression_level else "none"
+    if codec == "lzf":
+        return {"compression": "lzf"}
+    if codec == "gzip":
+        return {"compression": "gzip", "compression_opts": compression_level or 4, "shuffle": True}
+    if codec == "blosc-lz4":
+        if hdf5plugin is None:
+            raise Exception("Module hdf5plugin is needed for codec blosc-lz4")
+        return dict(hdf5plugin.Blosc(cname="lz4", clevel=compression_level or 5, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    return {}
+
 
 class DatasetH5:
-    def __init__(self, dataset_name):
+    """
+    A hdf5 dataset of time series of the same length m, of any of the LAYOUTS. The time series are addressed by
+    their index in self.ts_names, which is ordered by name in both layouts
+    """
+
+    def __init__(self, dataset_name, coeff_codec=COEFF_CODEC, mode='a'):
+        """
+        :param dataset_name: the hdf5 file
+        :param coeff_codec: the codec of the fourier coefficients stored in the _coeff.h5 file, one of CODECS
+        :param mode: the h5py mode the file is opened in, 'r' for a file that is only read, eg a read-only or shared
+                     file
+        """
         self.name = dataset_name
+        self.coeff_codec = coeff_codec
         self.ts_names = []
         assert os.path.exists(dataset_name)
-        self.f = h5py.File(self.name, 'a')
-        for ts in self.f:
-            self.ts_names.append(ts)
+        self.f = h5py.File(self.name, mode)
+        self.matrix = None  # the dataset "matrix" of the matrix layout
+        self.row_attributes = None  # the attributes of the rows of the matrix, read by attributes
+        if self.f.attrs.get("layout") == "matrix":
+            self.matrix = self.f["matrix"]
+            self.ts_names = [n.decode("utf-8") if isinstance(n, bytes) else n for n in self.f["names"][:].tolist()]
+        else:
+            for ts in self.f:
+                self.ts_names.append(ts)
+        self.interval = int(self.f.attrs.get("interval", 1))  # the seconds between two points
+
+    def point_attributes(self) -> dict:
+        """
+        :return: the POINT_ATTRIBUTES the file has, to pass to the DatasetH5Writer of a file derived from it
+        """
+        return dict((name, self.f.attrs[name]) for name in POINT_ATTRIBUTES if name in self.f.attrs)
 
     def __enter__(self):
         return self
@@ -28,13 +107,85 @@ class DatasetH5:
         return self.ts_names
 
     def __len__(self):
-        return len(self.f)
+        return len(self.ts_names)
 
     def __getitem__(self, item):
+        """
+        :param item: the index of the time series in self.ts_names
+        :return: the time series, a h5py.Dataset in the series layout or a np.ndarray in the matrix layout. Both
+                 support len() and [:] to read all points
+        """
+        if self.matrix is not None:
+            return self.matrix[item]
         return self.f[self.ts_names[item]]
 
     def __iter__(self):
-        return self.f.__iter__()
+        return iter(self.ts_names)
+
+    def read(self, time_series, start=None, stop=None) -> np.ndarray:
+        """
+        :param time_series: the name of the time series or its index in self.ts_names
+        :param start: if not None, the points before start are not read
+        :param stop: if not None, the points from stop on are not read
+        :return: all points of the time series
+        """
+        if isinstance(time_series, str):
+            if self.matrix is None:
+                return self.f[time_series][start:stop]
+            time_series = self.ts_names.index(time_series)
+        return self[time_series][start:stop]
+
+    def read_point(self, j) -> np.ndarray:
+        """
+        :return: the point j of every time series, in the order of self.ts_names
+        """
+        if self.matrix is not None:
+            return self.matrix[:, j]
+        return np.array([self.f[ts][j] for ts in self.ts_names], dtype='float32')
+
+    def attributes(self, index) -> dict:
+        """
+        :return: the attributes of the time series index, see DatasetH5Writer.set_attributes
+        """
+        if self.matrix is None:
+            return dict(self.f[self.ts_names[index]].attrs)
+        if self.row_attributes is None:
+            self.row_attributes = dict((name, values[:]) for name, values in self.f.get("attributes", {}).items())
+        return dict((name, values[index]) for name, values in self.row_attributes.items())
+
+    def attribute(self, name):
+        """
+        :return: the attribute name of every time series as a np.ndarray, see attributes, None if it is missing
+        """
+        if self.matrix is None:
+            values = [self.f[ts].attrs.get(name) for ts in self.ts_names]
+            return None if any(v is None for v in values) else np.array(values)
+        if "attributes" not in self.f or name not in self.f["attributes"]:
+            return None
+        return self.f["attributes"][name][:]
+
+    def read_block(self, indices, start=None, stop=None) -> np.ndarray:
+        """
+        read many time series at once, in the matrix layout with a single read of the rows
+
+        :param indices: the indices of the time series in self.ts_names, a list or a range
+        :param start: if not None, the points before start are not read
+        :param stop: if not None, the points from stop on are not read
+        :return: a len(indices) x m array, row j is time series indices[j]
+        """
+        indices = list(indices)
+        if len(indices) == 0:
+            m = len(range(len(self[0]))[start:stop]) if len(self) else 0
+            return np.zeros((0, m), dtype='float32')
+        if self.matrix is None:
+            return np.stack([self.f[self.ts_names[i]][start:stop] for i in indices])
+        if indices == list(range(indices[0], indices[-1] + 1)):
+            return self.matrix[indices[0]:indices[-1] + 1, start:stop]
+        # h5py reads rows given in increasing order without duplicates
+        rows = sorted(set(indices))
+        block = self.matrix[rows, start:stop]
+        position = dict((r, j) for j, r in enumerate(rows))
+        return block[[position[i] for i in indices]]
 
     def compute_fourier(self, time_series, k: int, disable_store=False):
         """
@@ -56,12 +207,12 @@ class DatasetH5:
                     k = len(ts_coeff)
                 return ts_coeff[0:k]
 
-        d = self.f[time_series]
+        d = self.read(time_series)
         fft = np.fft.fft(d)/len(d)
         if k > len(fft):
             k = len(fft)
         if not disable_store:
-            coeff_db.create_dataset(time_series, (len(fft),), data=fft, compression="gzip", compression_opts=9)
+            coeff_db.create_dataset(time_series, (len(fft),), data=fft, **compression_options(self.coeff_codec))
             coeff_db.close()
         return fft[0:k]
 
@@ -74,3 +225,165 @@ class DatasetH5:
         close the hdf5 database
         """
         self.f.close()
+
+
+class DatasetH5Writer:
+    """
+    Writes the time series of a hdf5 dataset in one of the LAYOUTS, see DatasetH5. In the matrix layout the rows are
+    ordered by name, as DatasetH5 orders the time series of the series layout, whatever the order of the writes.
+    The rows of a chunk are gathered in memory and the chunk is written (and compressed) once all of them are written.
+
+    The time axis of the datasets is resizable (maxshape None), a DatasetH5Writer with append=True extends the time
+    series of an existing file with the points of a later time
+    """
+
+    def __init__(self, hdf5_name, names, m, layout="series", compression_level=None, attrs=None, codec=None,
+                 chunk_size=None, append=False):
+        """
+        :param hdf5_name: the hdf5 file to create
+        :param names: the names of all time series that will be written
+        :param m: the number of points of every time series
+        :param layout: one of LAYOUTS
+        :param compression_level: None or the level 1-9 of codec
+        :param attrs: the attributes of the file, eg POINT_ATTRIBUTES
+        :param codec: one of CODECS, see compression_options
+        :param chunk_size: the bytes of a chunk, None is chosen by h5py in the series layout and MATRIX_CHUNK_BYTES
+                           in the matrix layout. A chunk holds whole rows of the matrix
+        :param append: resize the time series of the existing hdf5_name to m points instead of creating it. names,
+                       layout, compression_level, codec and chunk_size are those of the file
+        """
+        assert chunk_size is None or chunk_size >= 4
+        self.hdf5_name = hdf5_name
+        self.m = m
+        self.offset = None  # the index of the first point written of every time series, see write
+        self.rows = None  # {time series name: row of the matrix}
+        self.chunk_rows = None
+        self.blocks = {}  # the chunks being gathered {chunk index: [rows of the chunk, number of rows written]}
+        self.attributes = {}  # the attributes of the rows of the matrix {attribute name: np.ndarray}
+        if append:
+            self._open(m)
+        else:
+            self._create(names, m, layout, compression_level, codec, chunk_size)
+        for name, value in (attrs or {}).items():
+            self.h5.attrs[name] = value
+
+    def _create(self, names, m, layout, compression_level, codec, chunk_size):
+        assert layout in LAYOUTS
+        self.layout = layout
+        self.options = compression_options(codec, compression_level)  # of create_dataset
+        if chunk_size is not None and layout == "series" and m > 0:
+            self.options["chunks"] = (max(1, min(m, chunk_size // 4)),)
+        self.h5 = h5py.File(self.hdf5_name, mode='w')
+        if layout == "matrix":
+            names = sorted(names)
+            self.rows = dict((name, i) for i, name in enumerate(names))
+            self.h5.attrs["layout"] = "matrix"
+            self.h5.create_dataset("names", data=names, dtype=h5py.string_dtype())
+            self.chunk_rows = max(1, min(len(names), (chunk_size or MATRIX_CHUNK_BYTES) // (4 * max(m, 1))))
+            if len(names) > 0 and m > 0:
+                self.options["chunks"] = (self.chunk_rows, m)
+            self.h5.create_dataset("matrix", (len(names), m), dtype='float32', maxshape=(len(names), None),
+                                   **self.options)
+
+    def _open(self, m):
+        self.h5 = h5py.File(self.hdf5_name, mode='a')
+        if self.h5.attrs.get("layout") == "matrix":
+            self.layout = "matrix"
+            datasets = [self.h5["matrix"]]
+            names = [n.decode("utf-8") if isinstance(n, bytes) else n for n in self.h5["names"][:].tolist()]
+            self.rows = dict((name, i) for i, name in enumerate(names))
+            self.chunk_rows = datasets[0].chunks[0] if datasets[0].chunks else max(1, len(names))
+            for name, values in self.h5.get("attributes", {}).items():
+                self.attributes[name] = values[:]
+        else:
+            self.layout = "series"
+            datasets = list(self.h5.values())
+        for dataset in datasets:
+            if dataset.maxshape[-1] is not None:
+                raise Exception("the time series of \"%s\" are not resizable, it was written by a previous version"
+                                % self.hdf5_name)
+            assert dataset.shape[-1] <= m
+            dataset.resize(m, axis=len(dataset.shape) - 1)
+
+    def write(self, ts_name, ts_array, offset=0):
+        """
+        write the points offset to m - 1 of time series ts_name, the points before offset are not changed (written
+        before the append). Every time series is written from the same offset
+        """
+        assert offset + len(ts_array) == self.m
+        if self.offset is None:
+            self.offset = offset
+        assert offset == self.offset
+        if self.layout == "matrix":
+            row = self.rows[ts_name]
+            b = row // self.chunk_rows
+            block = self.blocks.get(b)
+            if block is None:
+                size = min(self.chunk_rows, len(self.rows) - b * self.chunk_rows)
+                block = self.blocks[b] = [np.zeros((size, self.m - offset), dtype='float32'), 0]
+            block[0][row - b * self.chunk_rows] = ts_array
+            block[1] += 1
+            if block[1] == len(block[0]):
+                self._write_block(b)
+        elif ts_name in self.h5:
+            self.h5[ts_name][offset:] = ts_array
+        else:
+            assert offset == 0
+            self.h5.create_dataset(ts_name, (len(ts_array),), data=ts_array, dtype='float32', maxshape=(None,),
+                                   **self.options)
+
+    def write_range(self, ts_name, values, start):
+        """
+        write the points start to start + len(values) - 1 of time series ts_name, a time series too long to be held in
+        memory is written by consecutive ranges. In the matrix layout a range is written to its row at once instead of
+        being gathered with the other rows of its chunk, the writes of a file are either all write or all write_range
+        """
+        assert start + len(values) <= self.m and self.offset in (None, 0)
+        self.offset = 0
+        if self.layout == "matrix":
+            self.h5["matrix"][self.rows[ts_name], start:start + len(values)] = values
+            return
+        if ts_name not in self.h5:
+            self.h5.create_dataset(ts_name, (self.m,), dtype='float32', maxshape=(None,), **self.options)
+        self.h5[ts_name][start:start + len(values)] = values
+
+    def set_attributes(self, ts_name, attrs):
+        """
+        set the attributes of time series ts_name, after it is written. They are the attributes of its dataset in the
+        series layout, and in the matrix layout the rows of datasets named after the attributes, in group "attributes"
+
+        :param attrs: {attribute name: number}
+        """
+        if self.layout == "matrix":
+            row = self.rows[ts_name]
+            for name, value in attrs.items():
+                if name not in self.attributes:
+                    self.attributes[name] = np.full(len(self.rows), np.nan)
+                self.attributes[name][row] = value
+        else:
+            self.h5[ts_name].attrs.update(attrs)
+
+    def _write_block(self, b):
+        start = b * self.chunk_rows
+        rows = self.blocks.pop(b)[0]
+        self.h5["matrix"][start:start + len(rows), self.offset:] = rows
+
+    def close(self):
+        """
+        write the chunks not complete, the rows not written are 0, the attributes of the rows and close the file
+        """
+        for b in sorted(self.blocks.keys()):
+            self._write_block(b)
+        if self.attributes:
+            group = self.h5.require_group("attributes")
+            for name, values in self.attributes.items():
+                if name in group:
+                    del group[name]
+                group.create_dataset(name, data=values)
+        self.h5.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -41,13 +41,14 @@ class DatasetPlotter:
         plt.show()
 
     @staticmethod
-    def plot_all_points(time_series_points: list):
+    def plot_all_points(time_series_points):
         """
-        time_series_points is a list of the form [[d1,d2,d3, ...], ...] where dx is datetime
-        a row holds all date-times for which the time series has data
-        the list holds all date-times for every time-series
+        time_series_points is an iterable of the form [[d1,d2,d3, ...], ...] where dx is datetime, it can be a
+        generator such as the points of DatasetDatabase.iter_all_points, then only one time-series is in memory
+        a row holds all date-times for which the time-series has data
+        the iterable holds all date-times for every time-series
 
-        date-time is of type str --> "month/day/year-hours:minutes:seconds"
+        a row is a np.ndarray of type datetime64 or a list of str --> "month/day/year-hours:minutes:seconds"
         """
         plt.figure(figsize=(12, 8))
         plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m/%d/%Y\n%H:%M:%S'))
@@ -57,13 +58,14 @@ class DatasetPlotter:
 
         t = 0
         for points in time_series_points:
-            dates = points
-            x = [dt.datetime.strptime(d, DATE_FORMAT) for d in dates]
-            y = [t] * len(x)
+            if isinstance(points, np.ndarray) and np.issubdtype(points.dtype, np.datetime64):
+                x = points
+            else:
+                x = [dt.datetime.strptime(d, DATE_FORMAT) for d in points]
+            y = np.full(len(x), t)
             plt.plot(x, y, ",", color="blue")
             t += 1
 
         plt.ylim([-t * 0.1, t + t * 0.1])
 
         plt.show()
-
@@ -1,7 +1,137 @@
 __author__ = 'gm'
 
+import bz2
+import datetime as dt
+import functools
+import gzip
 import io
 import logging
+import lzma
+import mmap
+import numpy as np
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EPOCH = dt.datetime(1970, 1, 1)
+
+# compressed datasets are decompressed while read, the compression is chosen by the file extension
+COMPRESSED_EXTENSIONS = {
+    ".gz": "gzip",
+    ".bz2": "bz2",
+    ".xz": "xz",
+    ".lzma": "xz",
+    ".zst": "zstd",
+    ".zstd": "zstd",
+}
+
+
+def timestamp_to_date_time(timestamp: int):
+    """
+    convert seconds since the epoch to the date and time strings used by the dataset
+
+    :return: ("month/day/year", "hours:minutes:seconds")
+    :rtype: tuple
+    """
+    d = EPOCH + dt.timedelta(seconds=int(timestamp))
+    return d.strftime("%m/%d/%Y"), d.strftime("%H:%M:%S")
+
+
+def date_time_to_timestamp(date: str, time: str) -> int:
+    """
+    convert the date and time strings used by the dataset to seconds since the epoch
+
+    :param date: "month/day/year"
+    :param time: "hours:minutes:seconds"
+    """
+    return _date_to_timestamp(date) + int(time[0:2]) * 3600 + int(time[3:5]) * 60 + int(time[6:8])
+
+
+@functools.lru_cache(maxsize=1024)
+def _date_to_timestamp(date: str) -> int:
+    return (dt.datetime(int(date[6:10]), int(date[0:2]), int(date[3:5])) - EPOCH).days * 86400
+
+
+def timestamps_to_date_time(timestamps: np.ndarray):
+    """
+    convert an array of seconds since the epoch to lists of date and time strings. Every distinct second is
+    formatted only once
+
+    :return: [dates], [times]
+    :rtype: tuple
+    """
+    unique_ts, inverse = np.unique(timestamps, return_inverse=True)
+    pairs = [timestamp_to_date_time(t) for t in unique_ts.tolist()]
+    dates = [pairs[i][0] for i in inverse.tolist()]
+    times = [pairs[i][1] for i in inverse.tolist()]
+    return dates, times
+
+
+def _digits(a: np.ndarray, positions: np.ndarray, n: int) -> np.ndarray:
+    """
+    read the n digit decimal numbers that start at positions of the byte array a
+    """
+    value = np.zeros(len(positions), dtype=np.int64)
+    for i in range(n):
+        value = value * 10 + (a[positions + i].astype(np.int64) - 48)
+    return value
+
+
+def _fields(a: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    gather the variable length fields a[starts[i]:ends[i]] into a fixed width bytes array
+    """
+    lengths = ends - starts
+    width = max(int(lengths.max()) if len(lengths) > 0 else 0, 1)
+    gathered = np.zeros((len(starts), width), dtype=np.uint8)
+    last = len(a) - 1
+    for i in range(width):
+        # one column of bytes at a time keeps the temporaries at the size of a single column
+        gathered[:, i] = np.where(i < lengths, a[np.minimum(starts + i, last)], 0)
+    return gathered.view("S%d" % width).ravel()
+
+
+class DatasetChunk:
+    """
+    A chunk of dataset lines, parsed column by column
+
+    name_ids index the names of the DatasetReader that produced the chunk, timestamps are the date-times of the
+    lines as seconds since the epoch. Chunks of averaged rows (see DatasetAggregator) also have ticks
+    """
+
+    def __init__(self, name_ids: np.ndarray, timestamps: np.ndarray, data1: np.ndarray, data2: np.ndarray,
+                 ticks=None):
+        self.name_ids = name_ids
+        """:type: np.ndarray"""
+        self.timestamps = timestamps
+        """:type: np.ndarray"""
+        self.data1 = data1
+        """:type: np.ndarray"""
+        self.data2 = data2
+        """:type: np.ndarray"""
+        self.ticks = ticks
+        """:type: np.ndarray"""
+
+    def __len__(self):
+        return len(self.name_ids)
+
+    @staticmethod
+    def concatenate(chunks: list):
+        """
+        :return: one chunk with the rows of all chunks, in order
+        :rtype: DatasetChunk
+        """
+        ticks = None
+        if all(c.ticks is not None for c in chunks):
+            ticks = np.concatenate([c.ticks for c in chunks])
+        return DatasetChunk(np.concatenate([c.name_ids for c in chunks]),
+                            np.concatenate([c.timestamps for c in chunks]),
+                            np.concatenate([c.data1 for c in chunks]),
+                            np.concatenate([c.data2 for c in chunks]),
+                            ticks=ticks)
 
 
 class DatasetReader:
@@ -9,44 +139,112 @@ class DatasetReader:
     Provides functionality to read data from a specific dataset
     """
 
-    def __init__(self, dataset_path: str):
+    def __init__(self, dataset_path: str, chunk_size=100000000):
         """
         :param dataset_path: the path to the dataset we want read data
+        :param chunk_size: read this many bytes (rounded up to the end of the line) at a time
         """
         self.dataset_path = dataset_path
         self.dataset_handle = None
-        """:type: io.TextIOWrapper"""
+        """:type: io.BufferedIOBase"""
+        self.dataset_map = None  # uncompressed datasets are memory mapped
+        """:type: mmap.mmap"""
+        self.position = 0  # the byte offset of the next chunk (of the decompressed data for compressed datasets)
+        self.chunk_size = chunk_size
+        self.end = None  # stop reading at this byte offset, None reads to EOF
         self.time_buffer = {}
         self.logger = logging.getLogger("DatasetReader")
+        self.names = []  # time-series names, indexed by the name ids of the chunks
+        self.name_ids = {}  # {"time-series name": name id}
         self.input_buffer = []
         self.chunk_no = 0
+        self.bytes_read = 0
         self.input_buffer_i = 0
 
-    def open_dataset(self):
+    @staticmethod
+    def get_compression(dataset_path: str):
         """
-        opens the dataset specified in dataset_path for reading
+        :return: the compression of the dataset ("gzip", "bz2", "xz", "zstd") or None if it is not compressed
+        """
+        return COMPRESSED_EXTENSIONS.get(os.path.splitext(dataset_path)[1].lower())
+
+    def open_dataset(self, start=0, end=None):
+        """
+        opens the dataset specified in dataset_path for reading. Compressed datasets are decompressed as they are
+        read, uncompressed datasets are memory mapped and parsed directly from the mapping
+
+        :param start: the byte offset to start reading from, must be the beginning of a line. Compressed datasets
+                      are decompressed up to start
+        :param end: the byte offset to stop reading at, must be the beginning of a line or None to read till EOF.
+                    Must be None for compressed datasets
         """
         if self.dataset_handle is None:
-            self.dataset_handle = open(self.dataset_path, 'r')
-            self.time_buffer = {}
-            self.chunk_no = 0
-            self.input_buffer_i = 0
-            self.input_buffer = []
-            self.logger.info("Open dataset file \"%s\" for reading" % self.dataset_path)
+            compression = DatasetReader.get_compression(self.dataset_path)
+            if compression is not None and end is not None:
+                raise Exception("Byte ranges can not be read from compressed dataset \"%s\"" % self.dataset_path)
+
+            if compression == "gzip":
+                self.dataset_handle = gzip.open(self.dataset_path, 'rb')
+            elif compression == "bz2":
+                self.dataset_handle = bz2.open(self.dataset_path, 'rb')
+            elif compression == "xz":
+                self.dataset_handle = lzma.open(self.dataset_path, 'rb')
+            elif compression == "zstd":
+                if zstandard is None:
+                    raise Exception("Module zstandard is needed to read dataset \"%s\"" % self.dataset_path)
+                reader = zstandard.ZstdDecompressor().stream_reader(open(self.dataset_path, 'rb'),
+                                                                    read_across_frames=True, closefd=True)
+                self.dataset_handle = io.BufferedReader(reader)
+            else:
+                self.dataset_handle = open(self.dataset_path, 'rb')
+                if os.fstat(self.dataset_handle.fileno()).st_size > 0:
+                    self.dataset_map = mmap.mmap(self.dataset_handle.fileno(), 0, access=mmap.ACCESS_READ)
+            self.end = end
+            self._reset()
+            self.position = start
+            if self.dataset_map is None:
+                skip = start
+                while skip > 0:
+                    skipped = len(self.dataset_handle.read(min(skip, self.chunk_size)))
+                    if skipped == 0:
+                        break
+                    skip -= skipped
+            self.logger.info("Open dataset file \"%s\" for reading (bytes %d-%s, compression: %s)"
+                             % (self.dataset_path, start, end, compression))
 
     def close_dataset(self):
         """
         closes the dataset specified in dataset_path
         """
         if self.dataset_handle is not None:
+            if self.dataset_map is not None:
+                self.dataset_map.close()
+                self.dataset_map = None
             self.dataset_handle.close()
             self.dataset_handle = None
-            self.time_buffer = {}
-            self.chunk_no = 0
-            self.input_buffer_i = 0
-            self.input_buffer = []
+            self._reset()
             self.logger.info("Close dataset file \"%s\"" % self.dataset_path)
 
+    def _reset(self):
+        self.time_buffer = {}
+        self.names = []
+        self.name_ids = {}
+        self.position = 0
+        self.chunk_no = 0
+        self.bytes_read = 0
+        self.input_buffer_i = 0
+        self.input_buffer = []
+
+    def set_names(self, names: list):
+        """
+        set the names of the name ids, eg. those of a previous reader of the same dataset. Must be called before
+        reading any data
+        """
+        assert len(self.names) == 0
+        for name in names:
+            self.name_ids[name] = len(self.names)
+            self.names.append(name)
+
     def __iter__(self):
         return self
 
@@ -60,8 +258,142 @@ class DatasetReader:
             return t
 
     def _get_data_chunk(self):
-        assert isinstance(self.dataset_handle, io.TextIOWrapper)
-        self.input_buffer = self.dataset_handle.readlines(100000000)
+        """
+        read the next chunk_size bytes of the dataset, extended to the end of the last line. Chunks of memory
+        mapped datasets are views of the mapping, nothing is copied
+
+        :rtype: bytes | memoryview
+        """
+        assert self.dataset_handle is not None
+        if self.dataset_map is not None:
+            end = len(self.dataset_map) if self.end is None else self.end
+            if self.position >= end:
+                return b""
+            stop = min(self.position + self.chunk_size, end)
+            if stop < end:
+                newline = self.dataset_map.find(b"\n", stop - 1, end)
+                stop = end if newline == -1 else newline + 1
+            data = memoryview(self.dataset_map)[self.position:stop]
+            self.position = stop
+            return data
+
+        data = self.dataset_handle.read(self.chunk_size)
+        if len(data) > 0 and not data.endswith(b"\n"):
+            data += self.dataset_handle.readline()
+        self.position += len(data)
+        return data
+
+    @staticmethod
+    def split_dataset(dataset_path: str, shards: int, start=0) -> list:
+        """
+        split the dataset in (at most) shards byte ranges of about the same size. Every range starts at the
+        beginning of a line and ends at the beginning of the line that follows its last line
+
+        :param start: split only the part of the dataset after this byte offset, must be the beginning of a line
+        :return: [(start, end), ...] ordered by start
+        :rtype: list
+        """
+        assert shards > 0
+        size = os.path.getsize(dataset_path)
+        if start >= size:
+            return []
+        bounds = [start]
+        with open(dataset_path, 'rb') as f:
+            for i in range(1, shards):
+                pos = max(start + (size - start) * i // shards, bounds[-1] + 1)
+                if pos >= size:
+                    break
+                # the previous byte is read as well, so that a range already starting a line is kept
+                f.seek(pos - 1)
+                f.readline()
+                bound = f.tell()
+                if bounds[-1] < bound < size:
+                    bounds.append(bound)
+        bounds.append(size)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def get_next_chunk(self):
+        """
+        read and parse the next chunk of the dataset
+
+        :return: the parsed chunk or None if reached EOF
+        :rtype: DatasetChunk
+        """
+        while True:
+            data = self._get_data_chunk()
+            if len(data) == 0:
+                return None
+            self.bytes_read += len(data)
+            print("Processing chunk %d -- read %d MB" % (self.chunk_no, self.bytes_read // 1000000))
+            self.chunk_no += 1
+            chunk = self.parse_chunk(data)
+            if isinstance(data, memoryview):
+                # the mapping can not be closed while views of it exist
+                data.release()
+            if len(chunk) > 0:
+                return chunk
+
+    def parse_chunk(self, data):
+        """
+        parse a buffer of complete dataset lines "name,month/day/year,hours:minutes:seconds,data1,data2" into
+        columns. Every column is computed with array operations over the whole buffer, only the distinct names are
+        handled one by one.
+
+        :param data: the lines to parse
+        :type data: bytes | memoryview
+        :rtype: DatasetChunk
+        """
+        a = np.frombuffer(data, dtype=np.uint8)
+
+        # line boundaries, a missing newline at the end of the buffer is tolerated
+        ends = np.flatnonzero(a == 10)
+        if len(a) > 0 and a[-1] != 10:
+            ends = np.append(ends, len(a))
+        starts = np.empty_like(ends)
+        starts[:1] = 0
+        starts[1:] = ends[:-1] + 1
+        crlf = np.zeros(len(ends), dtype=bool)
+        crlf[ends > starts] = a[ends[ends > starts] - 1] == 13
+        ends = ends - crlf
+        non_empty = ends > starts
+        starts = starts[non_empty]
+        ends = ends[non_empty]
+        n = len(starts)
+
+        # every line has exactly 4 commas
+        commas = np.flatnonzero(a == 44)
+        line_of_comma = np.searchsorted(ends, commas)
+        if len(commas) != 4 * n or np.any(np.bincount(line_of_comma, minlength=n) != 4):
+            raise ValueError("malformed line in dataset \"%s\", expected 5 comma separated values"
+                             % self.dataset_path)
+        commas = commas.reshape((n, 4))
+        c0, c1, c2, c3 = commas[:, 0], commas[:, 1], commas[:, 2], commas[:, 3]
+
+        # name ids, the ids are stable for all the chunks read through this reader
+        local_names, local_ids = np.unique(_fields(a, starts, c0), return_inverse=True)
+        translate = np.empty(len(local_names), dtype=np.int32)
+        for i, name in enumerate(local_names.tolist()):
+            name = name.decode("utf-8")
+            if name not in self.name_ids:
+                self.name_ids[name] = len(self.names)
+                self.names.append(name)
+            translate[i] = self.name_ids[name]
+        name_ids = translate[local_ids.ravel()]
+
+        # date-time '%m/%d/%Y,%H:%M:%S' packed as seconds since the epoch
+        if np.any(c1 - c0 != 11) or np.any(c2 - c1 != 9):
+            raise ValueError("malformed date-time in dataset \"%s\", expected month/day/year,hours:minutes:seconds"
+                             % self.dataset_path)
+        month = _digits(a, c0 + 1, 2)
+        day = _digits(a, c0 + 4, 2)
+        year = _digits(a, c0 + 7, 4)
+        months = (year - 1970) * 12 + month - 1
+        days = months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) + day - 1
+        timestamps = days * 86400 + _digits(a, c1 + 1, 2) * 3600 + _digits(a, c1 + 4, 2) * 60 + _digits(a, c1 + 7, 2)
+
+        data1 = _fields(a, c2 + 1, c3).astype(np.float64)
+        data2 = _fields(a, c3 + 1, ends).astype(np.float64)
+        return DatasetChunk(name_ids, timestamps, data1, data2)
 
     def get_next_data(self):
         """
@@ -70,22 +402,21 @@ class DatasetReader:
         :return: (name, date, time, data1, data2) or None if reached EOF
         :rtype: tuple
         """
-        assert isinstance(self.dataset_handle, io.TextIOWrapper)
+        assert self.dataset_handle is not None
 
         if self.input_buffer_i >= len(self.input_buffer):
-            self._get_data_chunk()
-            if len(self.input_buffer) == 0:
+            chunk = self.get_next_chunk()
+            if chunk is None:
+                self.input_buffer = []
                 return None
-            print("Processing chunk %d -- read %d MB" % (self.chunk_no, (self.chunk_no+1)*100))
-            self.chunk_no += 1
+            names = [self.names[i] for i in chunk.name_ids.tolist()]
+            dates, times = timestamps_to_date_time(chunk.timestamps)
+            self.input_buffer = list(zip(names, dates, times, chunk.data1.tolist(), chunk.data2.tolist()))
             self.input_buffer_i = 0
 
-        line = self.input_buffer[self.input_buffer_i].rstrip('\n')
+        line = self.input_buffer[self.input_buffer_i]
         self.input_buffer_i += 1
-        if line == "":
-            return None
-        name, date, time, data1, data2 = line.split(",")
-        return name, date, time, float(data1), float(data2)
+        return line
 
     def get_next_data_averaged(self):
         """
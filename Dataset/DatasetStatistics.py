@@ -0,0 +1,108 @@
+import numpy as np
+
+__author__ = 'gm'
+
+
+class DatasetStatistics:
+    """
+    Running count, mean and sum of squared deviations from the mean (m2) of the points of a time series. Batches of
+    points are merged with the parallel algorithm of Chan et al., so the statistics of a time series can be kept up
+    to date as points are appended, without reading the points already seen.
+
+    The statistics are stored as the attributes ATTRIBUTES of a time series of a hdf5 dataset, see
+    DatasetH5Writer.set_attributes, with the SUMMARY of the statistics:
+    std: the population standard deviation
+    constant: 1 if std is 0, the time series is not normalized then
+    energy: the sum of the squares of the normalized points, the points of a time series if it is constant
+    """
+
+    ATTRIBUTES = ["count", "mean", "m2"]
+    SUMMARY = ["std", "constant", "energy"]
+
+    # a std below this fraction of the mean is rounding error of a constant time series, the float32 points differ by
+    # more than 1e-8 of their value
+    CONSTANT_TOLERANCE = 1e-9
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = int(count)
+        self.mean = float(mean)
+        self.m2 = float(m2)
+
+    @staticmethod
+    def from_attributes(attrs):
+        """
+        :param attrs: the attributes of a time series, see DatasetH5.attributes
+        :return: the DatasetStatistics stored in attrs, None if they are missing
+        """
+        if any(name not in attrs for name in DatasetStatistics.ATTRIBUTES):
+            return None
+        return DatasetStatistics(attrs["count"], attrs["mean"], attrs["m2"])
+
+    def attributes(self) -> dict:
+        """
+        :return: the ATTRIBUTES and the SUMMARY of the statistics
+        """
+        std = self.std()
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "std": std, "constant": int(std == 0),
+                "energy": float(self.count) if std != 0 else self.count * self.mean * self.mean}
+
+    def update(self, values: np.ndarray):
+        """
+        add the points values
+        """
+        n = len(values)
+        if n == 0:
+            return
+        values = np.asarray(values, dtype='float64')
+        mean = values.mean()
+        m2 = np.square(values - mean).sum()
+        count = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / count
+        self.m2 += m2 + delta * delta * self.count * n / count
+        self.count = count
+
+    def remove(self, value: float):
+        """
+        remove a point added before, eg a point that is replaced
+        """
+        assert self.count > 0
+        value = float(value)  # a np.float32 value would make the result float32
+        if self.count == 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        count = self.count - 1
+        mean = (self.mean * self.count - value) / count
+        self.m2 = max(0.0, self.m2 - (value - mean) * (value - self.mean))
+        self.mean = mean
+        self.count = count
+
+    def std(self) -> float:
+        """
+        :return: the population standard deviation, as np.std, 0 for a constant time series
+        """
+        if self.count == 0:
+            return 0.0
+        std = float(np.sqrt(self.m2 / self.count))
+        if std <= DatasetStatistics.CONSTANT_TOLERANCE * abs(self.mean):
+            return 0.0
+        return std
+
+    def normalize(self, values: np.ndarray) -> np.ndarray:
+        """
+        :return: (values - mean) / std, as DatasetDBNormalizer.normalize_time_series values are returned as they are
+                 if std is 0
+        """
+        std = self.std()
+        if std == 0:
+            return np.asarray(values)
+        return (np.asarray(values, dtype='float64') - self.mean) / std
+
+    def denormalize(self, normalized: np.ndarray) -> np.ndarray:
+        """
+        :return: the points normalized by normalize
+        """
+        std = self.std()
+        if std == 0:
+            return np.asarray(normalized, dtype='float64')
+        return np.asarray(normalized, dtype='float64') * std + self.mean
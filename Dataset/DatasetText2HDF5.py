@@ -0,0 +1,163 @@
+from .DatasetReader import DatasetReader, EPOCH
+from .DatasetAggregator import DatasetAggregator
+from .DatasetDatabase import DatasetDatabase, DATE_FORMAT
+from .DatasetDB2HDF5 import DatasetDB2HDF5
+from .DatasetDBNormalizer import DatasetDBNormalizer
+from .DatasetH5 import DatasetH5Writer
+from .DatasetStatistics import DatasetStatistics
+import datetime as dt
+import logging
+import numpy as np
+
+__author__ = 'gm'
+
+
+class DatasetText2HDF5:
+    """
+    Converts a dataset file straight to a hdf5 database, without the sqlite3 database in between. The result is the
+    same as that of DatasetConverter followed by DatasetDB2HDF5 (and DatasetDBNormalizer.normalize_hdf5)
+
+    The dataset is parsed twice: the first pass finds the first and last date-time and the number of points of every
+    time series, the second gap fills the averaged rows of every chunk into the hdf5 datasets as they are parsed. Only
+    a chunk and the latest point of every time series are held in memory, whatever the size of the dataset
+    """
+
+    def __init__(self, dataset_name, hdf5_name, chunk_size=100000000):
+        """
+        :param dataset_name: the dataset file
+        :param hdf5_name: the hdf5 database file to be created
+        :param chunk_size: the dataset is parsed chunk_size bytes at a time
+        """
+        self.dataset = dataset_name
+        self.hdf5_name = hdf5_name
+        self.chunk_size = chunk_size
+        self.names = []  # time-series names, indexed by name id
+        self.first_ts = None  # the first date-time of every time series, indexed by name id
+        self.last_ts = None  # the last date-time of every time series
+        self.num_points = None  # the number of averaged rows of every time series
+        self.logger = logging.getLogger("DatasetText2HDF5")
+
+    def convert(self, range=None, compression_level=None, point_threshold=None, normalized_hdf5_name=None,
+                layout="series", codec=None, chunk_size=None):
+        """
+        parse the dataset and write every time series to the hdf5 database with one point per second, see
+        DatasetDB2HDF5.convert for range, point_threshold, layout, codec and chunk_size
+
+        :param normalized_hdf5_name: if not None, the normalized time series are written to this hdf5 database, from
+                                     the hdf5 database once it is written (see DatasetDBNormalizer.normalize_hdf5)
+        """
+        assert compression_level in [None, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+        self._read_extents()
+        selected = self.num_points > 0
+        if not selected.any():
+            raise Exception("Dataset \"%s\" has no data" % self.dataset)
+
+        # the globally first and last date-times (of all time series), clipped to range
+        first_timestamp, last_timestamp = DatasetDB2HDF5.clip_to_range(range, int(self.first_ts[selected].min()),
+                                                                       int(self.last_ts[selected].max()))
+
+        if range:
+            start = (dt.datetime.strptime(range[0], DATE_FORMAT) - EPOCH).total_seconds()
+            end = (dt.datetime.strptime(range[1], DATE_FORMAT) - EPOCH).total_seconds()
+            selected &= (start <= self.first_ts) & (self.last_ts <= end)
+        if point_threshold:
+            ts_lengths = [[i, self.num_points[i]] for i in np.flatnonzero(selected).tolist()]
+            kept = DatasetDatabase.filter_by_point_threshold(ts_lengths, point_threshold)
+            selected[:] = False
+            selected[kept] = True
+
+        ts_names = [self.names[i] for i in np.flatnonzero(selected).tolist()]
+        m = last_timestamp - first_timestamp + 1
+        attrs = DatasetDB2HDF5.point_attributes(first_timestamp, last_timestamp)
+        with DatasetH5Writer(self.hdf5_name, ts_names, m, layout=layout, compression_level=compression_level,
+                             attrs=attrs, codec=codec, chunk_size=chunk_size) as h5:
+            self._write_gap_filled(h5, selected, first_timestamp, m)
+        if normalized_hdf5_name is not None:
+            DatasetDBNormalizer.normalize_hdf5(self.hdf5_name, normalized_hdf5_name, compression_level, layout=layout,
+                                               codec=codec, chunk_size=chunk_size)
+
+    def _read_rows(self):
+        """
+        :return: generator of the averaged rows of the dataset, a DatasetChunk (with ticks) per chunk parsed
+        """
+        reader = DatasetReader(self.dataset, chunk_size=self.chunk_size)
+        reader.open_dataset()
+        reader.set_names(self.names)
+        aggregator = DatasetAggregator()
+        for chunk in iter(reader.get_next_chunk, None):
+            yield aggregator.process(chunk)
+        yield aggregator.flush()
+        self.names = reader.names
+        reader.close_dataset()
+
+    def _read_extents(self):
+        """
+        first pass: the first and last date-time and the number of points of every time series
+        """
+        self.names = []
+        first_ts = np.zeros(0, dtype=np.int64)
+        last_ts = np.zeros(0, dtype=np.int64)
+        num_points = np.zeros(0, dtype=np.int64)
+        rows = 0
+        for chunk in self._read_rows():
+            if len(chunk) == 0:
+                continue
+            n = int(chunk.name_ids.max()) + 1
+            if n > len(num_points):
+                first_ts = np.append(first_ts, np.full(n - len(first_ts), np.iinfo(np.int64).max))
+                last_ts = np.append(last_ts, np.full(n - len(last_ts), np.iinfo(np.int64).min))
+                num_points = np.append(num_points, np.zeros(n - len(num_points), dtype=np.int64))
+            np.minimum.at(first_ts, chunk.name_ids, chunk.timestamps)
+            np.maximum.at(last_ts, chunk.name_ids, chunk.timestamps)
+            num_points[:n] += np.bincount(chunk.name_ids, minlength=n)
+            rows += len(chunk)
+        # time series named but without data (of an empty chunk) have no points
+        missing = len(self.names) - len(num_points)
+        self.first_ts = np.append(first_ts, np.zeros(missing, dtype=np.int64))
+        self.last_ts = np.append(last_ts, np.zeros(missing, dtype=np.int64))
+        self.num_points = np.append(num_points, np.zeros(missing, dtype=np.int64))
+        self.logger.info("Read %d rows of %d time series from \"%s\"" % (rows, len(self.names), self.dataset))
+
+    def _write_gap_filled(self, h5, selected, first_timestamp, m):
+        """
+        second pass: gap fill the selected time series, as DatasetDB2HDF5.fill_gaps does, chunk by chunk. The seconds
+        from the latest point written of a time series up to its next point get the data of the latest point, so
+        only the latest point of every time series is kept between chunks. The DatasetStatistics of every time series
+        are merged from its parts and stored as its attributes
+
+        :param selected: the name ids written
+        :param m: the number of points of every time series
+        """
+        latest_index = np.full(len(self.names), -1, dtype=np.int64)  # -1 before the first point
+        latest_data = np.zeros(len(self.names), dtype='float32')
+        statistics = dict((i, DatasetStatistics()) for i in np.flatnonzero(selected).tolist())
+        for chunk in self._read_rows():
+            keep = selected[chunk.name_ids]
+            ids = chunk.name_ids[keep]
+            order = np.argsort(ids, kind="stable")
+            ids = ids[order]
+            index = chunk.timestamps[keep][order] - first_timestamp
+            data = chunk.data1[keep][order].astype('float32')
+            new_series = np.ones(len(ids), dtype=bool)
+            new_series[1:] = ids[1:] != ids[:-1]
+            bounds = np.append(np.flatnonzero(new_series), len(ids)).tolist()
+            for b in range(len(bounds) - 1):
+                i = int(ids[bounds[b]])
+                points_index = index[bounds[b]:bounds[b + 1]]
+                points_data = data[bounds[b]:bounds[b + 1]]
+                if latest_index[i] < 0:
+                    # the seconds before the first point get its data
+                    latest_index[i], latest_data[i] = 0, points_data[0]
+                start = latest_index[i]
+                filled = np.repeat(np.append(latest_data[i], points_data[:-1]),
+                                   np.diff(np.append(start, points_index)))
+                self._write_points(h5, i, start, filled, statistics[i])
+                latest_index[i], latest_data[i] = points_index[-1], points_data[-1]
+        for i, s in statistics.items():
+            self._write_points(h5, i, latest_index[i], np.full(m - latest_index[i], latest_data[i]), s)
+            h5.set_attributes(self.names[i], s.attributes())
+
+    def _write_points(self, h5, i, start, points, statistics):
+        if len(points) > 0:
+            h5.write_range(self.names[i], points, start)
+            statistics.update(points)
@@ -39,8 +39,10 @@ class FourierApproximation:
         loads given batch to the cache
         """
         assert isinstance(batch, list)
-        for ts in batch:
-            self.__load_ts_to_cache(ts)
+        missing = [ts for ts in batch if self.norm_cache[ts] is None]
+        # a single read of all rows in the matrix layout
+        for ts, data in zip(missing, self.norm_ds.read_block(missing)):
+            self.norm_cache[ts] = data
 
     def __load_ts_to_cache(self, ts: int):
         """
@@ -48,7 +50,7 @@ class FourierApproximation:
         """
         assert isinstance(ts, int)
         if self.norm_cache[ts] is None:
-            self.norm_cache[ts] = self.norm_ds[ts].value
+            self.norm_cache[ts] = self.norm_ds[ts][:]
 
     def __clear_cache(self):
         """
@@ -6,9 +6,12 @@ import pickle
 from Dataset.DatasetPlotter import DatasetPlotter
 from Dataset.DatasetConverter import DatasetConverter
 from Dataset.DatasetDatabase import DatasetDatabase
-from Dataset.DatasetDB2HDF5 import DatasetDB2HDF5
+from Dataset.DatasetDB2HDF5 import DatasetDB2HDF5, AGGREGATIONS
+from Dataset.DatasetText2HDF5 import DatasetText2HDF5
 from Dataset.DatasetDatabase import DATE_FORMAT
+from Dataset.DatasetCache import DatasetCache, DEFAULT_CACHE_FOLDER, DEFAULT_CACHE_SIZE
 from Dataset.DatasetDBNormalizer import DatasetDBNormalizer
+from Dataset.DatasetH5 import LAYOUTS, CODECS
 from PearsonCorrelation import PearsonCorrelation
 from FourierApproximation import FourierApproximation
 from BooleanCorrelation import BooleanCorrelation
@@ -39,8 +42,25 @@ def main():
                                    help="the dataset file")
     parser_dataset2db.add_argument("database_file",
                                    help="the database name, default='dataset.db'")
+    parser_dataset2db.add_argument("-j", "--jobs", type=int, default=1,
+                                   help="the number of processes that parse the dataset in parallel. The dataset is "
+                                        "split in byte ranges that are parsed and averaged by the worker processes, "
+                                        "default=1")
+    parser_dataset2db.add_argument("--resume", action="store_true",
+                                   help="continue an interrupted conversion of the dataset from its last checkpoint "
+                                        "in the database")
+    parser_dataset2db.add_argument("--append", action="store_true",
+                                   help="append the dataset (eg. a new trading day) to the time-series already in the "
+                                        "database, their ticks continue from the stored ones")
     parser_dataset2db.set_defaults(func=dataset2db)
 
+    parser_dbmigrate = subparsers.add_parser('dbmigrate',
+                                             help="convert a database created by an older version to the current "
+                                                  "schema, in place")
+    parser_dbmigrate.add_argument("database_file",
+                                  help="the database file")
+    parser_dbmigrate.set_defaults(func=dbmigrate)
+
     parser_dates = subparsers.add_parser('dates',
                                          help="plot all time-series date-time range in one graph")
     parser_dates.set_defaults(func=dates)
@@ -59,8 +79,13 @@ def main():
                               help="plot all time series points in one graph. A point is a date-time for which"
                                    " the time-series has data")
     parser_dates.add_argument("-f", "--use-file", action="store_true", default=False,
-                              help="store the query result in a file so that next time the query is not performed, "
-                                   "data are read from the file")
+                              help="store the query result in the cache folder so that next time the same query is "
+                                   "performed on the same database, data are read from the cache")
+    parser_dates.add_argument("--cache-folder", default=DEFAULT_CACHE_FOLDER,
+                              help="the cache folder of --use-file, default=%s" % DEFAULT_CACHE_FOLDER)
+    parser_dates.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // 1000000,
+                              help="the max size of the cache folder in MB, the least recently used results are "
+                                   "removed when it is exceeded, default=%d" % (DEFAULT_CACHE_SIZE // 1000000))
     parser_dates.add_argument("--range", default=None,
                               help="Only time series whose points are within start_date-end_date range are considered. "
                                    "format: '%m/%d/%Y-%H:%M:%S--%m/%d/%Y-%H:%M:%S "
@@ -86,8 +111,15 @@ def main():
     parser_db2h5.add_argument("hdf5_file",
                               help="the HDF5 file")
     parser_db2h5.add_argument("-c", "--compress", type=int, default=None,
-                              help="compress on the fly the HDF5 file, using gzip. Supply a number 1-9. 1 is low"
-                                   "compression, 9 is high")
+                              help="compress on the fly the HDF5 file, using gzip or --codec. Supply a number 1-9. "
+                                   "1 is low compression, 9 is high")
+    parser_db2h5.add_argument("--codec", choices=CODECS, default=None,
+                              help="the compression of the HDF5 file: none, lzf (fast), gzip (with the shuffle filter, "
+                                   "level -c) or blosc-lz4 (level -c, needs module hdf5plugin). Default is gzip if -c "
+                                   "is given else none")
+    parser_db2h5.add_argument("--chunk-size", type=int, default=None,
+                              help="the size of the HDF5 chunks in KiB, see Benchmark.BenchmarkH5Codecs. Default is "
+                                   "chosen by h5py for the series layout and 1024 for the matrix layout")
     parser_db2h5.add_argument("--range", default=None,
                               help="Only time series whose points are within start_date-end_date range are considered. "
                                    "format: '%m/%d/%Y-%H:%M:%S--%m/%d/%Y-%H:%M:%S "
@@ -97,6 +129,58 @@ def main():
                                    " percentage eg '%50'. This means that time series with data points less than"
                                    " 0.5 * max-points-in-given-range are ignored. Where this max is the number of"
                                    " points of the time series with the most points, that fits in the given range")
+    parser_db2h5.add_argument("-j", "--jobs", type=int, default=1,
+                              help="the number of processes that read and gap fill the time series in parallel, "
+                                   "the HDF5 file is written by one process, default=1")
+    parser_db2h5.add_argument("--layout", choices=LAYOUTS, default="series",
+                              help="series: one HDF5 dataset per time-series. matrix: one chunked N x m matrix, "
+                                   "read in blocks of time-series by the correlation algorithms, default=series")
+    parser_db2h5.add_argument("--interval", type=int, default=1,
+                              help="the seconds between two points of the time series, eg 60 for 1 minute bars. "
+                                   "It is stored in the interval attribute of the HDF5 file, default=1")
+    parser_db2h5.add_argument("--agg", choices=AGGREGATIONS, default="last",
+                              help="how the points of an interval are computed. last: the last data, mean: the mean "
+                                   "data, ohlc: 4 time-series NAME.open, NAME.high, NAME.low and NAME.close, vwap: "
+                                   "the mean data weighted by data2, default=last")
+    parser_db2h5.add_argument("--append", action="store_true", default=False,
+                              help="append the data after the last date-time of the existing HDF5 file, eg a new "
+                                   "day added by dataset2db --append. The other options are those the HDF5 file was "
+                                   "created with, --range and --threshold can not be given. Run h5norm on the "
+                                   "HDF5 file again afterwards, every normalized point changes with the means and "
+                                   "stds of the time-series")
+    parser_db2h5.add_argument("--normalized", default=None,
+                              help="also write the normalized time series to this HDF5 file, in the same pass. "
+                                   "Same as running h5norm on the HDF5 file")
+    parser_dataset2h5 = subparsers.add_parser('dataset2h5',
+                                              help="parse the given dataset and convert it straight to hdf5, without "
+                                                   "the sqlite database. Same as dataset2db followed by db2h5. The "
+                                                   "dataset is parsed twice, its rows are not held in memory")
+    parser_dataset2h5.set_defaults(func=dataset2h5)
+    parser_dataset2h5.add_argument("dataset_file",
+                                   help="the dataset file")
+    parser_dataset2h5.add_argument("hdf5_file",
+                                   help="the HDF5 file")
+    parser_dataset2h5.add_argument("-c", "--compress", type=int, default=None,
+                                   help="compress on the fly the HDF5 file, using gzip or --codec. Supply a number "
+                                        "1-9. 1 is low compression, 9 is high")
+    parser_dataset2h5.add_argument("--codec", choices=CODECS, default=None,
+                                   help="the compression of the HDF5 file, see db2h5")
+    parser_dataset2h5.add_argument("--chunk-size", type=int, default=None,
+                                   help="the size of the HDF5 chunks in KiB, see db2h5")
+    parser_dataset2h5.add_argument("--range", default=None,
+                                   help="Only time series whose points are within start_date-end_date range are "
+                                        "considered. format: '%m/%d/%Y-%H:%M:%S--%m/%d/%Y-%H:%M:%S "
+                                        "eg. --range '01/01/2016-00:00:00--01/01/2016-20:00:00'")
+    parser_dataset2h5.add_argument("--threshold", default=None,
+                                   help="ignore time series with less than threshold data points. This can also be a"
+                                        " percentage eg '%50'. This means that time series with data points less than"
+                                        " 0.5 * max-points-in-given-range are ignored. Where this max is the number of"
+                                        " points of the time series with the most points, that fits in the given range")
+    parser_dataset2h5.add_argument("--normalized", default=None,
+                                   help="also write the normalized time series to this HDF5 file, once the HDF5 file "
+                                        "is written. Same as running h5norm on the HDF5 file")
+    parser_dataset2h5.add_argument("--layout", choices=LAYOUTS, default="series",
+                                   help="the layout of the HDF5 files, see db2h5, default=series")
     parser_h5norm = subparsers.add_parser('h5norm',
                                           help="normalize a hdf5 database")
     parser_h5norm.set_defaults(func=h5norm)
@@ -105,8 +189,19 @@ def main():
     parser_h5norm.add_argument("h5normalized",
                                help="the normalizedHDF5 file")
     parser_h5norm.add_argument("-c", "--compress", type=int, default=None,
-                               help="compress on the fly the HDF5 file, using gzip. Supply a number 1-9. 1 is low"
-                                    "compression, 9 is high")
+                               help="compress on the fly the HDF5 file, using gzip or --codec. Supply a number 1-9. "
+                                    "1 is low compression, 9 is high")
+    parser_h5norm.add_argument("--codec", choices=CODECS, default=None,
+                               help="the compression of the HDF5 file, see db2h5")
+    parser_h5norm.add_argument("--chunk-size", type=int, default=None,
+                               help="the size of the HDF5 chunks in KiB, see db2h5")
+    parser_h5norm.add_argument("--layout", choices=LAYOUTS, default="series",
+                               help="the layout of the normalized HDF5 file, see db2h5. The HDF5 file to normalize "
+                                    "can have any layout, default=series")
+    parser_h5norm.add_argument("--read-size", type=int, default=None,
+                               help="normalize the time-series in two passes over ranges of READ_SIZE points, bounding "
+                                    "the memory used for long time-series. By default every time-series is read at "
+                                    "once")
     parser_corr = subparsers.add_parser('corr',
                                         help="Find the correlations of time-series in the given dataset")
     parser_corr.set_defaults(func=corr)
@@ -149,35 +244,62 @@ def dates(args):
         DatasetDatabase(args.database_file).connect().print_start_end_points(range=args.range,
                                                                              point_threshold=args.threshold)
     elif args.action == plot_dates:
+        cache = DatasetCache(args.cache_folder, args.cache_size * 1000000)
         if not args.all:
             point_dic = DatasetDatabase(args.database_file).connect() \
-                .get_start_end_points(range=args.range, use_file=args.use_file, point_threshold=args.threshold)
+                .get_start_end_points(range=args.range, use_file=args.use_file, point_threshold=args.threshold,
+                                      cache=cache)
             datetime_pairs = []
             for key, value in point_dic.items():
                 datetime_pairs.append(value)
             DatasetPlotter.plot_start_end_points(sorted(datetime_pairs, key=lambda x: x[0] + x[-1]))
         else:
-            point_dic = DatasetDatabase(args.database_file).connect() \
-                .get_all_points(range=args.range, use_file=args.use_file, point_threshold=args.threshold)
-            points = []
-            for key, value in point_dic.items():
-                points.append(value)
-            DatasetPlotter.plot_all_points(sorted(points, key=lambda x: x[0] + x[-1]))
+            # ordered by their first and last points, from the catalog, then streamed one time-series at a time
+            db = DatasetDatabase(args.database_file).connect()
+            point_dic = db.get_start_end_points(range=args.range, use_file=args.use_file,
+                                                point_threshold=args.threshold, cache=cache)
+            names = sorted(point_dic.keys(), key=lambda x: point_dic[x][0] + point_dic[x][-1])
+            DatasetPlotter.plot_all_points(points for name, points in db.iter_all_points(names))
 
 
 def dataset2db(args):
-    dc = DatasetConverter(args.dataset_file, args.database_file)
+    dc = DatasetConverter(args.dataset_file, args.database_file, jobs=args.jobs, resume=args.resume,
+                          append=args.append)
     dc.convert()
 
 
+def dbmigrate(args):
+    if DatasetDatabase.migrate(args.database_file):
+        print("migrated %s" % args.database_file)
+    else:
+        print("%s has the current schema" % args.database_file)
+
+
+def chunk_size(args):
+    """
+    :return: the --chunk-size of args in bytes
+    """
+    if args.chunk_size is None:
+        return None
+    return args.chunk_size * 1024
+
+
 def db2h5(args):
     if args.range:
         args.range = args.range.split("--")
     conv = DatasetDB2HDF5(args.database_file, args.hdf5_file)
-    if args.compress:
-        conv.convert(range=args.range, compression_level=args.compress, point_threshold=args.threshold)
-    else:
-        conv.convert()
+    conv.convert(range=args.range, compression_level=args.compress, point_threshold=args.threshold, jobs=args.jobs,
+                 layout=args.layout, interval=args.interval, agg=args.agg, codec=args.codec,
+                 chunk_size=chunk_size(args), append=args.append, normalized_hdf5_name=args.normalized)
+
+
+def dataset2h5(args):
+    if args.range:
+        args.range = args.range.split("--")
+    conv = DatasetText2HDF5(args.dataset_file, args.hdf5_file)
+    conv.convert(range=args.range, compression_level=args.compress, point_threshold=args.threshold,
+                 normalized_hdf5_name=args.normalized, layout=args.layout, codec=args.codec,
+                 chunk_size=chunk_size(args))
 
 
 def calc(args):
@@ -199,7 +321,8 @@ def calc(args):
 
 
 def h5norm(args):
-    DatasetDBNormalizer.normalize_hdf5(args.h5database, args.h5normalized, args.compress)
+    DatasetDBNormalizer.normalize_hdf5(args.h5database, args.h5normalized, args.compress, layout=args.layout,
+                                       codec=args.codec, chunk_size=chunk_size(args), read_size=args.read_size)
 
 
 def corr(args):
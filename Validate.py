@@ -3,6 +3,7 @@ import pickle
 import argparse
 import os
 from Dataset.DatasetH5 import DatasetH5
+from Dataset.DatasetStatistics import DatasetStatistics
 
 __author__ = 'gm'
 
@@ -76,15 +77,23 @@ with open(boolean_approximation_file, "rb") as f:
 with open(pearson_correlation_file, "rb") as f:
     pearson_correlation = pickle.load(f)
 
-orig_db = DatasetH5(h5_dataset_orig)
+orig_db = DatasetH5(h5_dataset_orig, mode='r')
 
 
-def normalize(ts):
+def normalize(ts, attributes=None):
+    """
+    :param attributes: if they have the mean, std and constant of ts (see DatasetStatistics), they are not recomputed.
+                       Otherwise they are computed as DatasetStatistics computes them, with its constant test
+    """
     d = ts
-    if np.std(d) == 0:
+    if attributes is None or "constant" not in attributes:
+        statistics = DatasetStatistics()
+        statistics.update(d)
+        attributes = statistics.attributes()
+    if attributes["constant"]:
         data_norm = d / d
     else:
-        data_norm = (d - np.mean(d)) / np.std(d)
+        data_norm = (d - attributes["mean"]) / attributes["std"]
     return data_norm
 
 
@@ -92,8 +101,11 @@ cache = [None] * len(orig_db)
 
 
 def get_ts(i):
+    """
+    :return: the normalized time series i of the original dataset
+    """
     if cache[i] is None:
-        cache[i] = orig_db[i].value
+        cache[i] = normalize(orig_db[i][:], orig_db.attributes(i))
     return cache[i]
 
 
@@ -106,8 +118,10 @@ def assert_pearson():
         print("validating %d/%d" % (i + 1, n))
         for j in range(i + 1, n):
             ts2 = get_ts(j)
-            corr = np.average(normalize(ts1) * normalize(ts2))
-            assert table[i][j] == corr
+            corr = np.average(ts1 * ts2)
+            # the table is computed in float32 from the normalized dataset, the time series here are normalized in
+            # float64 from the original dataset
+            assert np.isclose(table[i][j], corr, rtol=1e-4, atol=1e-5), "[%d,%d]: %f != %f" % (i, j, table[i][j], corr)
     print("Finished pearson correlation validation\n")
 
 
@@ -0,0 +1,97 @@
+import pytest
+
+from Dataset.DatasetAggregator import DatasetAggregator
+from Dataset.DatasetConverter import DatasetConverter, _convert_shard
+from Dataset.DatasetDatabase import DatasetDatabase
+from Dataset.DatasetReader import DatasetReader, timestamps_to_date_time
+
+__author__ = 'gm'
+
+
+def reference_rows(dataset):
+    """
+    the rows of the line by line pipeline, independent of DatasetReader: every line is split by "," and the
+    consecutive data of a time series at the same date-time are averaged incrementally, the ticks of a time series
+    are its date-times in the order they are read
+    """
+    rows = []
+    last = {}
+    with open(dataset) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line == "":
+                break
+            name, date, time, data1, data2 = line.split(",")
+            data1, data2 = float(data1), float(data2)
+            if name not in last:
+                last[name] = [0, date, time, data1, data2, 1]
+            elif last[name][1] == date and last[name][2] == time:
+                tick, _, _, avg1, avg2, n = last[name]
+                n += 1
+                last[name] = [tick, date, time, (n - 1) * avg1 / n + data1 / n, (n - 1) * avg2 / n + data2 / n, n]
+            else:
+                rows.append((name,) + tuple(last[name][:5]))
+                last[name] = [last[name][0] + 1, date, time, data1, data2, 1]
+    for name, data in last.items():
+        rows.append((name,) + tuple(data[:5]))
+    return sorted(rows)
+
+
+def to_rows(names, rows):
+    dates, times = timestamps_to_date_time(rows.timestamps)
+    return list(zip([names[i] for i in rows.name_ids.tolist()], rows.ticks.tolist(), dates, times,
+                    rows.data1.tolist(), rows.data2.tolist()))
+
+
+def test_aggregator(testfiles):
+    expected = reference_rows(testfiles["data10000"])
+    assert len(expected) < 10000  # there are same date-time data to average
+
+    # small chunks split the same date-time data of a time-series between chunks
+    for chunk_size in [100000000, 4096, 300]:
+        dr = DatasetReader(testfiles["data10000"], chunk_size=chunk_size)
+        dr.open_dataset()
+        aggregator = DatasetAggregator()
+        rows = []
+        for chunk in iter(dr.get_next_chunk, None):
+            rows += to_rows(dr.names, aggregator.process(chunk))
+        rows += to_rows(dr.names, aggregator.flush())
+        dr.close_dataset()
+        assert sorted(rows) == expected
+
+
+def test_aggregator_merge(testfiles):
+    expected = reference_rows(testfiles["data10000"])
+
+    aggregator = DatasetAggregator()
+    names = []
+    rows = []
+    for start, end in DatasetReader.split_dataset(testfiles["data10000"], 50):
+        range_names, range_rows, heads, run_lengths = _convert_shard((testfiles["data10000"], start, end, 1000))
+        translate = []
+        for name in range_names:
+            if name not in names:
+                names.append(name)
+            translate.append(names.index(name))
+        range_rows.name_ids = range_rows.name_ids.choose(translate)
+        heads = {translate[i]: h for i, h in heads.items()}
+        run_lengths = {translate[i]: n for i, n in run_lengths.items()}
+        rows += to_rows(names, aggregator.merge(range_rows, heads, run_lengths))
+    rows += to_rows(names, aggregator.flush())
+
+    assert sorted(rows) == expected
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_aggregator_converter(testfiles):
+    reference = DatasetDatabase("./reference.db").connect()
+    reference.store_multiple_data(reference_rows(testfiles["data10000"]))
+
+    dc = DatasetConverter(testfiles["data10000"], "./converted.db", write_buffer_size=1000, chunk_size=2000)
+    dc.convert()
+    converted = DatasetDatabase("./converted.db").connect()
+
+    query = "select name, tick, ts, data1, data2 from dataset join series on series_id = id order by name, tick"
+    assert converted.execute_query(query).fetchall() == reference.execute_query(query).fetchall()
+    reference.disconnect()
+    converted.disconnect()
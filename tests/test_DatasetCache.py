@@ -0,0 +1,66 @@
+from Dataset.DatasetCache import DatasetCache
+from Dataset.DatasetDatabase import DatasetDatabase
+import numpy as np
+import pytest
+import os
+import shutil
+
+__author__ = 'gm'
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_DatasetCache():
+    with open("db", "w") as f:
+        f.write("version 1")
+    key = DatasetCache.key("db", "query", range=None, point_threshold="10")
+    assert key == DatasetCache.key("db", "query", point_threshold="10", range=None)
+    assert key != DatasetCache.key("db", "query", range=None, point_threshold="20")
+    assert key != DatasetCache.key("db", "other-query", range=None, point_threshold="10")
+
+    cache = DatasetCache("cache", max_size=10000)
+    assert cache.get(key) is None
+    cache.put(key, {"names": np.array(["a", "b"]), "points": np.array([1, 2], dtype="datetime64[s]")})
+    arrays = cache.get(key)
+    assert arrays["names"].tolist() == ["a", "b"]
+    assert arrays["points"].dtype == np.dtype("datetime64[s]")
+    assert arrays["points"].astype(np.int64).tolist() == [1, 2]
+
+    # a changed database is a different key
+    with open("db", "w") as f:
+        f.write("version 2 of the database")
+    assert DatasetCache.key("db", "query", range=None, point_threshold="10") != key
+
+    # the least recently used entries are evicted, the cache fits two entries
+    cache.clear()
+    big = {"points": np.zeros(500, dtype=np.int64)}
+    for i in range(2):
+        cache.put("entry%d" % i, big)
+        os.utime(os.path.join("cache", "entry%d.npz" % i), ns=((i + 1) * 10 ** 9, (i + 1) * 10 ** 9))
+    assert cache.get("entry0") is not None
+    cache.put("entry2", big)
+    assert sorted(os.listdir("cache")) == ["entry0.npz", "entry2.npz"]
+
+    cache.clear()
+    assert os.listdir("cache") == []
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_cached_queries(testfiles):
+    shutil.copy(testfiles["dataset100"], "dataset100.db")
+    cache = DatasetCache("cache")
+    db = DatasetDatabase("dataset100.db").connect()
+    start_end_points = db.get_start_end_points()
+    all_points = db.get_all_points()
+    assert db.get_start_end_points(use_file=True, cache=cache) == start_end_points
+    assert db.get_start_end_points(use_file=True, cache=cache, point_threshold="3") != start_end_points
+    cached = db.get_all_points(use_file=True, cache=cache)
+    assert len(os.listdir("cache")) == 3
+    db.disconnect()
+
+    # served from the cache without querying the database
+    db = DatasetDatabase("dataset100.db")
+    assert db.get_start_end_points(use_file=True, cache=cache) == start_end_points
+    for result in [cached, db.get_all_points(use_file=True, cache=cache)]:
+        assert sorted(result.keys()) == sorted(all_points.keys())
+        for name, points in all_points.items():
+            assert result[name].tolist() == points.tolist()
@@ -18,9 +18,124 @@ def test_converter(testfiles):
 
     ts = db.get_time_series("Forex·EURSEK·NoExpiry")
 
-    assert ts.fetchall() == [("07/08/2015", "00:05:12", "9.37086666666667", "1.0"),
-                             ("07/08/2015", "00:05:13", "9.3714", "1.0"),
-                             ("07/08/2015", "00:05:14", "9.3713", "1.0")
+    assert ts.fetchall() == [("07/08/2015", "00:05:12", 9.370866666666666, 1.0),
+                             ("07/08/2015", "00:05:13", 9.3714, 1.0),
+                             ("07/08/2015", "00:05:14", 9.3713, 1.0)
                              ]
     db.disconnect()
     os.remove("./test_database.db")
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_converter_parallel(testfiles):
+    dc = DatasetConverter(testfiles["data10000"], "./serial.db")
+    dc.convert()
+
+    # small ranges, so that same date-time data of a time-series are split between ranges
+    dc = DatasetConverter(testfiles["data10000"], "./parallel.db", write_buffer_size=1000, jobs=3, shard_size=2000)
+    dc.convert()
+
+    query = "select name, tick, ts, data1, data2 from dataset join series on series_id = id order by name, tick"
+    serial = DatasetDatabase("./serial.db").connect()
+    parallel = DatasetDatabase("./parallel.db").connect()
+    serial_rows = serial.execute_query(query).fetchall()
+    assert len(serial_rows) > 0
+    assert parallel.execute_query(query).fetchall() == serial_rows
+    serial.disconnect()
+    parallel.disconnect()
+
+
+class CrashingConverter(DatasetConverter):
+    """
+    fails after its second checkpoint, with data written but not yet committed
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkpoints = 0
+
+    def _checkpoint(self, offset):
+        if self.writes >= self.checkpoint_interval:
+            self.checkpoints += 1
+        super()._checkpoint(offset)
+        if self.checkpoints >= 2 and self.writes > 0:
+            raise RuntimeError("crash")
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+@pytest.mark.usefixtures("cleandir")
+def test_converter_resume(testfiles, jobs):
+    dc = DatasetConverter(testfiles["data10000"], "./complete.db")
+    dc.convert()
+
+    dc = CrashingConverter(testfiles["data10000"], "./resumed.db", write_buffer_size=100, chunk_size=2000,
+                           checkpoint_interval=2)
+    with pytest.raises(RuntimeError):
+        dc.convert()
+    dc.db.conn.close()
+
+    # the data of the interrupted conversion would be duplicated
+    dc = DatasetConverter(testfiles["data10000"], "./resumed.db")
+    with pytest.raises(Exception):
+        dc.convert()
+    dc.db.disconnect()
+
+    dc = DatasetConverter(testfiles["data10000"], "./resumed.db", write_buffer_size=100, jobs=jobs, shard_size=2000,
+                          chunk_size=2000, resume=True)
+    dc.convert()
+
+    query = "select name, tick, ts, data1, data2 from dataset join series on series_id = id order by name, tick"
+    complete = DatasetDatabase("./complete.db").connect()
+    resumed = DatasetDatabase("./resumed.db").connect()
+    complete_rows = complete.execute_query(query).fetchall()
+    assert resumed.execute_query(query).fetchall() == complete_rows
+    assert resumed.get_checkpoint(os.path.abspath(testfiles["data10000"])) is None
+    complete.disconnect()
+    resumed.disconnect()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+@pytest.mark.usefixtures("cleandir")
+def test_converter_append(testfiles, jobs):
+    dc = DatasetConverter(testfiles["data10000"], "./complete.db")
+    dc.convert()
+
+    # two days, the same date-time data of some time-series are split between them
+    with open(testfiles["data10000"], "rb") as f:
+        lines = f.readlines()
+    with open("day1.txt", "wb") as f:
+        f.writelines(lines[:5000])
+    with open("day2.txt", "wb") as f:
+        f.writelines(lines[5000:])
+    with open("day3.txt", "wb") as f:
+        f.writelines([])
+
+    dc = DatasetConverter("day1.txt", "./appended.db")
+    dc.convert()
+    # without append, the ticks of day2 would start from 0 again
+    dc = DatasetConverter("day2.txt", "./appended.db")
+    with pytest.raises(Exception):
+        dc.convert()
+    dc.db.disconnect()
+
+    # an interrupted append is resumed
+    dc = CrashingConverter("day2.txt", "./appended.db", write_buffer_size=100, chunk_size=2000,
+                           checkpoint_interval=2, append=True)
+    with pytest.raises(RuntimeError):
+        dc.convert()
+    dc.db.conn.close()
+    dc = DatasetConverter("day2.txt", "./appended.db", write_buffer_size=100, jobs=jobs, shard_size=2000,
+                          chunk_size=2000, resume=True, append=True)
+    dc.convert()
+    dc = DatasetConverter("day3.txt", "./appended.db", append=True)
+    dc.convert()
+
+    query = "select name, tick, ts, data1, data2 from dataset join series on series_id = id order by name, tick"
+    complete = DatasetDatabase("./complete.db").connect()
+    appended = DatasetDatabase("./appended.db").connect()
+    assert appended.execute_query(query).fetchall() == complete.execute_query(query).fetchall()
+    assert sorted(appended.get_last_rows()) == sorted(complete.get_last_rows())
+    assert appended.get_start_end_points() == complete.get_start_end_points()
+    assert appended.get_num_points_of_all() == complete.get_num_points_of_all()
+    complete.disconnect()
+    appended.disconnect()
@@ -1,8 +1,12 @@
 import h5py
+import numpy as np
 import pytest
 import datetime as dt
+from Benchmark.BenchmarkDB2HDF5 import legacy_gap_fill
 from Dataset.DatasetConverter import DatasetConverter
-from Dataset.DatasetDB2HDF5 import DatasetDB2HDF5
+from Dataset.DatasetDB2HDF5 import DatasetDB2HDF5, AGGREGATION_SUFFIXES, AGGREGATIONS
+from Dataset.DatasetDBNormalizer import DatasetDBNormalizer
+from Dataset.DatasetH5 import DatasetH5, LAYOUTS
 from Dataset.DatasetDatabase import DatasetDatabase
 from Dataset.DatasetDatabase import DATE_FORMAT
 
@@ -34,3 +38,172 @@ def test(testfiles):
     with h5py.File(h5_db, 'r') as f:
         for name in f.keys():
             assert f[name].len() == pnum
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_range(testfiles):
+    range = ["07/08/2015-00:05:12", "07/08/2015-00:05:13"]
+    DatasetDB2HDF5(testfiles["dataset100"], "all.h5").convert()
+    DatasetDB2HDF5(testfiles["dataset100"], "range.h5").convert(range=range)
+
+    db = DatasetDatabase(testfiles["dataset100"]).connect()
+    names = db.get_distinct_names(range=range)
+    first_datetime = dt.datetime.strptime(db.get_first_datetime(None), DATE_FORMAT)
+    db.disconnect()
+    # the time axis is clipped to the range, 2 seconds within the whole axis
+    start = (dt.datetime.strptime(range[0], DATE_FORMAT) - first_datetime).seconds
+    with h5py.File("all.h5", 'r') as f_all, h5py.File("range.h5", 'r') as f_range:
+        assert sorted(f_range.keys()) == sorted(names)
+        assert len(names) < len(f_all.keys())
+        assert (f_range.attrs["window_start"], f_range.attrs["window_end"]) == tuple(range)
+        assert f_all.attrs["window_start"] == first_datetime.strftime(DATE_FORMAT)
+        for name in names:
+            assert f_range[name][:].tolist() == f_all[name][start:start + 2].tolist()
+
+    with pytest.raises(Exception):
+        DatasetDB2HDF5(testfiles["dataset100"], "empty.h5").convert(range=["01/01/2000-00:00:00",
+                                                                           "01/02/2000-00:00:00"])
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_gap_filling(testfiles):
+    dc = DatasetConverter(testfiles["data10000"], "dataset10000.db")
+    dc.convert()
+    DatasetDB2HDF5("dataset10000.db", "h510000.db").convert()
+
+    db = DatasetDatabase("dataset10000.db").connect()
+    first_datetime = dt.datetime.strptime(db.get_first_datetime(None), DATE_FORMAT)
+    last_datetime = dt.datetime.strptime(db.get_last_datetime(None), DATE_FORMAT)
+    with h5py.File("h510000.db", 'r') as f:
+        for name in db.get_distinct_names():
+            expected = legacy_gap_fill(db.get_time_series(name).fetchall(), first_datetime, last_datetime)
+            assert f[name][:].tolist() == expected.tolist()
+    db.disconnect()
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_parallel(testfiles):
+    dc = DatasetConverter(testfiles["data10000"], "dataset10000.db")
+    dc.convert()
+    DatasetDB2HDF5("dataset10000.db", "serial.h5").convert(compression_level=1)
+    DatasetDB2HDF5("dataset10000.db", "parallel.h5").convert(compression_level=1, jobs=3)
+
+    with h5py.File("serial.h5", 'r') as serial, h5py.File("parallel.h5", 'r') as parallel:
+        assert list(parallel.keys()) == list(serial.keys())
+        for name in serial.keys():
+            assert parallel[name][:].tolist() == serial[name][:].tolist()
+
+
+def test_resample():
+    timestamps = np.array([2, 3, 7, 12, 13, 14])
+    data1 = np.array([1.0, 2.0, 4.0, 8.0, 6.0, 7.0])
+    data2 = np.array([1.0, 3.0, 0.0, 1.0, 1.0, 2.0])
+    # intervals [0, 5) [5, 10) [10, 15) [15, 20) of first_timestamp 0, last_timestamp 17
+    resampled = dict((agg, [s.tolist() for s in DatasetDB2HDF5.resample(timestamps, data1, data2, 0, 17, 5, agg)])
+                     for agg in AGGREGATIONS)
+    assert resampled["last"] == [[2.0, 4.0, 7.0, 7.0]]
+    assert resampled["mean"] == [[1.5, 4.0, 7.0, 7.0]]
+    assert resampled["vwap"] == [[1.75, 4.0, 7.0, 7.0]]
+    assert resampled["ohlc"] == [[1.0, 4.0, 8.0, 7.0], [2.0, 4.0, 8.0, 7.0], [1.0, 4.0, 6.0, 7.0],
+                                 [2.0, 4.0, 7.0, 7.0]]
+    assert DatasetDB2HDF5.resample(timestamps, data1, data2, 0, 17, 1, "last")[0].tolist() == \
+        DatasetDB2HDF5.fill_gaps(timestamps, data1, 0, 17).tolist()
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_interval(testfiles):
+    DatasetDB2HDF5(testfiles["dataset100"], "seconds.h5").convert()
+    DatasetDB2HDF5(testfiles["dataset100"], "mean.h5").convert(interval=60, agg="mean", layout="matrix")
+    DatasetDB2HDF5(testfiles["dataset100"], "ohlc.h5").convert(interval=60, agg="ohlc", jobs=2)
+    DatasetDBNormalizer.normalize_hdf5("ohlc.h5", "ohlc_normalized.h5")
+
+    with DatasetH5("seconds.h5") as seconds, DatasetH5("mean.h5") as mean, DatasetH5("ohlc.h5") as ohlc, \
+            DatasetH5("ohlc_normalized.h5") as ohlc_normalized:
+        m = (len(seconds[0]) - 1) // 60 + 1
+        assert seconds.interval == 1 and mean.interval == 60 and ohlc_normalized.interval == 60
+        assert mean.f.attrs["aggregation"] == "mean" and ohlc_normalized.f.attrs["aggregation"] == "ohlc"
+        assert mean.ts_names == seconds.ts_names
+        assert ohlc.ts_names == ohlc_normalized.ts_names == sorted(n + suffix for n in seconds.ts_names
+                                                                   for suffix in AGGREGATION_SUFFIXES["ohlc"])
+        for name in seconds.ts_names:
+            # the intervals of the gap filled seconds are a bound of the aggregations
+            minutes = np.array_split(seconds.read(name), np.arange(60, len(seconds[0]), 60))
+            assert len(minutes) == m == len(mean.read(name)) == len(ohlc.read(name + ".close"))
+            assert ohlc.read(name + ".close").tolist() == [minute[-1] for minute in minutes]
+            assert np.all(ohlc.read(name + ".high") <= [minute.max() for minute in minutes])
+            assert np.all(ohlc.read(name + ".low") >= [minute.min() for minute in minutes])
+            assert np.all(ohlc.read(name + ".low") <= mean.read(name))
+            assert np.all(mean.read(name) <= ohlc.read(name + ".high"))
+
+
+@pytest.mark.parametrize("layout,interval", [("series", 1), ("matrix", 7)])
+@pytest.mark.usefixtures("cleandir")
+def test_append(testfiles, layout, interval):
+    DatasetConverter(testfiles["data10000"], "complete.db").convert()
+    DatasetDB2HDF5("complete.db", "complete.h5").convert(layout=layout, interval=interval)
+    DatasetDBNormalizer.normalize_hdf5("complete.h5", "complete_normalized.h5")
+
+    # the second day is appended to the database and then to the hdf5 databases built from the first day
+    with open(testfiles["data10000"], "rb") as f:
+        lines = f.readlines()
+    with open("day1.txt", "wb") as f:
+        f.writelines(lines[:5000])
+    with open("day2.txt", "wb") as f:
+        f.writelines(lines[5000:])
+    DatasetConverter("day1.txt", "appended.db").convert()
+    DatasetDB2HDF5("appended.db", "appended.h5").convert(layout=layout, interval=interval, codec="lzf")
+    with DatasetH5("appended.h5") as appended:
+        m = len(appended[0])
+    with pytest.raises(Exception):
+        DatasetDB2HDF5("appended.db", "appended.h5").convert(append=True, range=["07/08/2015-00:05:12",
+                                                                                  "07/08/2015-00:05:13"])
+    DatasetConverter("day2.txt", "appended.db", append=True).convert()
+    DatasetDB2HDF5("appended.db", "appended.h5").convert(append=True)
+    # nothing new to append
+    DatasetDB2HDF5("appended.db", "appended.h5").convert(append=True)
+    # the appended points change every normalized point, the appended hdf5 database is normalized again
+    DatasetDBNormalizer.normalize_hdf5("appended.h5", "appended_normalized.h5", layout=layout)
+
+    with DatasetH5("complete.h5") as complete, DatasetH5("appended.h5") as appended, \
+            DatasetH5("complete_normalized.h5") as complete_normalized, \
+            DatasetH5("appended_normalized.h5") as appended_normalized:
+        assert len(appended[0]) == len(complete[0]) > m
+        assert appended.point_attributes() == complete.point_attributes() == appended_normalized.point_attributes()
+        assert appended.ts_names == appended_normalized.ts_names
+        assert set(appended.ts_names) <= set(complete.ts_names)
+        for i, name in enumerate(appended.ts_names):
+            c = complete.ts_names.index(name)
+            assert appended.read(i).tolist() == complete.read(c).tolist()
+            assert np.allclose(appended_normalized.read(i), complete_normalized.read(c), atol=1e-4)
+            for h5_appended, h5_complete in [(appended, complete), (appended_normalized, complete_normalized)]:
+                statistics = h5_appended.attributes(i)
+                expected = h5_complete.attributes(c)
+                assert statistics["count"] == expected["count"]
+                assert np.isclose(statistics["mean"], expected["mean"])
+                assert np.isclose(statistics["m2"], expected["m2"], atol=1e-6)
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+@pytest.mark.usefixtures("cleandir")
+def test_normalized(testfiles, layout):
+    DatasetDB2HDF5(testfiles["dataset100"], "fused.h5").convert(normalized_hdf5_name="fused_normalized.h5",
+                                                                layout=layout)
+    DatasetDBNormalizer.normalize_hdf5("fused.h5", "normalized.h5")
+
+    with DatasetH5("fused.h5") as fused, DatasetH5("fused_normalized.h5") as fused_normalized, \
+            DatasetH5("normalized.h5") as normalized:
+        assert fused.ts_names == fused_normalized.ts_names == normalized.ts_names
+        m = len(fused[0])
+        for i in range(len(fused)):
+            ts = fused.read(i).astype('float64')
+            assert fused_normalized.read(i).tolist() == normalized.read(i).tolist()
+            attributes = fused.attributes(i)
+            assert attributes == fused_normalized.attributes(i)
+            assert attributes["count"] == m
+            assert np.isclose(attributes["mean"], ts.mean()) and np.isclose(attributes["std"], ts.std())
+            assert attributes["constant"] == (ts.min() == ts.max())
+            assert np.isclose(attributes["energy"], np.square(fused_normalized.read(i).astype('float64')).sum())
+        assert fused_normalized.attribute("energy").tolist() == [fused.attributes(i)["energy"]
+                                                                  for i in range(len(fused))]
+        assert 0 < fused.attribute("constant").sum() < len(fused)
+        assert fused.attribute("missing") is None
@@ -1,4 +1,7 @@
-from Dataset.DatasetDatabase import DatasetDatabase
+from Dataset.DatasetConverter import DatasetConverter
+from Dataset.DatasetDatabase import DatasetDatabase, DatasetDatabasePool
+import concurrent.futures
+import numpy as np
 import sqlite3 as sql
 import pytest
 import os
@@ -15,18 +18,20 @@ def test_DatasetDatabase():
     db = DatasetDatabase(test_db_filename)
     db.connect()
 
-    db.store_data("time-series1", 0, "11-11-2015", "19:12:00", 123.4, 1)
+    db.store_data("time-series1", 0, "11/11/2015", "19:12:00", 123.4, 1)
 
     assert isinstance(db.conn, sql.Connection)
     c = db.conn.cursor()
     assert isinstance(c, sql.Cursor)
     c.execute("SELECT * from dataset")
-    assert c.fetchone() == ("time-series1", 0, "11-11-2015", "19:12:00", "123.4", "1")
+    assert c.fetchone() == (1, 0, 1447269120, 123.4, 1.0)
+    c.execute("SELECT * from series")
+    assert c.fetchone() == (1, "time-series1")
 
     iterator = db.get_time_series("time-series1")
     assert iterator is not None
     for row in iterator:
-        assert row == ("11-11-2015", "19:12:00", "123.4", "1")
+        assert row == ("11/11/2015", "19:12:00", 123.4, 1.0)
 
     db.disconnect()
     assert db.conn is None
@@ -39,25 +44,205 @@ def test_DatasetDatabase():
     db = DatasetDatabase(test_db_filename)
     db.connect()
 
-    data = [("time-series1", 1, "11-11-2015", "19:12:01", "123.5", "1"),
-            ("time-series1", 2, "11-11-2015", "19:12:02", "123.6", "1"),
-            ("time-series1", 3, "11-11-2015", "19:12:03", "123.7", "1"),
-            ("time-series1", 4, "11-11-2015", "19:12:04", "123.8", "1"),
-            ("time-series1", 5, "11-11-2015", "19:12:05", "123.9", "1"),
-            ("time-series1", 6, "11-11-2015", "19:12:06", "123.5", "1")]
+    data = [("time-series1", 1, "11/11/2015", "19:12:01", "123.5", "1"),
+            ("time-series1", 2, "11/11/2015", "19:12:02", "123.6", "1"),
+            ("time-series1", 3, "11/11/2015", "19:12:03", "123.7", "1"),
+            ("time-series1", 4, "11/11/2015", "19:12:04", "123.8", "1"),
+            ("time-series1", 5, "11/11/2015", "19:12:05", "123.9", "1"),
+            ("time-series1", 6, "11/11/2015", "19:12:06", "123.5", "1")]
 
     db.store_multiple_data(data)
 
     iterator = db.get_time_series("time-series1")
 
-    assert iterator.fetchall() == [("11-11-2015", "19:12:01", "123.5", "1"),
-                                   ("11-11-2015", "19:12:02", "123.6", "1"),
-                                   ("11-11-2015", "19:12:03", "123.7", "1"),
-                                   ("11-11-2015", "19:12:04", "123.8", "1"),
-                                   ("11-11-2015", "19:12:05", "123.9", "1"),
-                                   ("11-11-2015", "19:12:06", "123.5", "1")]
+    assert iterator.fetchall() == [("11/11/2015", "19:12:01", 123.5, 1.0),
+                                   ("11/11/2015", "19:12:02", 123.6, 1.0),
+                                   ("11/11/2015", "19:12:03", 123.7, 1.0),
+                                   ("11/11/2015", "19:12:04", 123.8, 1.0),
+                                   ("11/11/2015", "19:12:05", 123.9, 1.0),
+                                   ("11/11/2015", "19:12:06", 123.5, 1.0)]
 
     db.disconnect()
     assert db.conn is None
 
     os.remove(test_db_filename)
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_migrate():
+    conn = sql.connect("legacy.db")
+    for table in ["dataset", "dataset_normalized"]:
+        conn.execute("CREATE TABLE %s(name varchar(255), tick int, date varchar(255), time varchar(255), "
+                     "data1 varchar(255), data2 varchar(255), CONSTRAINT mypk PRIMARY KEY (name, tick));" % table)
+    conn.executemany("INSERT INTO dataset VALUES (?,?,?,?,?,?);",
+                     [("time-series2", 0, "12/31/2015", "23:59:59", "2.5", "1.0"),
+                      ("time-series1", 0, "11/11/2015", "19:12:00", "123.4", "1"),
+                      ("time-series1", 1, "11/11/2015", "19:12:01", "123.5", "1")])
+    conn.commit()
+    conn.close()
+
+    with pytest.raises(Exception):
+        DatasetDatabase("legacy.db").connect()
+
+    assert DatasetDatabase.migrate("legacy.db")
+    assert not DatasetDatabase.migrate("legacy.db")
+
+    db = DatasetDatabase("legacy.db").connect()
+    assert db.get_distinct_names() == ["time-series1", "time-series2"]
+    assert db.get_time_series("time-series1").fetchall() == [("11/11/2015", "19:12:00", 123.4, 1.0),
+                                                             ("11/11/2015", "19:12:01", 123.5, 1.0)]
+    assert db.get_time_series("time-series2").fetchall() == [("12/31/2015", "23:59:59", 2.5, 1.0)]
+    assert db.get_first_datetime(None) == "11/11/2015-19:12:00"
+    assert db.get_last_datetime(None) == "12/31/2015-23:59:59"
+
+    # new data go to the migrated tables
+    db.store_data("time-series1", 2, "11/11/2015", "19:12:02", 123.6, 1)
+    assert db.get_num_points("time-series1") == 3
+    db.disconnect()
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_bulk_load():
+    db = DatasetDatabase("bulk.db").connect()
+    series_id = db.get_series_ids(["time-series1"])[0]
+    rows = [(series_id, i, 1447269120 + i, 123.4 + i, 1.0) for i in range(10)]
+
+    # an interrupted bulk load keeps the committed rows only
+    with pytest.raises(RuntimeError):
+        with db.bulk_load():
+            db.store_rows(rows[5:])
+            db.store_rows(rows[:1], commit=False)
+            raise RuntimeError("crash")
+    assert db.execute_query("SELECT count(*) FROM dataset").fetchone()[0] == 0
+
+    with db.bulk_load():
+        db.store_rows(rows[:5], commit=False)
+        assert db.execute_query("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db.execute_query("PRAGMA journal_mode").fetchone()[0] == "delete"
+    assert db.execute_query("PRAGMA synchronous").fetchone()[0] == 2
+    assert db.execute_query("SELECT count(*) FROM sqlite_master WHERE name='dataset_load'").fetchone()[0] == 0
+    assert db.get_time_series("time-series1").fetchall() == \
+        [("11/11/2015", "19:12:%02d" % i, 123.4 + i, 1.0) for i in range(10)]
+
+    # the settings the database had before are restored
+    db.execute_query("PRAGMA journal_mode=WAL")
+    db.execute_query("PRAGMA synchronous=NORMAL")
+    with db.bulk_load(journal_mode="OFF"):
+        db.store_rows([(series_id, 10, 1447269130, 133.4, 1.0)])
+        assert db.execute_query("PRAGMA journal_mode").fetchone()[0] == "off"
+    assert db.execute_query("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db.execute_query("PRAGMA synchronous").fetchone()[0] == 1
+    db.disconnect()
+
+
+def test_set_based_queries(testfiles):
+    db = DatasetDatabase(testfiles["dataset100"]).connect()
+    names = db.get_distinct_names()
+    start_end_points = db.get_start_end_points()
+    num_points = db.get_num_points_of_all()
+    assert sorted(start_end_points.keys()) == names
+    assert sorted(num_points.keys()) == names
+    for name in names:
+        assert start_end_points[name] == [db.get_first_datetime(name), db.get_last_datetime(name)]
+        assert num_points[name] == db.get_num_points(name)
+    assert db.get_distinct_names(point_threshold="3") == [name for name in names if num_points[name] >= 3]
+    db.disconnect()
+
+
+def catalog_from_data(db):
+    return db.execute_query("SELECT series_id, min(ts), max(ts), count(*) FROM dataset GROUP BY series_id "
+                            "ORDER BY series_id").fetchall()
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_catalog(testfiles):
+    dc = DatasetConverter(testfiles["data10000"], "./converted.db", write_buffer_size=1000)
+    dc.convert()
+    db = DatasetDatabase("./converted.db").connect()
+    assert db.execute_query("SELECT * FROM catalog ORDER BY series_id").fetchall() == catalog_from_data(db)
+    db.disconnect()
+
+    db = DatasetDatabase("./stored.db").connect()
+    series_id = db.get_series_ids(["time-series1"])[0]
+    db.store_rows([(series_id, i, 1447269120 + i, 1.0, 1.0) for i in range(1, 5)])
+    # out of order and duplicate ticks
+    db.store_rows([(series_id, 0, 1447269100, 1.0, 1.0), (series_id, 5, 1447269200, 1.0, 1.0)])
+    db.store_rows([(series_id, 6, 1447269300, 1.0, 1.0), (series_id, 1, 1447269121, 1.0, 1.0)])
+    assert db.execute_query("SELECT * FROM catalog").fetchall() == catalog_from_data(db)
+    assert db.get_start_end_points() == {"time-series1": ["11/11/2015-19:11:40", "11/11/2015-19:15:00"]}
+    assert db.get_num_points("time-series1") == 7
+    db.disconnect()
+
+
+def test_iter_all_points(testfiles):
+    db = DatasetDatabase(testfiles["dataset100"]).connect()
+    all_points = db.get_all_points()
+    names = list(reversed(db.get_distinct_names()))
+    streamed = list(db.iter_all_points(names, batch_size=2))
+    assert [name for name, points in streamed] == names
+    for name, points in streamed:
+        assert points.dtype == np.dtype("datetime64[s]")
+        assert [DatasetDatabase._date_time(t) for t in points.view(np.int64).tolist()] == all_points[name].tolist()
+    assert [name for name, points in db.iter_all_points(point_threshold="3")] == \
+        db.get_distinct_names(point_threshold="3")
+    db.disconnect()
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_time_series_range():
+    db = DatasetDatabase("range.db").connect()
+    series_id = db.get_series_ids(["time-series1"])[0]
+    db.store_rows([(series_id, i, 1447269120 + i, 123.4 + i, 1.0) for i in range(10)])
+    rows = db.get_time_series("time-series1").fetchall()
+    assert db.get_time_series("time-series1", start="11/11/2015-19:12:03").fetchall() == rows[3:]
+    assert db.get_time_series("time-series1", end="11/11/2015-19:12:03").fetchall() == rows[:4]
+    assert db.get_time_series("time-series1", start="11/11/2015-19:12:02",
+                              end="11/11/2015-19:12:05").fetchall() == rows[2:6]
+    assert db.get_time_series("time-series1", start="11/12/2015-00:00:00").fetchall() == []
+    db.disconnect()
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_read_pool():
+    db = DatasetDatabase("pool.db").connect()
+    db.execute_query("PRAGMA journal_mode=WAL")
+    names = ["time-series%d" % i for i in range(16)]
+    rows = []
+    for series_id in db.get_series_ids(names):
+        rows.extend((series_id, i, 1447269120 + i, float(series_id * i), 1.0) for i in range(2000))
+    db.store_rows(rows)
+    expected = dict((name, db.get_time_series(name).fetchall()) for name in names)
+
+    with pytest.raises(Exception):
+        DatasetDatabase("missing.db", read_only=True).connect()
+
+    pool = DatasetDatabasePool("pool.db", cache_size=-1024, mmap_size=1024 * 1024)
+    read_only = pool.get()
+    assert pool.get() is read_only
+    with pytest.raises(sql.OperationalError):
+        read_only.store_rows(rows[:1])
+
+    def read(name):
+        # stream a time-series in small batches, interleaved with the other threads
+        c = pool.get().get_time_series(name)
+        result = []
+        for batch in iter(lambda: c.fetchmany(100), []):
+            result.extend(batch)
+        return name, result, pool.get()
+
+    # a writer commits new rows while the readers stream in parallel
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        futures = [executor.submit(read, name) for name in names * 4]
+        new_id = db.get_series_ids(["time-series-new"])[0]
+        for i in range(0, 2000, 100):
+            db.store_rows([(new_id, t, 1447269120 + t, 1.0, 1.0) for t in range(i, i + 100)])
+        results = [f.result() for f in futures]
+    for name, result, connection in results:
+        assert result == expected[name]
+    # one connection per thread, plus the one of this thread
+    assert len(set(id(connection) for name, result, connection in results)) + 1 == len(pool.databases) <= 9
+    assert pool.get().get_num_points("time-series-new") == 2000
+
+    pool.close()
+    assert pool.databases == [] and read_only.conn is None
+    db.disconnect()
@@ -1,4 +1,13 @@
-from Dataset.DatasetH5 import DatasetH5
+from BooleanCorrelation import BooleanCorrelation
+from Dataset.DatasetDB2HDF5 import DatasetDB2HDF5
+from Dataset.DatasetDBNormalizer import DatasetDBNormalizer
+from Dataset.DatasetH5 import DatasetH5, DatasetH5Writer, CODECS, LAYOUTS, compression_options, hdf5plugin
+from Dataset.DatasetText2HDF5 import DatasetText2HDF5
+from PearsonCorrelation import PearsonCorrelation
+import h5py
+import numpy as np
+import pytest
+import tracemalloc
 
 __author__ = 'gm'
 
@@ -13,3 +22,106 @@ def test_init(testfiles):
         for ts in ds.get_ts_names():
             fourier = ds.compute_fourier(ts, 100)
             assert len(fourier) != 0
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_matrix_layout(testfiles):
+    DatasetDB2HDF5(testfiles["dataset100"], "series.h5").convert()
+    DatasetDB2HDF5(testfiles["dataset100"], "matrix.h5").convert(layout="matrix", compression_level=1)
+    DatasetText2HDF5(testfiles["data100"], "text_matrix.h5").convert(layout="matrix")
+    DatasetDBNormalizer.normalize_hdf5("matrix.h5", "normalized_series.h5")
+    DatasetDBNormalizer.normalize_hdf5("series.h5", "normalized_matrix.h5", layout="matrix")
+
+    with DatasetH5("series.h5") as series, DatasetH5("matrix.h5") as matrix, \
+            DatasetH5("text_matrix.h5") as text_matrix:
+        assert matrix.f["matrix"].shape == (len(series), len(series[0]))
+        assert matrix.ts_names == series.ts_names == text_matrix.ts_names
+        assert list(matrix) == series.ts_names
+        for i, name in enumerate(series.ts_names):
+            assert matrix[i][:].tolist() == series[i][:].tolist() == text_matrix.read(name).tolist()
+            assert matrix.compute_fourier(name, 10, disable_store=True).tolist() == \
+                series.compute_fourier(name, 10, disable_store=True).tolist()
+        for indices in [range(2, 7), [5, 1, 3, 1], []]:
+            assert matrix.read_block(indices).tolist() == series.read_block(indices).tolist()
+        assert matrix.read_block([0, 1]).shape == (2, len(series[0]))
+
+    with DatasetH5("normalized_series.h5") as normalized_series, \
+            DatasetH5("normalized_matrix.h5") as normalized_matrix:
+        assert normalized_series.read_block(range(len(normalized_series))).tolist() == \
+            normalized_matrix.read_block(range(len(normalized_matrix))).tolist()
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_codecs(testfiles):
+    DatasetDB2HDF5(testfiles["dataset100"], "plain.h5").convert()
+    codecs = [c for c in CODECS if c != "blosc-lz4" or hdf5plugin is not None]
+    for codec in codecs:
+        for layout in LAYOUTS:
+            DatasetDBNormalizer.normalize_hdf5("plain.h5", "%s_%s.h5" % (codec, layout), compression_level=1,
+                                               layout=layout, codec=codec, chunk_size=4096)
+    DatasetDBNormalizer.normalize_hdf5("plain.h5", "normalized.h5")
+
+    with DatasetH5("normalized.h5") as normalized:
+        expected = normalized.read_block(range(len(normalized))).tolist()
+        for codec in codecs:
+            with DatasetH5("%s_series.h5" % codec) as series, DatasetH5("%s_matrix.h5" % codec) as matrix:
+                assert series.read_block(range(len(series))).tolist() == expected
+                assert matrix.read_block(range(len(matrix))).tolist() == expected
+                assert series[0].chunks == (min(1024, len(series[0])),)
+                assert matrix.matrix.chunks == (min(len(matrix), 4096 // (4 * len(matrix[0]))), len(matrix[0]))
+                if codec != "blosc-lz4":
+                    assert matrix.matrix.compression == {"none": None}.get(codec, codec)
+                assert matrix.matrix.shuffle == (codec == "gzip")
+
+    assert compression_options(None, None) == {}
+    assert compression_options(None, 9) == {"compression": "gzip", "compression_opts": 9, "shuffle": True}
+    if hdf5plugin is None:
+        with pytest.raises(Exception):
+            compression_options("blosc-lz4")
+
+
+@pytest.mark.usefixtures("cleandir")
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_normalize_by_ranges(testfiles, layout):
+    DatasetDB2HDF5(testfiles["dataset100"], "plain.h5").convert(layout=layout)
+    # the input is only read, it can be open read-only elsewhere
+    with h5py.File("plain.h5", "r"):
+        DatasetDBNormalizer.normalize_hdf5("plain.h5", "normalized.h5")
+    DatasetDBNormalizer.normalize_hdf5("plain.h5", "ranges.h5", layout=layout, read_size=7)
+
+    with DatasetH5("normalized.h5") as normalized, DatasetH5("ranges.h5") as ranges:
+        assert ranges.ts_names == normalized.ts_names
+        assert np.allclose(ranges.read_block(range(len(ranges))), normalized.read_block(range(len(normalized))),
+                           rtol=1e-5, atol=1e-5)
+        for name in ["count", "mean", "constant"]:
+            assert np.allclose(ranges.attribute(name), normalized.attribute(name), rtol=1e-9)
+
+    # a long time series, of small variance, is read by ranges: the memory is that of a range
+    m = 1000000
+    with DatasetH5Writer("long.h5", ["a", "b"], m) as writer:
+        writer.write("a", 1000 + np.sin(np.arange(m) / 1000.0) / 100)
+        writer.write("b", np.random.RandomState(0).normal(size=m))
+    peaks = []
+    for read_size in [None, 10000]:
+        tracemalloc.start()
+        DatasetDBNormalizer.normalize_hdf5("long.h5", "long_%s.h5" % read_size, layout=layout, read_size=read_size)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < 20 * 10000 * 8 < peaks[0]
+    with DatasetH5("long_None.h5") as normalized, DatasetH5("long_10000.h5") as ranges:
+        assert np.allclose(ranges.read_block([0, 1]), normalized.read_block([0, 1]), rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_correlation_layouts(testfiles):
+    DatasetDB2HDF5(testfiles["dataset100"], "series.h5").convert(normalized_hdf5_name="normalized_series.h5")
+    DatasetDB2HDF5(testfiles["dataset100"], "matrix.h5").convert(layout="matrix",
+                                                                normalized_hdf5_name="normalized_matrix.h5")
+    # the time series are read by blocks of READ_BLOCK_SIZE, whatever the order they are needed in
+    for correlation in [PearsonCorrelation("normalized_series.h5"), PearsonCorrelation("normalized_matrix.h5")]:
+        for i in reversed(range(len(correlation.norm_ds))):
+            assert correlation.get_ts(i).tolist() == correlation.norm_ds.read(i).tolist()
+    assert PearsonCorrelation("normalized_series.h5").find_correlations().tolist() == \
+        PearsonCorrelation("normalized_matrix.h5").find_correlations().tolist()
+    assert BooleanCorrelation("normalized_series.h5").boolean_approximation(0.7).tolist() == \
+        BooleanCorrelation("normalized_matrix.h5").boolean_approximation(0.7).tolist()
@@ -1,4 +1,13 @@
-from Dataset.DatasetReader import DatasetReader
+from Dataset.DatasetReader import DatasetReader, timestamp_to_date_time, timestamps_to_date_time
+import bz2
+import gzip
+import lzma
+import pytest
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 __author__ = 'gm'
 
@@ -40,3 +49,95 @@ def test_DatasetReader(testfiles):
 
     for data in dr:
         assert(isinstance(data, tuple))
+
+
+def test_DatasetReader_chunks(testfiles):
+    lines = []
+    with open(testfiles["data10000"], encoding="utf-8") as f:
+        for line in f:
+            name, date, time, data1, data2 = line.rstrip("\n").split(",")
+            lines.append((name, date, time, float(data1), float(data2)))
+
+    # small chunks, so that lines of the same second and of the same time-series are split between chunks
+    dr = DatasetReader(testfiles["data10000"], chunk_size=4096)
+    dr.open_dataset()
+    chunks = []
+    chunk = dr.get_next_chunk()
+    while chunk is not None:
+        chunks.append(chunk)
+        chunk = dr.get_next_chunk()
+    assert len(chunks) > 1
+
+    i = 0
+    for chunk in chunks:
+        dates, times = timestamps_to_date_time(chunk.timestamps)
+        for j in range(len(chunk)):
+            assert (dr.names[chunk.name_ids[j]], dates[j], times[j], chunk.data1[j], chunk.data2[j]) == lines[i]
+            i += 1
+    assert i == len(lines)
+    dr.close_dataset()
+
+    # the tuple iterator is built on the chunks
+    dr = DatasetReader(testfiles["data10000"], chunk_size=4096)
+    dr.open_dataset()
+    assert [dr.get_next_data() for i in range(len(lines))] == lines
+    assert dr.get_next_data() is None
+    dr.close_dataset()
+
+
+def test_DatasetReader_malformed():
+    dr = DatasetReader("unused")
+    chunk = dr.parse_chunk(b"ts1,07/08/2015,00:05:12,1.5,1\r\n\nts2,07/08/2015,23:59:59,.25,2")
+    assert dr.names == ["ts1", "ts2"]
+    assert list(chunk.name_ids) == [0, 1]
+    assert list(chunk.data1) == [1.5, .25]
+    assert timestamp_to_date_time(chunk.timestamps[1]) == ("07/08/2015", "23:59:59")
+
+    with pytest.raises(ValueError):
+        dr.parse_chunk(b"ts1,07/08/2015,00:05:12,1.5\n")
+    with pytest.raises(ValueError):
+        dr.parse_chunk(b"ts1,7/8/2015,00:05:12,1.5,1\n")
+
+
+def test_DatasetReader_split(testfiles):
+    with open(testfiles["data10000"], "rb") as f:
+        lines = f.readlines()
+
+    for shards in [1, 2, 7, 100]:
+        ranges = DatasetReader.split_dataset(testfiles["data10000"], shards)
+        assert 0 < len(ranges) <= shards
+        assert ranges[0][0] == 0
+        read = []
+        for start, end in ranges:
+            dr = DatasetReader(testfiles["data10000"], chunk_size=1000)
+            dr.open_dataset(start, end)
+            read += list(iter(dr.get_next_data, None))
+            dr.close_dataset()
+        assert len(read) == len(lines)
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_DatasetReader_compressed(testfiles):
+    with open(testfiles["data10000"], "rb") as f:
+        data = f.read()
+
+    dr = DatasetReader(testfiles["data10000"], chunk_size=5000)
+    dr.open_dataset()
+    assert dr.dataset_map is not None
+    expected = list(iter(dr.get_next_data, None))
+    dr.close_dataset()
+
+    compressors = {"data.txt.gz": gzip.compress, "data.txt.bz2": bz2.compress, "data.txt.xz": lzma.compress}
+    if zstandard is not None:
+        compressors["data.txt.zst"] = zstandard.ZstdCompressor().compress
+    for path, compress in compressors.items():
+        with open(path, "wb") as f:
+            f.write(compress(data))
+        dr = DatasetReader(path, chunk_size=5000)
+        dr.open_dataset()
+        assert dr.dataset_map is None
+        assert list(iter(dr.get_next_data, None)) == expected
+        dr.close_dataset()
+
+        with pytest.raises(Exception):
+            dr.open_dataset(0, 100)
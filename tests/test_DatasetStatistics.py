@@ -0,0 +1,55 @@
+from Dataset.DatasetDBNormalizer import DatasetDBNormalizer
+from Dataset.DatasetH5 import DatasetH5, DatasetH5Writer
+from Dataset.DatasetStatistics import DatasetStatistics
+import numpy as np
+import pytest
+
+__author__ = 'gm'
+
+
+def test_DatasetStatistics():
+    values = np.random.RandomState(0).normal(1000.0, 0.01, 10000).astype('float32')
+    statistics = DatasetStatistics()
+    for batch in np.array_split(values, [1, 100, 5000, 5000]):
+        statistics.update(batch)
+    assert statistics.count == len(values)
+    assert np.isclose(statistics.mean, values.astype('float64').mean(), rtol=1e-15)
+    assert np.isclose(statistics.std(), values.astype('float64').std(), rtol=1e-9)
+    assert np.allclose(statistics.denormalize(statistics.normalize(values)), values)
+
+    # a replaced point, of statistics read from the attributes
+    statistics = DatasetStatistics.from_attributes(statistics.attributes())
+    statistics.remove(values[-1])  # a np.float32
+    statistics.update([5.0])
+    expected = np.append(values[:-1], 5.0).astype('float64')
+    assert np.isclose(statistics.mean, expected.mean(), rtol=1e-15)
+    assert np.isclose(statistics.std(), expected.std(), rtol=1e-9)
+
+    restored = DatasetStatistics.from_attributes(statistics.attributes())
+    assert restored.attributes() == statistics.attributes()
+    assert DatasetStatistics.from_attributes({"count": 1}) is None
+
+    # constant time series are not normalized, as DatasetDBNormalizer.normalize_time_series
+    constant = DatasetStatistics()
+    constant.update(np.full(1000, 0.1, dtype='float32'))
+    assert constant.std() == 0
+    assert constant.normalize(np.array([0.1, 0.1])).tolist() == [0.1, 0.1]
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_constant_tolerance():
+    # a constant time series up to rounding, every normalization treats it as constant
+    nearly_constant = np.full(1000, 1000.0) + np.random.RandomState(0).normal(0, 1e-8, 1000)
+    statistics = DatasetStatistics()
+    statistics.update(nearly_constant)
+    assert np.std(nearly_constant) != 0 and statistics.std() == 0
+    assert DatasetDBNormalizer.normalize_time_series(nearly_constant).tolist() == nearly_constant.tolist()
+
+    with DatasetH5Writer("raw.h5", ["a"], len(nearly_constant)) as h5:
+        h5.write("a", nearly_constant)
+    DatasetDBNormalizer.normalize_hdf5("raw.h5", "normalized.h5")
+    DatasetDBNormalizer.normalize_hdf5("raw.h5", "ranges.h5", read_size=100)
+    with DatasetH5("raw.h5") as raw, DatasetH5("normalized.h5") as normalized, DatasetH5("ranges.h5") as ranges:
+        for h5 in [normalized, ranges]:
+            assert h5.attributes(0)["constant"] == 1
+            assert h5.read(0).tolist() == raw.read(0).tolist()
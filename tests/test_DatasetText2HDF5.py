@@ -0,0 +1,57 @@
+import h5py
+import numpy as np
+import pytest
+from Dataset.DatasetConverter import DatasetConverter
+from Dataset.DatasetDB2HDF5 import DatasetDB2HDF5
+from Dataset.DatasetDBNormalizer import DatasetDBNormalizer
+from Dataset.DatasetText2HDF5 import DatasetText2HDF5
+
+__author__ = 'gm'
+
+
+def assert_same_h5(name1, name2):
+    with h5py.File(name1, 'r') as f1, h5py.File(name2, 'r') as f2:
+        assert list(f1.keys()) == list(f2.keys())
+        for name in f1.keys():
+            assert np.array_equal(f1[name][:], f2[name][:])
+
+
+@pytest.mark.usefixtures("cleandir")
+def test(testfiles):
+    dataset = testfiles["data10000"]
+
+    dc = DatasetConverter(dataset, "dataset10000.db")
+    dc.convert()
+    h5conv = DatasetDB2HDF5("dataset10000.db", "db2h5.h5")
+    h5conv.convert()
+    DatasetDBNormalizer.normalize_hdf5("db2h5.h5", "db2h5_normalized.h5")
+
+    conv = DatasetText2HDF5(dataset, "dataset2h5.h5", chunk_size=3000)
+    conv.convert(normalized_hdf5_name="dataset2h5_normalized.h5")
+
+    assert_same_h5("db2h5.h5", "dataset2h5.h5")
+    assert_same_h5("db2h5_normalized.h5", "dataset2h5_normalized.h5")
+    # the statistics of the time series written chunk by chunk
+    with h5py.File("db2h5.h5", 'r') as f1, h5py.File("dataset2h5.h5", 'r') as f2:
+        for name in f1.keys():
+            assert f1[name].attrs["count"] == f2[name].attrs["count"]
+            assert np.isclose(f1[name].attrs["mean"], f2[name].attrs["mean"])
+            assert np.isclose(f1[name].attrs["m2"], f2[name].attrs["m2"], atol=1e-6)
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_range_threshold(testfiles):
+    dataset = testfiles["data10000"]
+    range = ["07/08/2015-00:05:30", "07/08/2015-00:10:00"]
+
+    dc = DatasetConverter(dataset, "dataset10000.db")
+    dc.convert()
+    h5conv = DatasetDB2HDF5("dataset10000.db", "db2h5.h5")
+    h5conv.convert(range=range, compression_level=5, point_threshold="20")
+
+    conv = DatasetText2HDF5(dataset, "dataset2h5.h5")
+    conv.convert(range=range, compression_level=5, point_threshold="20")
+
+    assert_same_h5("db2h5.h5", "dataset2h5.h5")
+    with h5py.File("dataset2h5.h5", 'r') as f:
+        assert 0 < len(f) < 48
@@ -0,0 +1,29 @@
+import numpy as np
+
+from Benchmark.FeedGenerator import FeedGenerator
+from Dataset.DatasetReader import DatasetReader
+import pytest
+
+__author__ = 'gm'
+
+
+@pytest.mark.usefixtures("cleandir")
+def test_feed_generator():
+    FeedGenerator(series=5, tick_rate=0.5, duplicate_rate=0.3, gap_rate=0.05, gap_distribution="pareto",
+                  block_size=300).write("./feed1.txt", 1000)
+    FeedGenerator(series=5, tick_rate=0.5, duplicate_rate=0.3, gap_rate=0.05, gap_distribution="pareto",
+                  block_size=300).write("./feed2.txt", 1000)
+    with open("./feed1.txt", "rb") as f1, open("./feed2.txt", "rb") as f2:
+        assert f1.read() == f2.read()
+
+    reader = DatasetReader("./feed1.txt")
+    reader.open_dataset()
+    chunk = reader.get_next_chunk()
+    assert len(chunk) == 1000
+    assert len(reader.names) == 5
+    for i in range(5):
+        steps = np.diff(chunk.timestamps[chunk.name_ids == i])
+        # the lines of every time-series are in date-time order, some with the same date-time
+        assert (steps >= 0).all()
+        assert (steps == 0).any()
+    reader.close_dataset()
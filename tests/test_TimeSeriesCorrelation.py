@@ -37,18 +37,26 @@ def test_dates(testfiles):
 
 @pytest.mark.usefixtures("cleandir")
 def test_dataset2db(testfiles):
-    args = Args(dataset_file=testfiles["data100"], database_file="./test.db")
+    args = Args(dataset_file=testfiles["data100"], database_file="./test.db", jobs=1, resume=False, append=False)
     dataset2db(args)
 
     assert os.path.exists("./test.db")
 
+    args = Args(dataset_file=testfiles["data100"], database_file="./test_parallel.db", jobs=2, resume=False, append=False)
+    dataset2db(args)
+
+    assert os.path.exists("./test_parallel.db")
+
 
 @pytest.mark.usefixtures("cleandir")
 def test_db2h5(testfiles):
-    args = Args(database_file=testfiles["dataset100"], hdf5_file="./test_hdf.db", compress=None, range=None)
+    args = Args(database_file=testfiles["dataset100"], hdf5_file="./test_hdf.db", compress=None, range=None,
+                threshold=None, jobs=1, layout="series", interval=1, agg="last", codec=None, chunk_size=None,
+                append=False, normalized="./test_hdf_normalized.db")
     db2h5(args)
 
     assert os.path.exists("./test_hdf.db")
+    assert os.path.exists("./test_hdf_normalized.db")
 
 
 @pytest.mark.usefixtures("cleandir")
@@ -59,7 +67,8 @@ def test_calc(testfiles):
 
 @pytest.mark.usefixtures("cleandir")
 def test_h5norm(testfiles):
-    args = Args(h5database=testfiles["h5100"], h5normalized="testh5.db", compress=9)
+    args = Args(h5database=testfiles["h5100"], h5normalized="testh5.db", compress=9, layout="series", codec="lzf",
+                chunk_size=64, read_size=100)
     h5norm(args)
 
     assert os.path.exists("testh5.db")